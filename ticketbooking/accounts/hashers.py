@@ -0,0 +1,24 @@
+"""
+The password hashing policy.
+
+settings.PASSWORD_HASHERS puts the preferred hasher (settings.PASSWORD_HASHER)
+first; the others only verify hashes made under an older policy. Whenever a
+user logs in, Django's ModelBackend checks whether their stored hash was made
+by the preferred hasher at its current cost, and if not saves a new one
+(check_password()'s setter). Changing the algorithm or the cost therefore
+reaches each user at their next login, with no migration and no reset.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the iteration count from
+    settings.PASSWORD_HASH_ITERATIONS (Django's own default when unset). It
+    keeps the pbkdf2_sha256 algorithm name, so existing hashes still verify.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from accounts.hashers import TunedPBKDF2PasswordHasher
+
+USERNAME = 'bench-login'
+PASSWORD = 'correct horse battery staple'
+NO_LIMITS = {name: (10 ** 9, window) for name, (_, window) in settings.LOGIN_RATE_LIMITS.items()}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login throughput on one core for several PBKDF2 costs, and how fast "
+        "rate-limited attempts are turned away."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', default='',
+                            help="Comma-separated PBKDF2 iteration counts (default: the configured one).")
+        parser.add_argument('--seconds', type=float, default=3.0, help="Time spent on each run.")
+
+    def run(self, client, data, seconds):
+        # Logins (or attempts) per second, one after another on this thread
+        done = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            client.post(reverse('login'), data)
+            done += 1
+        return done / (time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        counts = [int(n) for n in options['iterations'].split(',') if n] or [TunedPBKDF2PasswordHasher().iterations]
+        User.objects.filter(username=USERNAME).delete()
+        user = User.objects.create_user(username=USERNAME)
+        client = Client()
+        logging.getLogger('django.request').setLevel(logging.ERROR) # Or every 429 logs a warning
+        good = {'username': USERNAME, 'password': PASSWORD}
+        try:
+            for iterations in counts:
+                with override_settings(PASSWORD_HASH_ITERATIONS=iterations, LOGIN_RATE_LIMITS=NO_LIMITS):
+                    user.set_password(PASSWORD)
+                    user.save(update_fields=['password'])
+                    rate = self.run(client, good, options['seconds'])
+                self.stdout.write(
+                    f"{iterations:>9} iterations: {rate:.1f} logins/s per core ({1000 / rate:.1f}ms each)"
+                )
+
+            # A credential-stuffing burst from one address, with the configured limits
+            cache.clear()
+            bad = {'username': USERNAME, 'password': 'wrong'}
+            limit, _ = settings.LOGIN_RATE_LIMITS['login_ip']
+            for _ in range(limit):
+                client.post(reverse('login'), bad)
+            rate = self.run(client, bad, options['seconds'])
+            self.stdout.write(f"  rate limited: {rate:.1f} rejected attempts/s per core ({1000 / rate:.2f}ms each)")
+        finally:
+            cache.clear()
+            user.delete()
@@ -0,0 +1,194 @@
+"""
+Sliding-window rate limits for logins and registrations.
+
+Checking a password costs a deliberately slow hash (see accounts/hashers.py),
+so a burst of logins, whether credential-stuffing bots or a crowd at an
+on-sale, can tie up every worker. The login and registration views check
+these limits first and turn excess attempts away with a 429 before any
+password is hashed:
+
+* attempts per client IP (logins and registrations counted separately);
+* failed logins per username, however many IPs they come from.
+
+The limits live in settings.LOGIN_RATE_LIMITS as (attempts, window seconds).
+The backend is chosen with settings.RATE_LIMITER, in the same shape as
+CACHES:
+
+    RATE_LIMITER = {
+        'BACKEND': 'accounts.ratelimit.CacheRateLimiter',
+        'OPTIONS': {},
+    }
+
+InMemoryRateLimiter keeps an exact log of recent attempts, but only within one
+process. CacheRateLimiter counts in the default cache, so every worker sharing
+it (e.g. memcached or Redis) shares the limits. It uses the sliding window
+counter approximation: the previous fixed window's count, weighted by how much
+of it is still inside the sliding window, plus the current window's count.
+"""
+import collections
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+
+class BaseRateLimiter:
+    def __init__(self, **options):
+        self.options = options
+
+    def hit(self, key, limit, window):
+        """
+        Count an attempt for `key`. Returns True if it is within `limit`
+        attempts in the last `window` seconds, counting this one.
+        """
+        raise NotImplementedError
+
+    def count(self, key, window):
+        """Attempts for `key` in the last `window` seconds, without counting a new one."""
+        raise NotImplementedError
+
+    def reset(self, key, window):
+        """Forget the attempts for `key`."""
+        raise NotImplementedError
+
+
+class InMemoryRateLimiter(BaseRateLimiter):
+    # Keys not seen for a while are dropped every PRUNE_EVERY attempts
+    PRUNE_EVERY = 1000
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._lock = threading.Lock()
+        self._attempts = {} # key -> (window, deque of attempt times, oldest first)
+        self._hits = 0
+
+    def _recent(self, key, window, now):
+        window, attempts = self._attempts.get(key, (window, collections.deque()))
+        while attempts and attempts[0] <= now - window:
+            attempts.popleft()
+        return attempts
+
+    def _prune(self, now):
+        for key, (window, attempts) in list(self._attempts.items()):
+            if not attempts or attempts[-1] <= now - window:
+                del self._attempts[key]
+
+    def hit(self, key, limit, window):
+        now = time.monotonic()
+        with self._lock:
+            self._hits += 1
+            if self._hits % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            attempts = self._recent(key, window, now)
+            attempts.append(now)
+            # Rejected attempts count too, but only the newest limit + 1 can matter
+            while len(attempts) > limit + 1:
+                attempts.popleft()
+            self._attempts[key] = (window, attempts)
+            return len(attempts) <= limit
+
+    def count(self, key, window):
+        with self._lock:
+            return len(self._recent(key, window, time.monotonic()))
+
+    def reset(self, key, window):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+class CacheRateLimiter(BaseRateLimiter):
+    # Uses wall-clock time (not monotonic) because the counters are shared between processes.
+    prefix = 'ratelimit'
+
+    def _window_key(self, key, window, index):
+        return f'{self.prefix}:{key}:{window}:{index}'
+
+    def _counts(self, key, window, now):
+        index = math.floor(now / window)
+        keys = [self._window_key(key, window, index - 1), self._window_key(key, window, index)]
+        counts = cache.get_many(keys)
+        return keys, counts.get(keys[0], 0), counts.get(keys[1], 0), now / window - index
+
+    def _estimate(self, previous, current, elapsed):
+        return previous * (1 - elapsed) + current
+
+    def hit(self, key, limit, window):
+        keys, previous, current, elapsed = self._counts(key, window, time.time())
+        # Two windows' lifetime: the window after this one still weighs it in
+        if cache.add(keys[1], 1, timeout=2 * window):
+            current = 1
+        else:
+            try:
+                current = cache.incr(keys[1])
+            except ValueError: # Expired in between
+                cache.set(keys[1], 1, timeout=2 * window)
+                current = 1
+        return self._estimate(previous, current, elapsed) <= limit
+
+    def count(self, key, window):
+        _, previous, current, elapsed = self._counts(key, window, time.time())
+        return math.floor(self._estimate(previous, current, elapsed))
+
+    def reset(self, key, window):
+        index = math.floor(time.time() / window)
+        cache.delete_many([self._window_key(key, window, index - 1), self._window_key(key, window, index)])
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter configured in settings.RATE_LIMITER."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                config = getattr(settings, 'RATE_LIMITER', {})
+                backend = import_string(config.get('BACKEND', 'accounts.ratelimit.CacheRateLimiter'))
+                _rate_limiter = backend(**config.get('OPTIONS', {}))
+    return _rate_limiter
+
+
+def client_ip(request):
+    # REMOTE_ADDR, unless a trusted reverse proxy passes the client's address
+    # in a header (settings.RATE_LIMIT_IP_HEADER, e.g. HTTP_X_REAL_IP)
+    header = getattr(settings, 'RATE_LIMIT_IP_HEADER', '')
+    if header and request.META.get(header):
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _key(scope, value):
+    # Hashed, so any username is a safe cache key
+    return f'{scope}:{hashlib.md5(value.encode()).hexdigest()}'
+
+
+def username_key(username):
+    return _key('login_username', username.strip().lower())
+
+
+def allow_attempt(request, scope):
+    """Count an attempt from the request's client IP under `scope`; False if over the limit."""
+    limit, window = settings.LOGIN_RATE_LIMITS[f'{scope}_ip']
+    return get_rate_limiter().hit(_key(f'{scope}_ip', client_ip(request)), limit, window)
+
+
+def username_locked(username):
+    """True if `username` has had too many failed logins recently."""
+    limit, window = settings.LOGIN_RATE_LIMITS['login_username']
+    return get_rate_limiter().count(username_key(username), window) >= limit
+
+
+def login_failed(username):
+    limit, window = settings.LOGIN_RATE_LIMITS['login_username']
+    get_rate_limiter().hit(username_key(username), limit, window)
+
+
+def login_succeeded(username):
+    _, window = settings.LOGIN_RATE_LIMITS['login_username']
+    get_rate_limiter().reset(username_key(username), window)
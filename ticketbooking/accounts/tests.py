@@ -1,3 +1,126 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import identify_hasher
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from . import ratelimit
+
+LIMITS = {'login_ip': (3, 60), 'login_username': (2, 300), 'register_ip': (2, 3600)}
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def check_limiter(self, limiter):
+        self.assertEqual([limiter.hit('k', 3, 60) for _ in range(5)], [True, True, True, False, False])
+        self.assertTrue(limiter.hit('other', 3, 60)) # Keys are counted separately
+        self.assertGreaterEqual(limiter.count('k', 60), 3)
+        limiter.reset('k', 60)
+        self.assertEqual(limiter.count('k', 60), 0)
+        self.assertTrue(limiter.hit('k', 3, 60))
+
+    def test_in_memory(self):
+        self.check_limiter(ratelimit.InMemoryRateLimiter())
+
+    def test_cache(self):
+        self.check_limiter(ratelimit.CacheRateLimiter())
+
+    def test_in_memory_window_slides(self):
+        limiter = ratelimit.InMemoryRateLimiter()
+        with mock.patch.object(ratelimit.time, 'monotonic', return_value=1000.0):
+            self.assertTrue(limiter.hit('k', 1, 60))
+            self.assertFalse(limiter.hit('k', 1, 60))
+        with mock.patch.object(ratelimit.time, 'monotonic', return_value=1061.0):
+            self.assertTrue(limiter.hit('k', 1, 60))
+
+    def test_cache_previous_window_is_weighted(self):
+        limiter = ratelimit.CacheRateLimiter()
+        with mock.patch.object(ratelimit.time, 'time', return_value=6000.0):
+            for _ in range(4):
+                limiter.hit('k', 4, 60)
+        # Three quarters into the next window a quarter of the old one is still counted
+        with mock.patch.object(ratelimit.time, 'time', return_value=6105.0):
+            self.assertEqual(limiter.count('k', 60), 1)
+            self.assertTrue(limiter.hit('k', 4, 60))
+
+
+@override_settings(LOGIN_RATE_LIMITS=LIMITS)
+class LoginRateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear() # Rate limit counters live in the cache
+        self.user = User.objects.create_user(username='fan', password='secret')
+
+    def login(self, password, ip='10.0.0.1', username='fan'):
+        return self.client.post(reverse('login'), {'username': username, 'password': password}, REMOTE_ADDR=ip)
+
+    def test_ip_limit_rejects_before_hashing(self):
+        for _ in range(3):
+            self.login('wrong', username='nobody')
+        with mock.patch('accounts.views.authenticate') as authenticate:
+            response = self.login('secret')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        authenticate.assert_not_called()
+        self.assertEqual(self.login('secret', ip='10.0.0.2').status_code, 302) # Other clients are unaffected
+
+    def test_username_locked_across_ips(self):
+        self.login('wrong', ip='10.0.0.1')
+        self.login('wrong', ip='10.0.0.2')
+        self.assertEqual(self.login('secret', ip='10.0.0.3').status_code, 429)
+        self.assertEqual(self.login('secret', ip='10.0.0.3', username='other').status_code, 200) # Unknown user, not locked
+
+    def test_success_resets_username_failures(self):
+        self.login('wrong', ip='10.0.0.1')
+        self.assertEqual(self.login('secret', ip='10.0.0.2').status_code, 302)
+        self.client.logout()
+        self.login('wrong', ip='10.0.0.3')
+        self.assertEqual(self.login('secret', ip='10.0.0.4').status_code, 302)
+
+    @override_settings(RATE_LIMIT_IP_HEADER='HTTP_X_REAL_IP')
+    def test_ip_from_proxy_header(self):
+        for i in range(3):
+            self.client.post(reverse('login'), {'username': 'nobody', 'password': 'x'},
+                             REMOTE_ADDR=f'10.0.0.{i}', HTTP_X_REAL_IP='192.0.2.7')
+        response = self.client.post(reverse('login'), {'username': 'fan', 'password': 'secret'},
+                                    REMOTE_ADDR='10.0.0.9', HTTP_X_REAL_IP='192.0.2.7')
+        self.assertEqual(response.status_code, 429)
+
+    def test_registration_limited(self):
+        for i in range(2):
+            data = {'username': f'new{i}', 'password': 'pw', 'password2': 'pw'}
+            self.assertEqual(self.client.post(reverse('register'), data).status_code, 302)
+            self.client.logout()
+        data = {'username': 'new2', 'password': 'pw', 'password2': 'pw'}
+        self.assertEqual(self.client.post(reverse('register'), data).status_code, 429)
+        self.assertFalse(User.objects.filter(username='new2').exists())
+
+
+@override_settings(
+    PASSWORD_HASHERS=['accounts.hashers.TunedPBKDF2PasswordHasher'],
+    LOGIN_RATE_LIMITS=LIMITS,
+)
+class PasswordHasherTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def iterations(self, user):
+        user.refresh_from_db()
+        return int(user.password.split('$')[1])
+
+    def test_iterations_from_settings(self):
+        with self.settings(PASSWORD_HASH_ITERATIONS=1000):
+            user = User.objects.create_user(username='fan', password='secret')
+        self.assertEqual(identify_hasher(user.password).algorithm, 'pbkdf2_sha256')
+        self.assertEqual(self.iterations(user), 1000)
+
+    def test_rehashed_on_login_when_cost_changes(self):
+        with self.settings(PASSWORD_HASH_ITERATIONS=1000):
+            user = User.objects.create_user(username='fan', password='secret')
+        with self.settings(PASSWORD_HASH_ITERATIONS=2000):
+            response = self.client.post(reverse('login'), {'username': 'fan', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.iterations(user), 2000)
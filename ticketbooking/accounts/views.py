@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.db import IntegrityError
 from django.shortcuts import render, redirect
 from django.views import View
 from django.contrib.auth.models import User
@@ -6,10 +8,21 @@ from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect # Needed for manual forms
 
+from . import ratelimit
+
 # Note: Django's built-in LoginView and LogoutView handle much of this,
 # but they often expect a Form class. Since we are explicitly avoiding
 # Django Forms, we'll implement the logic manually within a generic View.
 
+
+def too_many_attempts(request, template_name, username, limit_name):
+    # Rate limited (see accounts/ratelimit.py): answered without hashing anything
+    _, window = settings.LOGIN_RATE_LIMITS[limit_name]
+    errors = ["Too many attempts. Please wait a few minutes and try again."]
+    response = render(request, template_name, {'errors': errors, 'username': username}, status=429)
+    response['Retry-After'] = str(window)
+    return response
+
 @method_decorator(csrf_protect, name='dispatch') # Ensure CSRF protection for POST
 class RegisterView(View):
     template_name = 'accounts/register.html'
@@ -22,6 +35,9 @@ class RegisterView(View):
         password = request.POST.get('password')
         password2 = request.POST.get('password2')
 
+        if not ratelimit.allow_attempt(request, 'register'):
+            return too_many_attempts(request, self.template_name, username, 'register_ip')
+
         errors = []
         if not username:
             errors.append("Username is required.")
@@ -41,6 +57,9 @@ class RegisterView(View):
             # Log the user in immediately after registration (optional)
             login(request, user)
             return redirect('home') # Redirect to homepage after successful registration
+        except IntegrityError: # Taken by a concurrent registration since the check above
+            errors.append("Username already exists.")
+            return render(request, self.template_name, {'errors': errors, 'username': username})
         except Exception as e:
             errors.append(f"An error occurred: {e}")
             return render(request, self.template_name, {'errors': errors, 'username': username})
@@ -66,16 +85,25 @@ class LoginView(View):
         if errors:
              return render(request, self.template_name, {'errors': errors, 'username': username})
 
+        # Checked before authenticate(), which always hashes (even for unknown usernames)
+        if not ratelimit.allow_attempt(request, 'login'):
+            return too_many_attempts(request, self.template_name, username, 'login_ip')
+        if ratelimit.username_locked(username):
+            return too_many_attempts(request, self.template_name, username, 'login_username')
+
+        # Also rehashes the password if the hashing policy changed (accounts/hashers.py)
         user = authenticate(request, username=username, password=password)
 
         if user is not None:
             # A user was found, and the password matched
+            ratelimit.login_succeeded(username)
             login(request, user)
             # Redirect to a success page.
             next_url = request.GET.get('next') or reverse('home') # Redirect to 'next' if present, else home
             return redirect(next_url)
         else:
             # No user found or password didn't match
+            ratelimit.login_failed(username)
             errors.append("Invalid username or password.")
             return render(request, self.template_name, {'errors': errors, 'username': username})
 
@@ -0,0 +1,38 @@
+"""
+The cart: shows a user wants to book together, kept in their session as
+show id -> quantity until checkout.
+
+Adding a line only writes the session. Seats are checked and taken for the
+whole cart in one transaction by services.checkout().
+"""
+from .services import MAX_CART_LINES, BookingError
+
+SESSION_KEY = 'cart'
+
+
+def get_lines(session):
+    """The cart as {show id: quantity}."""
+    return {int(show_id): quantity for show_id, quantity in session.get(SESSION_KEY, {}).items()}
+
+
+def save_lines(session, lines):
+    session[SESSION_KEY] = {str(show_id): quantity for show_id, quantity in lines.items()}
+
+
+def add(session, show_id, quantity):
+    """Put `quantity` tickets for a show in the cart, replacing any earlier line for it."""
+    lines = get_lines(session)
+    if show_id not in lines and len(lines) >= MAX_CART_LINES:
+        raise BookingError(f"A cart can hold at most {MAX_CART_LINES} shows.")
+    lines[show_id] = quantity
+    save_lines(session, lines)
+
+
+def remove(session, show_id):
+    lines = get_lines(session)
+    lines.pop(show_id, None)
+    save_lines(session, lines)
+
+
+def clear(session):
+    session.pop(SESSION_KEY, None)
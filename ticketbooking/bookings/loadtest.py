@@ -0,0 +1,286 @@
+"""
+On-sale load test.
+
+Seeds a batch of shows and users, then has a pool of threads send a weighted
+mix of listing, show page, booking and login requests through the full Django
+stack (URLs, middleware, views, templates) with the test client. Every request
+is timed and its SQL queries counted. Afterwards every seeded show is checked
+for overselling and seat-counter drift.
+
+Run it with `manage.py loadtest` (see bookings/management/commands/loadtest.py);
+the report is a plain dict so it can be written to JSON and compared between
+releases with compare().
+"""
+import datetime
+import math
+import random
+import threading
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from shows.models import Show
+from .models import Booking
+
+OPERATIONS = ('list', 'detail', 'book', 'login')
+DEFAULT_MIX = {'list': 4, 'detail': 3, 'book': 2, 'login': 1}
+PASSWORD = 'loadtest-password'
+# Metrics compared by compare(), and whether a higher value is worse
+REGRESSION_METRICS = {'p95_ms': True, 'p99_ms': True, 'throughput': False, 'mean_queries': True}
+
+
+def parse_mix(value):
+    """'list=4,book=1' -> {'list': 4, 'book': 1}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}'. Choose from {', '.join(OPERATIONS)}.")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("At least one operation needs a positive weight.")
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Per-operation latencies, query counts and outcomes, shared by the workers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {op: [] for op in OPERATIONS}
+        self.queries = {op: [] for op in OPERATIONS}
+        self.outcomes = {op: {} for op in OPERATIONS}
+
+    def add(self, op, seconds, queries, outcome):
+        with self.lock:
+            self.samples[op].append(seconds)
+            self.queries[op].append(queries)
+            self.outcomes[op][outcome] = self.outcomes[op].get(outcome, 0) + 1
+
+    def summary(self, elapsed):
+        report = {}
+        for op in OPERATIONS:
+            samples = sorted(self.samples[op])
+            if not samples:
+                continue
+            queries = self.queries[op]
+            report[op] = {
+                'count': len(samples),
+                'throughput': round(len(samples) / elapsed, 2) if elapsed else 0,
+                'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+                'mean_queries': round(sum(queries) / len(queries), 2),
+                'max_queries': max(queries),
+                'outcomes': self.outcomes[op],
+            }
+        return report
+
+
+class LoadTest:
+    def __init__(self, shows=10, users=50, seats=100, workers=8, duration=10.0, requests=None,
+                 mix=None, hot_fraction=0.5, quantity=1, seed=None):
+        self.show_count = shows
+        self.user_count = users
+        self.seats = seats
+        self.workers = workers
+        self.duration = duration
+        self.requests = requests # Requests per worker; overrides duration when set
+        self.mix = mix or DEFAULT_MIX
+        self.hot_fraction = hot_fraction # Share of bookings aimed at the first ("hot") show
+        self.quantity = quantity
+        self.random = random.Random(seed)
+        self.prefix = f'loadtest-{int(time.time() * 1000)}'
+        self.shows = []
+        self.users = []
+
+    # Seeding
+
+    def seed(self):
+        date_time = timezone.now() + datetime.timedelta(days=30)
+        Show.objects.bulk_create([
+            Show(
+                title=f'{self.prefix}-show-{i}',
+                description="Load test show",
+                date_time=date_time,
+                location="Load test",
+                total_seats=self.seats,
+                available_seats=self.seats,
+                price=10,
+            )
+            for i in range(self.show_count)
+        ])
+        self.shows = list(Show.objects.filter(title__startswith=self.prefix).order_by('pk'))
+        password = make_password(PASSWORD) # Hash once; hashing per user would dominate seeding
+        User.objects.bulk_create([
+            User(username=f'{self.prefix}-user-{i}', password=password)
+            for i in range(self.user_count)
+        ])
+        self.users = list(User.objects.filter(username__startswith=self.prefix).order_by('pk'))
+
+    def cleanup(self):
+        # Bookings, holds and sales rollups go with their show and user
+        Show.objects.filter(title__startswith=self.prefix).delete()
+        User.objects.filter(username__startswith=self.prefix).delete()
+
+    # Traffic
+
+    def pick_show(self, rng, hot=False):
+        if hot and rng.random() < self.hot_fraction:
+            return self.shows[0]
+        return rng.choice(self.shows)
+
+    def request(self, op, client, anonymous, rng):
+        """Send one request and return a short outcome label."""
+        if op == 'list':
+            response = client.get(reverse('show_list'))
+            return str(response.status_code)
+        if op == 'detail':
+            response = client.get(reverse('show_detail', kwargs={'pk': self.pick_show(rng).pk}))
+            return str(response.status_code)
+        if op == 'book':
+            show = self.pick_show(rng, hot=True)
+            response = client.post(reverse('show_detail', kwargs={'pk': show.pk}), {'quantity': self.quantity})
+            if response.status_code == 302 and response['Location'] == reverse('booking_confirmation'):
+                return 'booked'
+            if response.status_code == 302:
+                return 'rejected' # Sold out or invalid, sent back to the show page
+            return str(response.status_code)
+        user = rng.choice(self.users)
+        response = anonymous.post(reverse('login'), {'username': user.username, 'password': PASSWORD})
+        anonymous.logout()
+        return 'ok' if response.status_code == 302 else str(response.status_code)
+
+    def worker(self, index, recorder, barrier, deadline_box):
+        rng = random.Random(self.random.random())
+        ops, weights = zip(*self.mix.items())
+        client = Client()
+        client.force_login(self.users[index % len(self.users)])
+        anonymous = Client()
+        barrier.wait()
+        sent = 0
+        try:
+            while True:
+                if self.requests is not None:
+                    if sent >= self.requests:
+                        break
+                elif time.perf_counter() >= deadline_box[0]:
+                    break
+                op = rng.choices(ops, weights)[0]
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    try:
+                        outcome = self.request(op, client, anonymous, rng)
+                    except Exception as e:
+                        outcome = f'error:{type(e).__name__}'
+                    elapsed = time.perf_counter() - started
+                recorder.add(op, elapsed, len(queries), outcome)
+                sent += 1
+        finally:
+            connections.close_all()
+
+    # Checks
+
+    def integrity(self):
+        sold = dict(
+            Booking.objects.filter(show__in=self.shows)
+            .values_list('show').annotate(total=Sum('quantity'))
+        )
+        oversold = drift = 0
+        for show in Show.objects.filter(pk__in=[s.pk for s in self.shows]):
+            show_sold = sold.get(show.pk, 0)
+            oversold += max(show_sold - show.total_seats, 0)
+            drift += abs((show.total_seats - show_sold) - show.available_seats)
+        return {
+            'seats_sold': sum(sold.values()),
+            'seats_total': self.seats * len(self.shows),
+            'oversold': oversold,
+            'counter_drift': drift,
+        }
+
+    def run(self):
+        self.seed()
+        try:
+            recorder = Recorder()
+            # The start time is set once every worker is ready, so client
+            # setup and logins are not counted against the run.
+            deadline_box = [None]
+            barrier = threading.Barrier(self.workers + 1)
+            threads = [
+                threading.Thread(target=self.worker, args=(i, recorder, barrier, deadline_box))
+                for i in range(self.workers)
+            ]
+            for t in threads:
+                t.start()
+            started = time.perf_counter()
+            deadline_box[0] = started + self.duration
+            barrier.wait()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+
+            operations = recorder.summary(elapsed)
+            total = sum(op['count'] for op in operations.values())
+            return {
+                'started_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'config': {
+                    'shows': self.show_count,
+                    'users': self.user_count,
+                    'seats': self.seats,
+                    'workers': self.workers,
+                    'duration': self.duration,
+                    'requests': self.requests,
+                    'mix': self.mix,
+                    'hot_fraction': self.hot_fraction,
+                    'quantity': self.quantity,
+                },
+                'elapsed_seconds': round(elapsed, 3),
+                'total_requests': total,
+                'throughput': round(total / elapsed, 2) if elapsed else 0,
+                'operations': operations,
+                'integrity': self.integrity(),
+            }
+        finally:
+            self.cleanup()
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    List the metrics in `report` that are more than `tolerance` (a fraction)
+    worse than in `baseline`, plus any oversell or counter drift.
+    """
+    regressions = []
+    for op, current in report['operations'].items():
+        previous = baseline.get('operations', {}).get(op)
+        if not previous:
+            continue
+        for metric, higher_is_worse in REGRESSION_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"{op}.{metric}: {old} -> {new} ({change:+.0%})")
+    for check in ('oversold', 'counter_drift'):
+        if report['integrity'][check]:
+            regressions.append(f"integrity.{check}: {report['integrity'][check]}")
+    return regressions
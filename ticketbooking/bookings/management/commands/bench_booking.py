@@ -0,0 +1,138 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+from shows.models import Show, SeatShard
+from shows import shards
+from bookings.models import Booking
+from bookings.services import book_seats, BookingError
+
+
+def legacy_book(user, show, quantity):
+    # The read-check-write sequence ShowDetailView.post used before the booking
+    # service existed. Kept here only so the benchmark has something to compare against.
+    show.refresh_from_db()
+    if quantity > show.available_seats:
+        return False
+    Booking.objects.create(
+        user=user,
+        show=show,
+        quantity=quantity,
+        total_price=quantity * show.price,
+        booking_time=timezone.now(),
+    )
+    show.available_seats -= quantity
+    show.save()
+    return True
+
+
+def atomic_book(user, show, quantity):
+    try:
+        book_seats(user, show, quantity)
+        return True
+    except BookingError:
+        return False
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent bookings on a single hot show: the legacy path, the booking service, "
+        "and the booking service with the show's seats split over 1, 2, 4... seat shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=50, help="Booking attempts per thread.")
+        parser.add_argument('--seats', type=int, default=200, help="Seats on the hot show.")
+        parser.add_argument('--quantity', type=int, default=1, help="Tickets per booking.")
+        parser.add_argument('--mode', choices=['legacy', 'atomic', 'both', 'sharded'], default='both')
+        parser.add_argument('--shards', default='1,2,4,8,16',
+                            help="Comma-separated seat shard counts to try with --mode sharded.")
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'sharded':
+            runs = [('sharded', int(count)) for count in options['shards'].split(',')]
+        else:
+            runs = [(mode, 0) for mode in (['legacy', 'atomic'] if options['mode'] == 'both' else [options['mode']])]
+        for mode, seat_shards in runs:
+            result = self.run_mode(mode, options, seat_shards)
+            label = f"K={seat_shards}" if mode == 'sharded' else mode
+            self.stdout.write(
+                f"{label:>7}: {result['booked']} bookings in {result['elapsed']:.2f}s "
+                f"({result['throughput']:.1f}/s), errors={result['errors']}, "
+                f"sold={result['sold']}/{options['seats']}, oversold={result['oversold']}, "
+                f"counter_drift={result['drift']}"
+                + (f", lowest_shard={result['lowest_shard']}" if mode == 'sharded' else '')
+            )
+
+    def run_mode(self, mode, options, seat_shards=0):
+        book = legacy_book if mode == 'legacy' else atomic_book
+        quantity = options['quantity']
+        show = Show.objects.create(
+            title=f"bench-{mode}-{int(time.time())}",
+            description="Benchmark show",
+            date_time=timezone.now(),
+            location="Benchmark",
+            total_seats=options['seats'],
+            available_seats=options['seats'],
+            price=10,
+        )
+        if seat_shards:
+            shards.set_shards(show, seat_shards)
+        users = [
+            User.objects.create(username=f"bench-{mode}-{show.pk}-{i}")
+            for i in range(options['threads'])
+        ]
+        counts = {'booked': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options['threads'])
+
+        def worker(user):
+            # Every thread works on its own copy of the show, like separate requests would.
+            local_show = Show.objects.get(pk=show.pk)
+            booked = errors = 0
+            start_barrier.wait()
+            try:
+                for _ in range(options['attempts']):
+                    try:
+                        if book(user, local_show, quantity):
+                            booked += 1
+                    except Exception:
+                        errors += 1
+            finally:
+                connection.close()
+            with lock:
+                counts['booked'] += booked
+                counts['errors'] += errors
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        show.refresh_from_db()
+        sold = Booking.objects.filter(show=show).aggregate(total=Sum('quantity'))['total'] or 0
+        remaining = shards.available_seats(show)
+        result = {
+            'booked': counts['booked'],
+            'errors': counts['errors'],
+            'elapsed': elapsed,
+            'throughput': counts['booked'] / elapsed if elapsed else 0,
+            'sold': sold,
+            'oversold': max(sold - show.total_seats, 0),
+            'drift': (show.total_seats - sold) - remaining,
+            'lowest_shard': SeatShard.objects.filter(show=show).aggregate(lowest=Min('available_seats'))['lowest'],
+        }
+
+        # Clean up so the benchmark can be run against a real database.
+        show.delete()
+        User.objects.filter(pk__in=[u.pk for u in users]).delete()
+        return result
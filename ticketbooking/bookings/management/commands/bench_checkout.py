@@ -0,0 +1,84 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from shows.models import Show
+from bookings.services import book_seats, checkout
+
+MARKER = 'benchcheckout' # In every seeded title, so cleanup finds them
+
+
+class Command(BaseCommand):
+    help = "Compare booking N shows one at a time with booking them in one cart checkout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=20, help="Shows per cart.")
+        parser.add_argument('--rounds', type=int, default=20, help="Carts booked each way.")
+        parser.add_argument('--quantity', type=int, default=2, help="Tickets per show.")
+
+    def measure(self, rounds, run):
+        # Median time and queries of one round
+        timings, queries = [], []
+        for _ in range(rounds):
+            reset_queries() # The query log only keeps the last 9000
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - started)
+            queries.append(len(captured.captured_queries))
+        timings.sort()
+        queries.sort()
+        return timings[len(timings) // 2], queries[len(queries) // 2]
+
+    def handle(self, *args, **options):
+        lines, rounds, quantity = options['lines'], options['rounds'], options['quantity']
+        seats = rounds * quantity * 4 # Enough for every run below
+        shows = [
+            Show.objects.create(
+                title=f"{MARKER}-{i}",
+                description="Benchmark show",
+                date_time=timezone.now() + timezone.timedelta(days=30),
+                location="Benchmark",
+                total_seats=seats,
+                available_seats=seats,
+                price=10,
+            )
+            for i in range(lines)
+        ]
+        user = User.objects.create(username=f"{MARKER}-{int(time.time())}")
+        client = Client()
+        client.force_login(user)
+        cart = {show.pk: quantity for show in shows}
+
+        def single_requests():
+            # One POST/redirect cycle per show, as ShowDetailView.post books them
+            for show in shows:
+                client.post(reverse('show_detail', kwargs={'pk': show.pk}), {'quantity': quantity})
+                client.get(reverse('booking_confirmation'))
+
+        def cart_requests():
+            # Filling the cart only writes the session; one POST then books it all
+            for show in shows:
+                client.post(reverse('show_cart_add', kwargs={'pk': show.pk}), {'quantity': quantity})
+            client.post(reverse('cart'))
+            client.get(reverse('booking_confirmation'))
+
+        runs = {
+            f"{lines} x book_seats": lambda: [book_seats(user, show, quantity) for show in shows],
+            f"checkout, {lines} lines": lambda: checkout(user, cart),
+            f"{lines} booking requests": single_requests,
+            f"cart, {lines} lines": cart_requests,
+        }
+        try:
+            for label, run in runs.items():
+                elapsed, queries = self.measure(rounds, run)
+                self.stdout.write(f"{label:>22}: p50={elapsed * 1000:.1f}ms, {queries} queries")
+        finally:
+            Show.objects.filter(title__startswith=MARKER).delete()
+            user.delete()
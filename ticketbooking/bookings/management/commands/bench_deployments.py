@@ -0,0 +1,273 @@
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from bookings.loadtest import LoadTest, percentile
+
+
+def add_db_latency(seconds):
+    # Every query on every new connection sleeps first, to stand in for the
+    # network round trip to MySQL that a local SQLite file does not have.
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def on_connect(sender, connection, **kwargs):
+        connection.execute_wrappers.append(wrapper)
+
+    connection_created.connect(on_connect, weak=False)
+
+
+def login_cookies(user):
+    # Session and CSRF cookies for `user`, so requests can be sent straight
+    # to the WSGI/ASGI handlers like a browser would
+    client = Client()
+    client.force_login(user)
+    token = get_random_string(32)
+    return f"sessionid={client.cookies['sessionid'].value}; csrftoken={token}", token
+
+
+def wsgi_request(app, method, path, body, cookies, token):
+    environ = {
+        'REQUEST_METHOD': method.upper(),
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookies,
+        'HTTP_X_CSRFTOKEN': token,
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    response = app(environ, lambda s, headers, exc_info=None: status.append(int(s.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0]
+
+
+async def asgi_request(app, method, path, body, cookies, token):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method.upper(),
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [
+            (b'host', b'testserver'),
+            (b'cookie', cookies.encode()),
+            (b'x-csrftoken', token.encode()),
+            (b'content-type', b'application/x-www-form-urlencoded'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    done = asyncio.Event()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await done.wait() # Django listens for a disconnect until the response is sent
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many concurrent requests the WSGI (sync views, fixed thread pool) and ASGI "
+        "(async views, one event loop) deployments sustain on browsing and booking traffic. "
+        "Requests go straight to Django's WSGI and ASGI handlers, without a network server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='10,50,200', help="Comma-separated client counts to try.")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per concurrency level.")
+        parser.add_argument('--wsgi-threads', type=int, default=8,
+                            help="Request threads of the WSGI deployment (e.g. gunicorn --threads).")
+        parser.add_argument('--db-latency-ms', type=float, default=2.0,
+                            help="Artificial delay added to every query, to mimic a networked database.")
+        parser.add_argument('--shows', type=int, default=20)
+        parser.add_argument('--seats', type=int, default=100000)
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--deployment', choices=['wsgi', 'asgi'], help="Run only one side, in this process.")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError("--concurrency takes comma-separated integers.")
+
+        if options['deployment']:
+            # Child process: print the results for one deployment as JSON
+            self.stdout.write(json.dumps(self.run_deployment(options['deployment'], levels, options)))
+            return
+
+        report = {'config': {k: options[k] for k in (
+            'concurrency', 'duration', 'wsgi_threads', 'db_latency_ms', 'shows', 'seats',
+        )}}
+        for deployment in ('wsgi', 'asgi'):
+            report[deployment] = self.spawn(deployment, options)
+        for deployment in ('wsgi', 'asgi'):
+            for level in report[deployment]:
+                self.stdout.write(
+                    f"{deployment} c={level['concurrency']:>4}: {level['throughput']:7.1f} req/s "
+                    f"p50={level['p50_ms']:.0f}ms p95={level['p95_ms']:.0f}ms p99={level['p99_ms']:.0f}ms "
+                    f"errors={level['errors']}"
+                )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def spawn(self, deployment, options):
+        # Each deployment gets its own process, so the URLconf is built with the
+        # right views (settings.ASYNC_VIEWS) exactly as it would be in production.
+        env = dict(os.environ, ASYNC_VIEWS='True' if deployment == 'asgi' else 'False')
+        command = [
+            sys.executable, sys.argv[0], 'bench_deployments', '--deployment', deployment,
+            '--concurrency', options['concurrency'], '--duration', str(options['duration']),
+            '--wsgi-threads', str(options['wsgi_threads']), '--db-latency-ms', str(options['db_latency_ms']),
+            '--shows', str(options['shows']), '--seats', str(options['seats']),
+        ]
+        if options.get('settings'):
+            command.append(f"--settings={options['settings']}")
+        result = subprocess.run(command, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"{deployment} run failed:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def run_deployment(self, deployment, levels, options):
+        if options['db_latency_ms']:
+            add_db_latency(options['db_latency_ms'] / 1000)
+        users = max(levels)
+        load = LoadTest(shows=options['shows'], users=users, seats=options['seats'])
+        load.seed()
+        try:
+            run = self.run_wsgi if deployment == 'wsgi' else self.run_asgi
+            return [run(load, level, options) for level in levels]
+        finally:
+            load.cleanup()
+
+    def requests_for(self, load, rng):
+        # Mostly browsing, some bookings: (method, url, data)
+        show = rng.choice(load.shows)
+        choice = rng.random()
+        if choice < 0.45:
+            return 'get', reverse('show_list'), b''
+        if choice < 0.8:
+            return 'get', reverse('show_detail', kwargs={'pk': show.pk}), b''
+        if choice < 0.9:
+            return 'get', reverse('booking_history'), b''
+        return 'post', reverse('show_detail', kwargs={'pk': show.pk}), b'quantity=1'
+
+    def summarize(self, level, latencies, errors, elapsed):
+        latencies.sort()
+        return {
+            'concurrency': level,
+            'requests': len(latencies),
+            'errors': errors,
+            'throughput': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        }
+
+    def run_wsgi(self, load, level, options):
+        # `level` clients, but only --wsgi-threads requests in flight at once;
+        # the rest wait as they would in the server's accept queue.
+        app = get_wsgi_application()
+        pool = threading.Semaphore(options['wsgi_threads'])
+        latencies, errors, lock = [], [0], threading.Lock()
+        logins = [login_cookies(user) for user in load.users[:level]]
+        barrier = threading.Barrier(level + 1)
+        deadline = [0]
+
+        def client_loop(index):
+            rng = random.Random(index)
+            cookies, token = logins[index]
+            barrier.wait()
+            while time.perf_counter() < deadline[0]:
+                method, url, body = self.requests_for(load, rng)
+                started = time.perf_counter()
+                with pool:
+                    status = wsgi_request(app, method, url, body, cookies, token)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += status >= 400
+
+        threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(level)]
+        for t in threads:
+            t.start()
+        deadline[0] = time.perf_counter() + options['duration']
+        started = time.perf_counter()
+        barrier.wait()
+        for t in threads:
+            t.join()
+        return self.summarize(level, latencies, errors[0], time.perf_counter() - started)
+
+    def run_asgi(self, load, level, options):
+        app = get_asgi_application()
+        logins = [login_cookies(user) for user in load.users[:level]]
+
+        async def main():
+            latencies, errors = [], [0]
+            deadline = time.perf_counter() + options['duration']
+
+            async def client_loop(index):
+                rng = random.Random(index)
+                cookies, token = logins[index]
+                while time.perf_counter() < deadline:
+                    method, url, body = self.requests_for(load, rng)
+                    started = time.perf_counter()
+                    status = await asgi_request(app, method, url, body, cookies, token)
+                    latencies.append(time.perf_counter() - started)
+                    errors[0] += status >= 400
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client_loop(i) for i in range(level)))
+            return self.summarize(level, latencies, errors[0], time.perf_counter() - started)
+
+        return asyncio.run(main())
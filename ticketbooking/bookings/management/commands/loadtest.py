@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.loadtest import LoadTest, DEFAULT_MIX, parse_mix, compare
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test listing, show page, booking and login traffic with a thread pool. "
+        "Seeds its own shows and users and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shows', type=int, default=10)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--seats', type=int, default=100, help="Seats per show.")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent client threads.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run for.")
+        parser.add_argument('--requests', type=int, help="Requests per worker (instead of --duration).")
+        parser.add_argument('--mix', default=','.join(f'{op}={w}' for op, w in DEFAULT_MIX.items()),
+                            help="Relative weight of each operation, e.g. list=4,detail=3,book=2,login=1.")
+        parser.add_argument('--hot-fraction', type=float, default=0.5,
+                            help="Share of bookings aimed at a single hot show.")
+        parser.add_argument('--quantity', type=int, default=1, help="Tickets per booking.")
+        parser.add_argument('--seed', type=int, help="Random seed for a repeatable request sequence.")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--baseline', help="Earlier JSON report to compare against.")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Allowed slowdown against the baseline, as a fraction (default 0.2).")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['shows'] < 1 or options['users'] < 1 or options['workers'] < 1:
+            raise CommandError("--shows, --users and --workers must be at least 1.")
+
+        report = LoadTest(
+            shows=options['shows'],
+            users=options['users'],
+            seats=options['seats'],
+            workers=options['workers'],
+            duration=options['duration'],
+            requests=options['requests'],
+            mix=mix,
+            hot_fraction=options['hot_fraction'],
+            quantity=options['quantity'],
+            seed=options['seed'],
+        ).run()
+
+        self.stdout.write(
+            f"{report['total_requests']} requests in {report['elapsed_seconds']:.2f}s "
+            f"({report['throughput']:.1f}/s) on {report['database']}"
+        )
+        for op, stats in report['operations'].items():
+            self.stdout.write(
+                f"{op:>7}: n={stats['count']} {stats['throughput']:.1f}/s "
+                f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                f"queries={stats['mean_queries']:.1f} (max {stats['max_queries']}) {stats['outcomes']}"
+            )
+        integrity = report['integrity']
+        self.stdout.write(
+            f"sold={integrity['seats_sold']}/{integrity['seats_total']} "
+            f"oversold={integrity['oversold']} counter_drift={integrity['counter_drift']}"
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        regressions = []
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = compare(report, json.load(f), options['tolerance'])
+        elif integrity['oversold'] or integrity['counter_drift']:
+            regressions = compare(report, {}, options['tolerance'])
+        if regressions:
+            for line in regressions:
+                self.stderr.write(f"REGRESSION {line}")
+            raise CommandError(f"{len(regressions)} regression(s) found.")
+        self.stdout.write(self.style.SUCCESS("No regressions."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from bookings.services import purge_idempotency_keys, IDEMPOTENCY_PURGE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Delete expired booking idempotency keys, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=IDEMPOTENCY_PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            deleted = purge_idempotency_keys(batch_size=options['batch_size'])
+            total += deleted
+            if deleted < options['batch_size']:
+                break
+        self.stdout.write(f"Deleted {total} expired idempotency keys.")
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from bookings.services import sweep_expired_holds, HOLD_SWEEP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Return the seats of expired holds to their shows, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=HOLD_SWEEP_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping until interrupted.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between sweeps with --loop.")
+
+    def sweep(self, batch_size):
+        total = 0
+        while True:
+            expired = sweep_expired_holds(batch_size=batch_size)
+            total += expired
+            if expired < batch_size:
+                return total
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            total = self.sweep(options['batch_size'])
+            self.stdout.write(f"Expired {total} holds.")
+            return
+
+        try:
+            while True:
+                close_old_connections()
+                total = self.sweep(options['batch_size'])
+                if total:
+                    self.stdout.write(f"Expired {total} holds.")
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
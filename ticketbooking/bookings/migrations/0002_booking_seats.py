@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='seats',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 19:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0004_idempotency_keys'),
+        ('shows', '0004_indexes_and_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-booking_time', '-id'], name='bookings_bo_user_id_49e364_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['-booking_time', '-id'], name='bookings_bo_booking_233fa0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['show', 'booking_time'], name='bookings_bo_show_id_5b072f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seathold',
+            index=models.Index(fields=['created_at'], name='bookings_se_created_7f2d05_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.CheckConstraint(condition=models.Q(('quantity__gt', 0)), name='booking_quantity_positive'),
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.CheckConstraint(condition=models.Q(('total_price__gte', 0)), name='booking_total_price_non_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='seathold',
+            constraint=models.CheckConstraint(condition=models.Q(('quantity__gt', 0)), name='seathold_quantity_positive'),
+        ),
+    ]
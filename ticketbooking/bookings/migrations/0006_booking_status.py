@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 19:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_indexes_and_constraints'),
+        ('shows', '0006_seat_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='cancelled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='status',
+            field=models.CharField(choices=[('confirmed', 'Confirmed'), ('cancelled', 'Cancelled')], default='confirmed', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', 'status', '-booking_time', '-id'], name='bookings_bo_user_id_15aaad_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='booking',
+            name='bookings_bo_user_id_49e364_idx',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_booking_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='cart_bookings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
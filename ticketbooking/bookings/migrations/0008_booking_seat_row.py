@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-18 20:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def parse_label(label):
+    # "<section> Row <row label>, Seat(s) <first>[-<last>]" -> (row name, start, quantity)
+    row_name, _, seats = label.rpartition(', Seat')
+    first, _, last = seats.lstrip('s ').partition('-')
+    return row_name, int(first) - 1, int(last or first) - int(first) + 1
+
+
+def locate_booked_seats(apps, schema_editor):
+    # Bookings made so far only have the seat label; find their row from it,
+    # once per show. A name that matches no row, or several (a section name
+    # used twice), is left unset rather than guessed.
+    Booking = apps.get_model('bookings', 'Booking')
+    SeatRow = apps.get_model('shows', 'SeatRow')
+    bookings = Booking.objects.filter(status='confirmed', seat_row__isnull=True).exclude(seats='').order_by('show_id', 'id')
+    rows, show_id = {}, None
+    for booking in bookings.only('id', 'show_id', 'seats').iterator(chunk_size=1000):
+        if booking.show_id != show_id:
+            show_id, rows = booking.show_id, {}
+            for row in SeatRow.objects.filter(section__show=show_id).values('id', 'label', 'section__name'):
+                rows.setdefault(f"{row['section__name']} Row {row['label']}", []).append(row['id'])
+        try:
+            row_name, start, _ = parse_label(booking.seats)
+        except ValueError:
+            continue
+        matches = rows.get(row_name, [])
+        if len(matches) == 1:
+            Booking.objects.filter(pk=booking.pk).update(seat_row=matches[0], seat_start=start)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_idempotency_cart_bookings'),
+        ('shows', '0006_seat_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='seat_row',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='shows.seatrow'),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='seat_start',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(locate_booked_seats, migrations.RunPython.noop),
+    ]
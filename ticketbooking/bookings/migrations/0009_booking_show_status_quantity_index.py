@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 20:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_booking_seat_row'),
+        ('shows', '0006_seat_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['show', 'status', 'quantity'], name='bookings_bo_show_id_47ab3a_idx'),
+        ),
+    ]
@@ -1,17 +1,117 @@
 from django.db import models
 from django.contrib.auth.models import User
-from shows.models import Show # Import Show model
+from shows.models import Show, SeatRow # Import Show model
 from django.utils import timezone
 
 class Booking(models.Model):
+    # Cancelling a booking keeps the row (for the sales history and exports)
+    # and gives its seats back, see services.cancel_booking() and cancel_show().
+    CONFIRMED = 'confirmed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (CONFIRMED, 'Confirmed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
     show = models.ForeignKey(Show, on_delete=models.CASCADE, related_name='bookings')
     quantity = models.PositiveIntegerField()
     booking_time = models.DateTimeField(default=timezone.now) # Use timezone.now()
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    seats = models.CharField(max_length=255, blank=True, default='') # Assigned seats, empty for general admission
+    # Where the assigned seats are, so cancelling frees exactly those bits.
+    # Cleared if the show's seat map is rebuilt.
+    seat_row = models.ForeignKey(SeatRow, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    seat_start = models.PositiveIntegerField(null=True, blank=True) # 0-based index of the first seat in seat_row
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=CONFIRMED)
+    cancelled_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Booking for {self.show.title} by {self.user.username} ({self.quantity} tickets)"
 
+    @property
+    def is_cancelled(self):
+        return self.status == self.CANCELLED
+
+    class Meta:
+        ordering = ['-booking_time'] # Order by newest booking first
+        indexes = [
+            models.Index(fields=['user', 'status', '-booking_time', '-id']), # Booking history pages (confirmed bookings only)
+            models.Index(fields=['-booking_time', '-id']), # Admin booking list pages, export date range
+            models.Index(fields=['show', 'booking_time']), # Per-show export, delete guard, rollup rebuild
+            models.Index(fields=['show', 'status', 'quantity']), # Seat reconciliation totals, read from the index alone
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(quantity__gt=0), name='booking_quantity_positive'),
+            models.CheckConstraint(condition=models.Q(total_price__gte=0), name='booking_total_price_non_negative'),
+        ]
+
+
+class SeatHold(models.Model):
+    # A short-lived reservation of seats. Placing a hold takes the seats from
+    # Show.available_seats straight away; confirming it turns it into a Booking,
+    # and the sweep_holds command hands expired holds' seats back in batches.
+    ACTIVE = 'active'
+    CONFIRMED = 'confirmed'
+    EXPIRED = 'expired'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (CONFIRMED, 'Confirmed'),
+        (EXPIRED, 'Expired'),
+        (RELEASED, 'Released'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='seat_holds')
+    show = models.ForeignKey(Show, on_delete=models.CASCADE, related_name='seat_holds')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    booking = models.OneToOneField(Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name='hold')
+
+    def __str__(self):
+        return f"Hold of {self.quantity} for {self.show.title} by {self.user.username} ({self.status})"
+
+    @property
+    def is_live(self):
+        return self.status == self.ACTIVE and self.expires_at > timezone.now()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']), # Sweeper scan
+            models.Index(fields=['created_at']), # Dashboard hold metrics window
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(quantity__gt=0), name='seathold_quantity_positive'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    # The first outcome of a booking or hold submission that carried an
+    # idempotency key, so a double-click or client retry with the same key gets
+    # the same result back instead of booking twice. Exactly one of booking,
+    # hold or error is set; a checkout also stores the ids of all the bookings
+    # it made in cart_bookings (booking is the first of them). Rows past
+    # expires_at are removed by the purge_idempotency_keys command.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    cart_bookings = models.JSONField(null=True, blank=True) # Booking ids in show id order
+    hold = models.ForeignKey(SeatHold, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    error = models.CharField(max_length=255, blank=True, default='')
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.user_id}"
+
     class Meta:
-        ordering = ['-booking_time'] # Order by newest booking first
\ No newline at end of file
+        constraints = [
+            # Also what serialises concurrent duplicates: the second insert of
+            # a key waits on the first one's row until it commits.
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_user_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']), # Purge scan
+        ]
@@ -0,0 +1,124 @@
+"""
+Seat inventory reconciliation.
+
+A show's unreserved seats are a counter (Show.available_seats, or the total
+of its SeatShard rows when its seats are sharded, see shows/shards.py) that
+every booking, hold and release moves. It should always equal
+
+    total_seats - SUM(quantity of confirmed Bookings) - SUM(quantity of active SeatHolds)
+
+(an expired hold still counts until the sweeper returns its seats). A bug or
+a hand edit in the database can make the two disagree. The reconcile_seats
+command finds such "drift" a chunk of shows at a time, and can repair it.
+
+find_drift() reads a chunk with one transaction: the shows' counters, then
+their booked, held and shard totals, each one GROUP BY show over the chunk's
+show-id range (a range scan of the show indexes, which the
+(show, status, quantity) index on bookings covers), rather than a correlated
+subquery per show. Under MySQL's REPEATABLE READ the reads share one snapshot,
+so a booking committed meanwhile is counted on both sides or on neither, and
+nothing is locked. Correct bookings never change the drift, as they move both
+sides by the same amount. (Under READ COMMITTED such a booking can show up as
+drift in the report; repair() recomputes under the locks and leaves it alone.)
+
+repair() locks only the drifted shows (show rows in id order, then their
+shards, the order every booking takes them in), recomputes them under the
+locks and sets the counters with one UPDATE, plus one per sharded show.
+Bookings for other shows carry on throughout. A show with more seats booked
+than it has is set to 0 and reported as oversold.
+"""
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Case, Sum, Value, When
+
+from shows.models import Show, SeatShard
+from shows import catalogue
+from shows import shards
+from .models import Booking, SeatHold
+
+# Shows checked per statement by reconcile_seats.
+RECONCILE_CHUNK_SIZE = 1000
+
+
+@dataclass
+class Drift:
+    show_id: int
+    recorded: int # The counter as stored
+    expected: int # total_seats - booked - held
+    booked: int
+    held: int
+
+    @property
+    def oversold(self):
+        return self.expected < 0
+
+    def __str__(self):
+        return (
+            f"Show {self.show_id}: {self.recorded} seats recorded, {self.expected} expected "
+            f"({self.booked} booked, {self.held} held)" + (" OVERSOLD" if self.oversold else "")
+        )
+
+
+def _per_show(queryset, column, show_ids):
+    # {show id: SUM(column)} over the range of show_ids, one grouped statement
+    low, high = min(show_ids), max(show_ids)
+    totals = queryset.filter(show_id__gte=low, show_id__lte=high).order_by().values('show').annotate(total=Sum(column))
+    return dict(totals.values_list('show', 'total'))
+
+
+def _counts(show_ids):
+    shows = list(Show.objects.filter(pk__in=show_ids).order_by('pk').values_list('pk', 'total_seats', 'available_seats', 'seat_shards'))
+    if not shows:
+        return []
+    ids = [pk for pk, *_ in shows]
+    booked = _per_show(Booking.objects.filter(status=Booking.CONFIRMED), 'quantity', ids)
+    held = _per_show(SeatHold.objects.filter(status=SeatHold.ACTIVE), 'quantity', ids)
+    sharded = [pk for pk, _, _, seat_shards in shows if seat_shards]
+    shard_seats = _per_show(SeatShard.objects.all(), 'available_seats', sharded) if sharded else {}
+    return [
+        (pk, total_seats, available_seats, seat_shards, booked.get(pk, 0), held.get(pk, 0), shard_seats.get(pk, 0))
+        for pk, total_seats, available_seats, seat_shards in shows
+    ]
+
+
+def find_drift(show_ids):
+    """The shows among `show_ids` whose seat counter is wrong, as Drift objects in id order."""
+    drift = []
+    with transaction.atomic(): # One snapshot for all the reads
+        counts = _counts(show_ids)
+    for pk, total_seats, available_seats, seat_shards, booked, held, shard_seats in counts:
+        recorded = shard_seats if seat_shards else available_seats
+        expected = total_seats - booked - held
+        if recorded != expected:
+            drift.append(Drift(pk, recorded, expected, booked, held))
+    return drift
+
+
+def repair(show_ids):
+    """
+    Correct the seat counters of the given shows (normally those find_drift()
+    reported). Safe while bookings are being made. Returns the Drift objects
+    of the shows that were still wrong under the locks, i.e. the ones changed.
+    """
+    with transaction.atomic():
+        locked = list(Show.objects.select_for_update().filter(pk__in=show_ids).order_by('pk').values_list('pk', 'seat_shards'))
+        sharded = {pk for pk, seat_shards in locked if seat_shards}
+        if sharded:
+            list(SeatShard.objects.select_for_update().filter(show_id__in=sharded).order_by('show', 'shard').values_list('pk'))
+        drift = find_drift([pk for pk, _ in locked])
+        if not drift:
+            return drift
+
+        unsharded = {d.show_id: max(d.expected, 0) for d in drift if d.show_id not in sharded}
+        if unsharded:
+            Show.objects.filter(pk__in=unsharded).update(available_seats=Case(
+                *[When(pk=pk, then=Value(seats)) for pk, seats in unsharded.items()],
+            ))
+        resharded = [d for d in drift if d.show_id in sharded]
+        for d in resharded:
+            shards.adjust(Show(pk=d.show_id), max(d.expected, 0) - d.recorded)
+        if resharded:
+            shards.sync_available_seats([d.show_id for d in resharded])
+        catalogue.seats_changed([d.show_id for d in drift])
+    return drift
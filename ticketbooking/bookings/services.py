@@ -0,0 +1,565 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, OperationalError, IntegrityError
+from django.db.models import F, Case, When, Value, Count, Sum
+from django.utils import timezone
+
+from shows.models import Show, SeatShard
+from shows import seatmap
+from shows import catalogue
+from shows import shards
+from custom_admin import rollups
+from .models import Booking, SeatHold, IdempotencyKey
+
+# How many times a booking is retried when the database reports a transient
+# error (deadlock, lock wait timeout, "database is locked" on SQLite).
+MAX_BOOKING_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.05
+# How many times best-available allocation re-scans a seat map after losing
+# the seats it picked to a concurrent booking.
+MAX_SEAT_CLAIM_ATTEMPTS = 5
+# Expired holds released per sweeper transaction.
+HOLD_SWEEP_BATCH_SIZE = 1000
+# How many times a seat release is retried when a show's seats were sharded or
+# unsharded while it ran.
+MAX_RELEASE_ATTEMPTS = 3
+# Expired idempotency keys deleted per purge statement.
+IDEMPOTENCY_PURGE_BATCH_SIZE = 5000
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+# Shows in one cart checkout.
+MAX_CART_LINES = 25
+
+
+class BookingError(Exception):
+    """Base class for booking failures that should be shown to the user."""
+
+
+class InsufficientSeats(BookingError):
+    pass
+
+
+class HoldExpired(BookingError):
+    pass
+
+
+class _DuplicateRequest(Exception):
+    # Another request already claimed this idempotency key
+    pass
+
+
+def reserve_seats(show_id, quantity):
+    """
+    Atomically take `quantity` seats from a show.
+
+    Runs a single conditional UPDATE:
+        UPDATE shows_show SET available_seats = available_seats - n
+        WHERE id = ? AND available_seats >= n
+    so the check and the decrement can never be split by another request.
+    Must be called inside a transaction. Returns True if the seats were taken.
+    Shows with sharded seats never match; see take_seats().
+    """
+    updated = Show.objects.filter(
+        pk=show_id, is_active=True, seat_shards=0, available_seats__gte=quantity,
+    ).update(available_seats=F('available_seats') - quantity)
+    if updated:
+        catalogue.seats_changed([show_id])
+    return updated == 1
+
+
+def take_seats(show, quantity):
+    """
+    Take `quantity` seats from `show`: from the Show row, or from its seat
+    shards if they are sharded (shows/shards.py). `show` may be a cached copy;
+    if its seats were sharded or unsharded since, the other way is tried.
+    Must be called inside a transaction. Returns True if the seats came from
+    shards; raises InsufficientSeats if there are not enough.
+    """
+    seat_shards = show.seat_shards
+    for _ in range(2):
+        if seat_shards:
+            taken = shards.reserve(show.pk, quantity, seat_shards)
+        else:
+            taken = reserve_seats(show.pk, quantity)
+        if taken:
+            return bool(seat_shards)
+        current = Show.objects.filter(pk=show.pk).values_list('seat_shards', flat=True).first()
+        if current is None or bool(current) == bool(seat_shards):
+            break # Really sold out
+        seat_shards = current
+    raise InsufficientSeats("Sorry, not enough seats are available.")
+
+
+def record_sale(booking, sharded):
+    # Sharded shows sell too fast for one rollup row per show; their rollups
+    # are rebuilt by sync_seat_shards instead
+    if not sharded:
+        rollups.booking_created(booking)
+
+
+def assign_seats(show, quantity):
+    """
+    Claim the best `quantity` adjacent seats on a seat-mapped show. Returns
+    (row, start, label): the SeatRow, the 0-based first seat and a label
+    describing them. Must be called inside a transaction.
+
+    The show's seat counter is not decremented separately: it is set to the
+    seat map's free seats (the rows' popcounts) in the same transaction, see
+    seatmap.set_available_seats(). The show row is locked first, as in
+    checkout() and cancel_booking(), so concurrent bookings cannot deadlock
+    on the seat rows that UPDATE reads.
+    """
+    if Show.objects.select_for_update().filter(pk=show.pk, is_active=True).values_list('pk').first() is None:
+        raise InsufficientSeats("Sorry, not enough seats are available.")
+    for _ in range(MAX_SEAT_CLAIM_ATTEMPTS):
+        choice = seatmap.find_best_available(show, quantity)
+        if choice is None:
+            raise InsufficientSeats(f"Sorry, there are no {quantity} seats available together.")
+        row_id, start = choice
+        try:
+            row = seatmap.claim_seats(row_id, start, quantity)
+        except seatmap.SeatsTaken:
+            continue # Someone beat us to those seats, look again
+        seatmap.set_available_seats([show.pk])
+        return row, start, seatmap.seat_label(row, start, quantity)
+    raise InsufficientSeats("Sorry, available seats changed. Please try again.")
+
+
+def allocate_seats(show, quantity):
+    """
+    Take `quantity` seats from `show`: the best adjacent block of its seat
+    map (assign_seats()), or otherwise a count off its Show row or shards
+    (take_seats()). Must be called inside a transaction. Returns
+    (sharded, seat_row, seat_start, seats).
+    """
+    if show.has_seat_map:
+        return (False, *assign_seats(show, quantity))
+    return take_seats(show, quantity), None, None, ''
+
+
+def book_seats(user, show, quantity, max_attempts=MAX_BOOKING_ATTEMPTS, idempotency_key=None):
+    """
+    Book `quantity` tickets for `show` on behalf of `user`.
+
+    The seat decrement and the Booking insert happen in the same transaction,
+    so either both are committed or neither is. Seat-mapped shows also get
+    the best available block of adjacent seats assigned. Transient database errors are
+    retried up to `max_attempts` times. Raises InsufficientSeats when the show
+    does not have enough seats left.
+
+    With an `idempotency_key`, only the first call for that key books; later
+    calls return the same Booking (or raise the same error) without touching
+    the show, see run_once().
+    """
+    if quantity <= 0:
+        raise BookingError("Quantity must be a positive number.")
+
+    def create():
+        sharded, seat_row, seat_start, seats = allocate_seats(show, quantity)
+        booking = Booking.objects.create(
+            user=user,
+            show=show,
+            quantity=quantity,
+            total_price=quantity * show.price,
+            booking_time=timezone.now(),
+            seats=seats,
+            seat_row=seat_row,
+            seat_start=seat_start,
+        )
+        record_sale(booking, sharded)
+        return booking
+
+    return with_retries(max_attempts, lambda: run_once(user, idempotency_key, create))
+
+
+def with_retries(max_attempts, func):
+    # Run func(), retrying transient database errors with a growing backoff
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func()
+        except OperationalError:
+            if attempt >= max_attempts:
+                raise
+            time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+
+
+def checkout(user, lines, max_attempts=MAX_BOOKING_ATTEMPTS, idempotency_key=None):
+    """
+    Book a whole cart for `user`: `lines` maps show id -> quantity. All the
+    bookings are made in one transaction, or none are.
+
+    The shows are locked up front with one SELECT ... FOR UPDATE in id order,
+    so two checkouts that share shows always lock them in the same order and
+    cannot deadlock each other. Seats are then taken show by show as in
+    book_seats(), and the Booking rows are inserted with one bulk_create.
+    Raises a BookingError naming the first line that cannot be booked.
+    Returns the bookings in show id order.
+
+    With an `idempotency_key`, only the first call for that key books; see
+    run_once(). The cart is checked only after the key, so a resubmission
+    after a successful checkout has emptied the cart still gets its bookings.
+    """
+    def create():
+        if not lines:
+            raise BookingError("Your cart is empty.")
+        if len(lines) > MAX_CART_LINES:
+            raise BookingError(f"A cart can hold at most {MAX_CART_LINES} shows.")
+        if any(quantity <= 0 for quantity in lines.values()):
+            raise BookingError("Quantity must be a positive number.")
+        shows = list(Show.objects.select_for_update().filter(pk__in=lines, is_active=True).order_by('pk'))
+        if len(shows) != len(lines):
+            raise BookingError("Some shows in your cart are no longer available. Please review your cart.")
+        now = timezone.now() # Shared by the whole cart
+        bookings, unsharded = [], []
+        for show in shows:
+            quantity = lines[show.pk]
+            try:
+                sharded, seat_row, seat_start, seats = allocate_seats(show, quantity)
+            except InsufficientSeats as e:
+                raise InsufficientSeats(f"{show.title}: {e}")
+            booking = Booking(
+                user=user,
+                show=show,
+                quantity=quantity,
+                total_price=quantity * show.price,
+                booking_time=now,
+                seats=seats,
+                seat_row=seat_row,
+                seat_start=seat_start,
+            )
+            bookings.append(booking)
+            if not sharded:
+                unsharded.append(booking)
+        Booking.objects.bulk_create(bookings)
+        rollups.apply_bookings(unsharded) # Sharded shows skip the rollups, see record_sale()
+        return bookings
+
+    result = with_retries(max_attempts, lambda: run_once(user, idempotency_key, create))
+    if isinstance(result, Booking): # The key was stored without the cart's booking ids
+        return [result]
+    return result
+
+
+def idempotent_outcome(user, key):
+    """The stored outcome for `key`, or None. One indexed lookup; never reads the show."""
+    return IdempotencyKey.objects.select_related('booking', 'hold').filter(user=user, key=key).first()
+
+
+def replay(record):
+    # Return (or raise) what the first request with this key got
+    if record.cart_bookings is not None:
+        return list(Booking.objects.filter(pk__in=record.cart_bookings).order_by('show_id'))
+    if record.booking is not None:
+        return record.booking
+    if record.hold is not None:
+        return record.hold
+    raise BookingError(record.error or "This request has already been processed.")
+
+
+def run_once(user, key, create):
+    """
+    Run `create()` (which makes and returns a Booking, a SeatHold or a list
+    of Bookings) in a transaction, at most once per (user, idempotency key).
+
+    The key row is inserted first, in the same transaction, so a concurrent
+    duplicate blocks on the key's unique index until the first request
+    commits and then replays its outcome; duplicates never wait on the show.
+    A BookingError is stored as the outcome too, so retries get the same
+    error. Without a key this is just create() in a transaction.
+    """
+    if not key:
+        with transaction.atomic():
+            return create()
+    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise BookingError("Invalid idempotency key.")
+
+    record = idempotent_outcome(user, key)
+    if record is not None:
+        return replay(record)
+
+    failure = None
+    try:
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=user,
+                        key=key,
+                        expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS),
+                    )
+            except IntegrityError:
+                raise _DuplicateRequest()
+            try:
+                with transaction.atomic():
+                    result = create()
+            except BookingError as e:
+                failure = e
+                record.error = str(e)[:255]
+                record.save(update_fields=['error'])
+            else:
+                if isinstance(result, list): # A checkout
+                    record.booking = result[0]
+                    record.cart_bookings = [booking.pk for booking in result]
+                elif isinstance(result, Booking):
+                    record.booking = result
+                else:
+                    record.hold = result
+                record.save(update_fields=['booking', 'cart_bookings', 'hold'])
+                return result
+    except _DuplicateRequest:
+        record = idempotent_outcome(user, key)
+        if record is None:
+            raise BookingError("This request is already being processed. Please try again.")
+        return replay(record)
+    raise failure
+
+
+def idempotency_key_used(user, key):
+    return bool(key) and IdempotencyKey.objects.filter(user=user, key=key).exists()
+
+
+def purge_idempotency_keys(batch_size=IDEMPOTENCY_PURGE_BATCH_SIZE, now=None):
+    """Delete one batch of expired idempotency keys. Returns how many were deleted."""
+    now = now or timezone.now()
+    expired = list(
+        IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size]
+    )
+    if not expired:
+        return 0
+    IdempotencyKey.objects.filter(pk__in=expired).delete()
+    return len(expired)
+
+
+def release_seats_by_show(released):
+    """
+    Give seats back to several shows, with one UPDATE for the shows that keep
+    their seats on the Show row and one for those with sharded seats.
+    `released` maps show id -> number of seats to return.
+    """
+    if not released:
+        return
+    for attempt in range(1, MAX_RELEASE_ATTEMPTS + 1):
+        counts = dict(Show.objects.filter(pk__in=released).values_list('pk', 'seat_shards'))
+        unsharded = {show_id: quantity for show_id, quantity in released.items() if counts.get(show_id) == 0}
+        sharded = {show_id: quantity for show_id, quantity in released.items() if counts.get(show_id)}
+        try:
+            with transaction.atomic():
+                updated = Show.objects.filter(pk__in=unsharded, seat_shards=0).update(
+                    available_seats=F('available_seats') + Case(
+                        *[When(pk=show_id, then=Value(quantity)) for show_id, quantity in unsharded.items()],
+                        default=Value(0),
+                    )
+                ) if unsharded else 0
+                if updated != len(unsharded):
+                    raise shards.ModeChanged()
+                if sharded:
+                    shards.release(sharded, counts)
+            break
+        except shards.ModeChanged:
+            if attempt == MAX_RELEASE_ATTEMPTS:
+                raise
+    catalogue.seats_changed(released)
+
+
+def cancel_booking(booking, max_attempts=MAX_BOOKING_ATTEMPTS):
+    """
+    Cancel `booking` and give its seats back to the show. Returns True if
+    this call cancelled it, False if it already was cancelled. Raises
+    BookingError, cancelling nothing, if its assigned seats' row is gone.
+
+    The booking is marked with a conditional UPDATE (WHERE status =
+    'confirmed'), so of two concurrent cancellations only one releases the
+    seats. The seats go back with a relative UPDATE (available_seats =
+    available_seats + n, see release_seats_by_show()) in the same transaction,
+    together with the sales rollups. Assigned seats are freed on the seat map
+    instead, and the show's counter set from the map.
+    """
+    def cancel():
+        now = timezone.now()
+        with transaction.atomic():
+            # The show row first, as in checkout() and cancel_show()
+            show = Show.objects.select_for_update().only('id', 'has_seat_map', 'seat_shards').get(pk=booking.show_id)
+            cancelled = Booking.objects.filter(pk=booking.pk, status=Booking.CONFIRMED).update(
+                status=Booking.CANCELLED, cancelled_at=now,
+            )
+            if not cancelled:
+                return None
+            if booking.seats and show.has_seat_map:
+                row = seatmap.release_seats(booking.seat_row_id, booking.seat_start, booking.quantity)
+                if row is None: # The seat map was rebuilt since; rolls the cancellation back
+                    raise BookingError("The seats of this booking are no longer on the show's seat map.")
+                seatmap.set_available_seats([show.pk])
+            else:
+                release_seats_by_show({show.pk: booking.quantity})
+            if not show.seat_shards: # Sharded shows' rollups are rebuilt by sync_seat_shards
+                rollups.booking_cancelled(booking)
+        return now
+
+    cancelled_at = with_retries(max_attempts, cancel)
+    if cancelled_at is None:
+        return False
+    booking.status = Booking.CANCELLED
+    booking.cancelled_at = cancelled_at
+    return True
+
+
+def cancel_show(show, max_attempts=MAX_BOOKING_ATTEMPTS):
+    """
+    Take `show` off sale and cancel all its bookings and active holds.
+    Returns the number of bookings cancelled.
+
+    Runs a fixed number of statements however many bookings the show has:
+    the bookings are marked cancelled with one UPDATE and their seats (and
+    the holds') returned with one more, and the show's seat map and rollups
+    are reset set-wise too. The show row, its seat shards and its holds are
+    locked first, which holds off every path that could add a booking until
+    the show is inactive. The hold sweeper locks holds before their shows, so
+    a deadlock with it is retried like any transient error.
+    """
+    def cancel():
+        now = timezone.now()
+        with transaction.atomic():
+            locked = Show.objects.select_for_update().only('id', 'has_seat_map').get(pk=show.pk)
+            list(SeatShard.objects.select_for_update().filter(show=show).order_by('shard').values_list('pk'))
+            Show.objects.filter(pk=show.pk).update(is_active=False)
+            # confirm_hold() and release_hold() lock the show first too, so they
+            # wait and then find the hold released
+            holds = SeatHold.objects.filter(show=show, status=SeatHold.ACTIVE)
+            held = sum(holds.select_for_update().values_list('quantity', flat=True))
+            holds.update(status=SeatHold.RELEASED)
+
+            bookings = Booking.objects.filter(show=show, status=Booking.CONFIRMED)
+            totals = bookings.aggregate(count=Count('id'), seats=Sum('quantity'))
+            bookings.update(status=Booking.CANCELLED, cancelled_at=now)
+            released = (totals['seats'] or 0) + held
+            if locked.has_seat_map:
+                seatmap.clear_seat_map(show)
+                seatmap.set_available_seats([show.pk])
+            elif released:
+                release_seats_by_show({show.pk: released})
+            rollups.rebuild([show.pk])
+            catalogue.catalogue_changed([show.pk])
+        return totals['count']
+
+    count = with_retries(max_attempts, cancel)
+    show.is_active = False
+    return count
+
+
+def place_hold(user, show, quantity, ttl=None, idempotency_key=None):
+    """
+    Reserve `quantity` seats for `user` for `ttl` seconds (SEAT_HOLD_TTL_SECONDS
+    by default). The seats leave Show.available_seats immediately, so
+    confirming the hold later can no longer fail for lack of seats.
+    A repeated `idempotency_key` returns the first hold, see run_once().
+    """
+    if quantity <= 0:
+        raise BookingError("Quantity must be a positive number.")
+    if show.has_seat_map:
+        raise BookingError("Holds are not available for assigned seating. Please book directly.")
+    ttl = settings.SEAT_HOLD_TTL_SECONDS if ttl is None else ttl
+
+    def create():
+        take_seats(show, quantity)
+        now = timezone.now()
+        return SeatHold.objects.create(
+            user=user,
+            show=show,
+            quantity=quantity,
+            created_at=now,
+            expires_at=now + timedelta(seconds=ttl),
+        )
+
+    return run_once(user, idempotency_key, create)
+
+
+def lock_show(show_id):
+    # The show row is locked before any of its holds or bookings, the order
+    # cancel_show() takes them in, so the two cannot deadlock
+    Show.objects.select_for_update().filter(pk=show_id).values_list('pk').get()
+
+
+def confirm_hold(hold, max_attempts=MAX_BOOKING_ATTEMPTS):
+    """Turn a live hold into a Booking. Raises HoldExpired if it is too late."""
+    def confirm():
+        with transaction.atomic():
+            lock_show(hold.show_id)
+            # Conditional UPDATE so a hold can only be confirmed once, and never
+            # after the sweeper has started returning its seats.
+            claimed = SeatHold.objects.filter(
+                pk=hold.pk, status=SeatHold.ACTIVE, expires_at__gt=timezone.now(),
+            ).update(status=SeatHold.CONFIRMED)
+            if not claimed:
+                raise HoldExpired("Sorry, your hold has expired. Please select your tickets again.")
+            booking = Booking.objects.create(
+                user=hold.user,
+                show=hold.show,
+                quantity=hold.quantity,
+                total_price=hold.quantity * hold.show.price,
+                booking_time=timezone.now(),
+            )
+            SeatHold.objects.filter(pk=hold.pk).update(booking=booking)
+            record_sale(booking, hold.show.seat_shards > 0)
+        return booking
+
+    booking = with_retries(max_attempts, confirm)
+    hold.status = SeatHold.CONFIRMED
+    hold.booking = booking
+    return booking
+
+
+def release_hold(hold):
+    """Let a user give up a live hold early. Returns True if seats were released."""
+    with transaction.atomic():
+        lock_show(hold.show_id)
+        released = SeatHold.objects.filter(
+            pk=hold.pk, status=SeatHold.ACTIVE,
+        ).update(status=SeatHold.RELEASED)
+        if released:
+            release_seats_by_show({hold.show_id: hold.quantity})
+    return bool(released)
+
+
+def sweep_expired_holds(batch_size=HOLD_SWEEP_BATCH_SIZE, now=None):
+    """
+    Expire one batch of overdue holds and return their seats to the shows.
+
+    Uses a fixed number of statements per batch regardless of its size: one
+    SELECT (row-locked, skipping rows other sweepers hold), one UPDATE marking
+    the holds expired and one UPDATE returning seats to all affected shows.
+    Returns the number of holds expired.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = list(
+            SeatHold.objects.select_for_update(skip_locked=True)
+            .filter(status=SeatHold.ACTIVE, expires_at__lte=now)
+            .order_by('expires_at')
+            .values_list('pk', 'show_id', 'quantity')[:batch_size]
+        )
+        if not expired:
+            return 0
+        SeatHold.objects.filter(pk__in=[pk for pk, _, _ in expired]).update(status=SeatHold.EXPIRED)
+        released = defaultdict(int)
+        for _, show_id, quantity in expired:
+            released[show_id] += quantity
+        release_seats_by_show(released)
+    return len(expired)
+
+
+def hold_metrics(since=None):
+    """Counts of holds by outcome plus conversion and expiry rates."""
+    holds = SeatHold.objects.all()
+    if since is not None:
+        holds = holds.filter(created_at__gte=since)
+    counts = dict(holds.order_by().values_list('status').annotate(total=Count('id')))
+    metrics = {status: counts.get(status, 0) for status, _ in SeatHold.STATUS_CHOICES}
+    metrics['placed'] = sum(counts.values())
+    finished = metrics[SeatHold.CONFIRMED] + metrics[SeatHold.EXPIRED] + metrics[SeatHold.RELEASED]
+    metrics['conversion_rate'] = metrics[SeatHold.CONFIRMED] / finished if finished else None
+    metrics['expiry_rate'] = metrics[SeatHold.EXPIRED] / finished if finished else None
+    return metrics
@@ -1,3 +1,778 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, IntegrityError, transaction
+from django.db.models import Sum
+from django.urls import reverse
+from django.utils import timezone
+
+from shows.models import Show, SeatShard
+from shows import shards
+from shows import seatmap
+from custom_admin.models import ShowSalesRollup
+from ticket_booking_system.queryplans import captured_full_scans, full_scans
+from ticket_booking_system import replicas
+from ticket_booking_system.pagination import encode_cursor
+from .models import Booking, SeatHold, IdempotencyKey
+from . import reconcile
+from .loadtest import percentile, parse_mix, compare
+from .services import (
+    book_seats, InsufficientSeats, HoldExpired,
+    place_hold, confirm_hold, release_hold, sweep_expired_holds, hold_metrics,
+    purge_idempotency_keys, BookingError, checkout, cancel_booking, cancel_show,
+)
+
+
+def make_show(**kwargs):
+    defaults = {
+        'title': "Test Show",
+        'description': "A show used in tests",
+        'date_time': timezone.now() + timezone.timedelta(days=7),
+        'location': "Main Hall",
+        'total_seats': 10,
+        'available_seats': 10,
+        'price': Decimal('25.00'),
+    }
+    defaults.update(kwargs)
+    return Show.objects.create(**defaults)
+
+
+class BookSeatsTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='alice', password='pw')
+        self.show = make_show(total_seats=5)
+
+    def test_booking_decrements_seats_and_creates_booking(self):
+        booking = book_seats(self.user, self.show, 3)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 2)
+        self.assertEqual(booking.total_price, Decimal('75.00'))
+
+    def test_booking_more_than_available_is_rejected(self):
+        with self.assertRaises(InsufficientSeats):
+            book_seats(self.user, self.show, 6)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 5)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_decrement_does_not_overwrite_other_fields(self):
+        # An admin edit that lands between loading the show and booking must survive.
+        Show.objects.filter(pk=self.show.pk).update(title="Renamed")
+        book_seats(self.user, self.show, 1)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.title, "Renamed")
+
+    def test_detail_view_books_through_service(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('show_detail', kwargs={'pk': self.show.pk}), {'quantity': '2'})
+        self.assertRedirects(response, reverse('booking_confirmation'))
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 3)
+
+
+class SeatHoldTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='carol', password='pw')
+        self.show = make_show(total_seats=10)
+
+    def expire(self, *holds):
+        SeatHold.objects.filter(pk__in=[h.pk for h in holds]).update(
+            expires_at=timezone.now() - timezone.timedelta(seconds=1)
+        )
+
+    def test_hold_takes_seats_and_confirm_creates_booking(self):
+        hold = place_hold(self.user, self.show, 4)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 6)
+
+        booking = confirm_hold(hold)
+        self.assertEqual(booking.quantity, 4)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 6) # Seats were taken when the hold was placed
+        with self.assertRaises(HoldExpired):
+            confirm_hold(hold) # A hold can only be confirmed once
+
+    def test_expired_hold_cannot_be_confirmed(self):
+        hold = place_hold(self.user, self.show, 2)
+        self.expire(hold)
+        with self.assertRaises(HoldExpired):
+            confirm_hold(hold)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_hold_paths_lock_the_show_first(self):
+        # The order cancel_show() locks in: show, then holds
+        for finish in (confirm_hold, release_hold):
+            hold = place_hold(self.user, self.show, 1)
+            with CaptureQueriesContext(connection) as queries:
+                finish(hold)
+            statements = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+            self.assertIn('"shows_show"', statements[0])
+            self.assertIn('"bookings_seathold"', statements[1])
+
+    def test_sweeper_returns_seats_in_batches(self):
+        other = make_show(title="Other", total_seats=10)
+        holds = [place_hold(self.user, self.show, 2) for _ in range(3)]
+        holds.append(place_hold(self.user, other, 5))
+        live = place_hold(self.user, self.show, 1)
+        self.expire(*holds)
+
+        self.assertEqual(sweep_expired_holds(batch_size=3), 3)
+        self.assertEqual(sweep_expired_holds(batch_size=3), 1)
+        self.assertEqual(sweep_expired_holds(batch_size=3), 0)
+
+        self.show.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 9) # Only the live hold is still out
+        self.assertEqual(other.available_seats, 10)
+        live.refresh_from_db()
+        self.assertEqual(live.status, SeatHold.ACTIVE)
+
+    def test_release_and_metrics(self):
+        confirmed = place_hold(self.user, self.show, 1)
+        confirm_hold(confirmed)
+        expired = place_hold(self.user, self.show, 1)
+        self.expire(expired)
+        sweep_expired_holds()
+        released = place_hold(self.user, self.show, 1)
+        self.assertTrue(release_hold(released))
+        self.assertFalse(release_hold(released))
+        place_hold(self.user, self.show, 1)
+
+        metrics = hold_metrics()
+        self.assertEqual(metrics['placed'], 4)
+        self.assertEqual(metrics['active'], 1)
+        self.assertAlmostEqual(metrics['conversion_rate'], 1 / 3)
+        self.assertAlmostEqual(metrics['expiry_rate'], 1 / 3)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 8)
+
+    def test_hold_flow_through_views(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('show_hold', kwargs={'pk': self.show.pk}), {'quantity': '3'})
+        hold = SeatHold.objects.get()
+        self.assertRedirects(response, reverse('hold_detail', kwargs={'pk': hold.pk}))
+        self.assertContains(self.client.get(reverse('hold_detail', kwargs={'pk': hold.pk})), "Confirm Booking")
+        response = self.client.post(reverse('hold_detail', kwargs={'pk': hold.pk}))
+        self.assertRedirects(response, reverse('booking_confirmation'))
+        self.assertEqual(Booking.objects.get().quantity, 3)
+
+
+class CartCheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='gina', password='pw')
+        self.shows = [make_show(title=f"Show {i}", total_seats=10) for i in range(3)]
+
+    def seats_left(self):
+        return [shards.available_seats(show) for show in Show.objects.order_by('pk')]
+
+    def test_checkout_books_every_line_with_one_insert(self):
+        mapped = seatmap.build_seat_map(make_show(title="Mapped"), [("Stalls", 1, 6)])
+        shards.set_shards(self.shows[2], 2)
+        lines = {self.shows[0].pk: 2, self.shows[1].pk: 3, self.shows[2].pk: 4, mapped.pk: 2}
+        with CaptureQueriesContext(connection) as queries:
+            bookings = checkout(self.user, lines)
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "bookings_booking"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual([b.show_id for b in bookings], sorted(lines))
+        self.assertEqual(self.seats_left(), [8, 7, 6, 4])
+        self.assertEqual(Booking.objects.get(show=mapped).seats, "Stalls Row 1, Seats 3-4")
+        self.assertEqual(ShowSalesRollup.objects.get(show=self.shows[1]).tickets_sold, 3)
+        self.assertFalse(ShowSalesRollup.objects.filter(show=self.shows[2]).exists()) # Sharded, see sync_seat_shards
+
+    def test_checkout_is_all_or_nothing(self):
+        lines = {self.shows[0].pk: 2, self.shows[1].pk: 11, self.shows[2].pk: 1}
+        with self.assertRaisesMessage(InsufficientSeats, "Show 1"):
+            checkout(self.user, lines)
+        Show.objects.filter(pk=self.shows[2].pk).update(is_active=False)
+        with self.assertRaises(BookingError):
+            checkout(self.user, {self.shows[0].pk: 1, self.shows[2].pk: 1})
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.seats_left(), [10, 10, 10])
+
+    def test_repeated_key_replays_the_whole_cart(self):
+        lines = {show.pk: 1 for show in self.shows}
+        first = checkout(self.user, lines, idempotency_key='cart-1')
+        # Another booking with the same timestamp is not part of the cart
+        other = book_seats(self.user, make_show(title="Other"), 1)
+        Booking.objects.filter(pk=other.pk).update(booking_time=first[0].booking_time)
+        again = checkout(self.user, lines, idempotency_key='cart-1')
+        self.assertEqual([b.pk for b in again], [b.pk for b in first])
+        self.assertEqual(self.seats_left(), [9, 9, 9, 9])
+
+    def test_cart_flow_through_views(self):
+        self.client.force_login(self.user)
+        for show in self.shows[:2]:
+            self.client.post(reverse('show_cart_add', kwargs={'pk': show.pk}), {'quantity': '2'})
+        self.client.post(reverse('cart_remove', kwargs={'pk': self.shows[0].pk}))
+        self.client.post(reverse('show_cart_add', kwargs={'pk': self.shows[2].pk}), {'quantity': '3'})
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['total'], Decimal('125.00'))
+
+        queued = make_show(title="Queued", queue_enabled=True, queue_rate=1)
+        self.client.post(reverse('show_cart_add', kwargs={'pk': queued.pk}), {'quantity': '1'})
+        self.assertEqual(len(self.client.get(reverse('cart')).context['items']), 2)
+
+        response = self.client.post(reverse('cart'), {'idempotency_key': 'k'})
+        self.assertRedirects(response, reverse('booking_confirmation'))
+        self.assertEqual(sorted(Booking.objects.values_list('quantity', flat=True)), [2, 3])
+        self.assertEqual(self.client.get(reverse('cart')).context['items'], [])
+
+    def test_resubmitted_checkout_replays_after_the_cart_is_cleared(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('show_cart_add', kwargs={'pk': self.shows[0].pk}), {'quantity': '2'})
+        for _ in range(2): # A double submit: the second arrives after the first emptied the cart
+            response = self.client.post(reverse('cart'), {'idempotency_key': 'submit-1'})
+            self.assertRedirects(response, reverse('booking_confirmation'), fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(checkout(self.user, {}, idempotency_key='submit-1'), list(Booking.objects.all()))
+        with self.assertRaisesMessage(BookingError, "Your cart is empty."):
+            checkout(self.user, {})
+
+    def test_cancelled_show_is_dropped_from_the_cart(self):
+        self.client.force_login(self.user)
+        for show in self.shows[:2]:
+            self.client.post(reverse('show_cart_add', kwargs={'pk': show.pk}), {'quantity': '2'})
+        cancel_show(self.shows[0])
+        response = self.client.post(reverse('cart'), {'idempotency_key': 'before'}) # From a page shown before the cancellation
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['unavailable'], 1)
+        self.assertEqual([item['show'].pk for item in response.context['items']], [self.shows[1].pk])
+        self.assertContains(response, "no longer on sale and has been removed")
+        response = self.client.post(reverse('cart'), {'idempotency_key': response.context['idempotency_key']})
+        self.assertRedirects(response, reverse('booking_confirmation'))
+        self.assertEqual(list(Booking.objects.values_list('show', 'quantity')), [(self.shows[1].pk, 2)])
+
+
+class ReconcileSeatsTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='rita', password='pw')
+        self.shows = [make_show(title=f"Show {i}", total_seats=10) for i in range(4)]
+        shards.set_shards(self.shows[3], 3)
+        for show in self.shows:
+            book_seats(self.user, show, 2)
+        place_hold(self.user, self.shows[1], 3)
+
+    def reconcile(self, **options):
+        out = io.StringIO()
+        call_command('reconcile_seats', chunk_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def seats_left(self):
+        return [shards.available_seats(show) for show in Show.objects.order_by('pk')]
+
+    def test_consistent_inventory_has_no_drift(self):
+        self.assertEqual(reconcile.find_drift([show.pk for show in self.shows]), [])
+        self.assertIn("Checked 4 shows", self.reconcile())
+
+    def test_reports_and_repairs_drift(self):
+        Show.objects.filter(pk=self.shows[0].pk).update(available_seats=10) # Lost a booking
+        Show.objects.filter(pk=self.shows[1].pk).update(available_seats=0) # Lost a hold's release
+        SeatShard.objects.filter(show=self.shows[3], shard=0).update(available_seats=0)
+        sharded_left = shards.available_seats(self.shows[3])
+        Booking.objects.create(user=self.user, show=self.shows[2], quantity=20, total_price=0) # Oversold by hand
+        drift = reconcile.find_drift([show.pk for show in self.shows])
+        self.assertEqual([(d.show_id, d.recorded, d.expected) for d in drift], [
+            (self.shows[0].pk, 10, 8), (self.shows[1].pk, 0, 5), (self.shows[2].pk, 8, -12),
+            (self.shows[3].pk, sharded_left, 8),
+        ])
+        output = self.reconcile()
+        self.assertIn("4 with seat drift", output)
+        self.assertIn("OVERSOLD", output)
+        self.assertEqual(self.seats_left(), [10, 0, 8, sharded_left]) # Report only
+
+        with self.captureOnCommitCallbacks(execute=True):
+            output = self.reconcile(repair=True)
+        self.assertIn("4 repaired, 1 oversold (set to 0 seats)", output)
+        self.assertEqual(self.seats_left(), [8, 5, 0, 8])
+        self.assertEqual(Show.objects.get(pk=self.shows[3].pk).available_seats, 8) # Shard total written back
+        self.assertEqual(reconcile.find_drift([self.shows[0].pk, self.shows[1].pk, self.shows[3].pk]), [])
+
+    def test_repair_skips_shows_fixed_meanwhile(self):
+        Show.objects.filter(pk=self.shows[0].pk).update(available_seats=9)
+        drift = reconcile.find_drift([self.shows[0].pk])
+        Show.objects.filter(pk=self.shows[0].pk).update(available_seats=8)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(reconcile.repair([d.show_id for d in drift]), [])
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')])
+
+    def test_check_is_grouped_statements_per_chunk(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.reconcile()
+        aggregates = [q['sql'] for q in queries.captured_queries if 'GROUP BY' in q['sql']]
+        # Two chunks of two shows: bookings and holds for each, shards only for the chunk with show 3
+        self.assertEqual(len(aggregates), 5)
+        self.assertFalse([sql for sql in aggregates if sql.count('SELECT') > 1]) # No correlated subqueries
+        self.assertTrue(all('>=' in sql and '<=' in sql for sql in aggregates)) # Over the chunk's id range
+
+
+class CancellationTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='carol', password='pw')
+        self.show = make_show(total_seats=10)
+
+    def test_cancel_booking_releases_seats_once(self):
+        booking = book_seats(self.user, self.show, 3)
+        self.assertTrue(cancel_booking(booking))
+        self.assertFalse(cancel_booking(Booking.objects.get(pk=booking.pk))) # Already cancelled
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 10)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, Booking.CANCELLED)
+        self.assertIsNotNone(booking.cancelled_at)
+        self.assertEqual(ShowSalesRollup.objects.get(show=self.show).tickets_sold, 0)
+
+    def test_cancel_frees_mapped_and_sharded_seats(self):
+        mapped = seatmap.build_seat_map(make_show(title="Mapped"), [("Stalls", 1, 6)])
+        booking = book_seats(self.user, mapped, 2)
+        cancel_booking(booking)
+        self.assertEqual(seatmap.availability(mapped)[0]['seats'], 'oooooo')
+        self.assertEqual(book_seats(self.user, mapped, 2).seats, booking.seats) # The same best seats again
+
+        shards.set_shards(self.show, 3)
+        cancel_booking(book_seats(self.user, self.show, 4))
+        self.assertEqual(shards.available_seats(self.show), 10)
+
+    def test_cancel_frees_the_booked_row_by_key(self):
+        # Two sections with the same name give identical seat labels
+        mapped = seatmap.build_seat_map(make_show(title="Mapped"), [("Stalls", 1, 2), ("Stalls", 1, 2)])
+        first = book_seats(self.user, mapped, 2)
+        second = book_seats(self.user, mapped, 2)
+        self.assertEqual(first.seats, second.seats)
+        self.assertNotEqual(first.seat_row_id, second.seat_row_id)
+        with CaptureQueriesContext(connection) as queries:
+            cancel_booking(second)
+        row_statements = [q['sql'] for q in queries.captured_queries if '"shows_seatrow"' in q['sql'] and not q['sql'].startswith('UPDATE "shows_show"')]
+        self.assertEqual(len(row_statements), 2) # Lock and update one row (the show's counter is then totalled from the map)
+        self.assertEqual([row['seats'] for row in seatmap.availability(mapped)], ['xx', 'oo'])
+
+    def test_cancel_rolls_back_when_the_row_is_gone(self):
+        mapped = seatmap.build_seat_map(make_show(title="Mapped"), [("Stalls", 1, 6)])
+        booking = book_seats(self.user, mapped, 2)
+        seatmap.build_seat_map(mapped, [("Stalls", 1, 6)]) # Rebuilt: the booking's row is deleted
+        booking.refresh_from_db()
+        self.assertIsNone(booking.seat_row_id)
+        with self.assertRaises(BookingError):
+            cancel_booking(booking)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, Booking.CONFIRMED)
+        mapped.refresh_from_db()
+        self.assertEqual(mapped.available_seats, 6)
+
+    def test_cancel_show_is_set_based(self):
+        other = make_show(title="Other", total_seats=30)
+        for show, count in ((self.show, 2), (other, 10)):
+            for _ in range(count):
+                book_seats(self.user, show, 1)
+        hold = place_hold(self.user, self.show, 3)
+        query_counts = []
+        for show in (self.show, other):
+            with CaptureQueriesContext(connection) as queries:
+                with self.captureOnCommitCallbacks(execute=True):
+                    cancel_show(show)
+            query_counts.append(len(queries.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1]) # However many bookings
+        for show in (self.show, other):
+            show.refresh_from_db()
+            self.assertFalse(show.is_active)
+            self.assertEqual(show.available_seats, show.total_seats)
+        self.assertFalse(Booking.objects.filter(status=Booking.CONFIRMED).exists())
+        self.assertFalse(ShowSalesRollup.objects.filter(bookings__gt=0).exists())
+        with self.assertRaises(HoldExpired):
+            confirm_hold(hold)
+        self.assertEqual(reconcile.find_drift([self.show.pk, other.pk]), [])
+
+    def test_cancel_show_clears_seat_map(self):
+        mapped = seatmap.build_seat_map(make_show(title="Mapped"), [("Stalls", 2, 6)])
+        for _ in range(3):
+            book_seats(self.user, mapped, 2)
+        self.assertEqual(cancel_show(mapped), 3)
+        self.assertEqual([row['seats'] for row in seatmap.availability(mapped)], ['oooooo', 'oooooo'])
+        mapped.refresh_from_db()
+        self.assertEqual(mapped.available_seats, 12)
+
+    def test_user_cancels_from_history(self):
+        kept = book_seats(self.user, self.show, 1)
+        cancelled = book_seats(self.user, self.show, 2)
+        past = Booking.objects.create(user=self.user, show=make_show(date_time=timezone.now() - timezone.timedelta(days=1)),
+                                      quantity=1, total_price=Decimal('25.00'))
+        other = User.objects.create_user(username='mallory', password='pw')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post(reverse('booking_cancel', kwargs={'pk': cancelled.pk})).status_code, 404)
+
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('booking_cancel', kwargs={'pk': cancelled.pk}))
+        self.assertRedirects(response, reverse('booking_history'))
+        response = self.client.post(reverse('booking_cancel', kwargs={'pk': past.pk}), follow=True)
+        self.assertContains(response, "once the show has started")
+        self.assertEqual([b.pk for b in response.context['bookings']], [past.pk, kept.pk])
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 9)
+
+
+class BookingHistoryPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='erin', password='pw')
+        shows = [make_show(title=f"Show {i}", total_seats=100) for i in range(3)]
+        same_time = timezone.now()
+        # Several bookings share a booking_time so the id tie-breaker matters
+        for i in range(25):
+            Booking.objects.create(
+                user=self.user, show=shows[i % 3], quantity=1, total_price=Decimal('25.00'),
+                booking_time=same_time - timezone.timedelta(minutes=i // 4),
+            )
+        self.client.force_login(self.user)
+
+    def collect_pages(self, page_size):
+        ids, params = [], {'page_size': page_size}
+        while True:
+            response = self.client.get(reverse('booking_history'), params)
+            ids.extend(b.pk for b in response.context['bookings'])
+            page = response.context['page']
+            if not page.has_next:
+                return ids
+            params = {'page_size': page_size, 'after': page.next_cursor}
+
+    def test_cursors_walk_every_booking_once_in_order(self):
+        expected = list(
+            Booking.objects.filter(user=self.user).order_by('-booking_time', '-id').values_list('pk', flat=True)
+        )
+        self.assertEqual(self.collect_pages(7), expected)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        url = reverse('booking_history')
+        self.client.get(url, {'page_size': 2}) # Warm up session and user lookups
+        with self.assertNumQueries(3) as small:
+            self.client.get(url, {'page_size': 2})
+        with self.assertNumQueries(len(small.captured_queries)):
+            self.client.get(url, {'page_size': 25})
+
+    def test_bad_cursor_is_404(self):
+        response = self.client.get(reverse('booking_history'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_well_formed_cursor_with_bad_values_is_404(self):
+        now = str(timezone.now())
+        cursors = [
+            encode_cursor(['not a date', 1]),
+            encode_cursor([now, 'x']),
+            encode_cursor([now, None]),
+            encode_cursor([{'a': 1}, 1]),
+            encode_cursor([now, 10 ** 30]), # Beyond the id column
+        ]
+        self.client.force_login(User.objects.create_superuser(username='boss', password='pw'))
+        for url in (reverse('booking_history'), reverse('admin_booking_list')):
+            for cursor in cursors:
+                self.assertEqual(self.client.get(url, {'after': cursor}).status_code, 404, (url, cursor))
+        for url in (reverse('show_list'), reverse('admin_show_list')): # Ordered by date_time, id too
+            for cursor in cursors:
+                self.assertEqual(self.client.get(url, {'after': cursor}).status_code, 404, (url, cursor))
+        self.assertEqual(self.client.get(reverse('booking_history'), {'after': encode_cursor([now, 1])}).status_code, 200)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='ivan', password='pw')
+        self.show = make_show(total_seats=5)
+
+    def test_replay_returns_first_booking_without_touching_show(self):
+        first = book_seats(self.user, self.show, 2, idempotency_key='k1')
+        with CaptureQueriesContext(connection) as queries:
+            again = book_seats(self.user, self.show, 2, idempotency_key='k1')
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('shows_show', queries[0]['sql'])
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 3)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_failure_is_replayed_and_keys_are_per_user(self):
+        with self.assertRaises(InsufficientSeats):
+            book_seats(self.user, self.show, 6, idempotency_key='k2')
+        with self.assertRaisesMessage(BookingError, "Sorry, not enough seats are available."):
+            book_seats(self.user, self.show, 1, idempotency_key='k2')
+        other = User.objects.create_user(username='olga', password='pw')
+        book_seats(other, self.show, 1, idempotency_key='k2')
+        self.assertEqual(Booking.objects.get().user, other)
+
+    def test_double_submitted_form_books_once(self):
+        self.client.force_login(self.user)
+        url = reverse('show_detail', kwargs={'pk': self.show.pk})
+        key = self.client.get(url).context['idempotency_key']
+        for _ in range(2):
+            response = self.client.post(url, {'quantity': '2', 'idempotency_key': key})
+            self.assertRedirects(response, reverse('booking_confirmation'))
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_hold_header_key(self):
+        self.client.force_login(self.user)
+        url = reverse('show_hold', kwargs={'pk': self.show.pk})
+        first = self.client.post(url, {'quantity': '2'}, HTTP_IDEMPOTENCY_KEY='h1')
+        second = self.client.post(url, {'quantity': '2'}, HTTP_IDEMPOTENCY_KEY='h1')
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(SeatHold.objects.count(), 1)
+
+    def test_purge_removes_expired_keys(self):
+        book_seats(self.user, self.show, 1, idempotency_key='old')
+        book_seats(self.user, self.show, 1, idempotency_key='new')
+        IdempotencyKey.objects.filter(key='old').update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(purge_idempotency_keys(batch_size=1), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+        self.assertEqual(Booking.objects.count(), 2) # Bookings are kept
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def setUp(self):
+        # Threads need their own connections to the same database; SQLite's
+        # shared-cache in-memory test database fails those with "table is locked".
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Needs a test database that supports concurrent connections.")
+
+    def test_concurrent_bookings_never_oversell(self):
+        seats = 20
+        show = make_show(total_seats=seats)
+        users = [User.objects.create(username=f"user{i}") for i in range(8)]
+        barrier = threading.Barrier(len(users))
+        failures = []
+
+        def worker(user):
+            local_show = Show.objects.get(pk=show.pk)
+            barrier.wait()
+            try:
+                for _ in range(5):
+                    try:
+                        book_seats(user, local_show, 1)
+                    except InsufficientSeats:
+                        pass
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(failures, [])
+        show.refresh_from_db()
+        sold = Booking.objects.filter(show=show).aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(sold, seats)
+        self.assertEqual(show.available_seats, 0)
+
+    def test_concurrent_sharded_bookings_never_oversell(self):
+        seats = 30
+        show = make_show(total_seats=seats)
+        shards.set_shards(show, 4)
+        users = [User.objects.create(username=f"user{i}") for i in range(8)]
+        barrier = threading.Barrier(len(users))
+        failures = []
+
+        def worker(user, quantity):
+            local_show = Show.objects.get(pk=show.pk)
+            barrier.wait()
+            try:
+                for _ in range(10):
+                    try:
+                        book_seats(user, local_show, quantity)
+                    except InsufficientSeats:
+                        pass
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        # Mixed sizes, so shards run low unevenly and bookings span several
+        threads = [threading.Thread(target=worker, args=(u, 1 + i % 3)) for i, u in enumerate(users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(failures, [])
+        sold = Booking.objects.filter(show=show).aggregate(total=Sum('quantity'))['total']
+        left = list(SeatShard.objects.filter(show=show).values_list('available_seats', flat=True))
+        self.assertGreaterEqual(min(left), 0)
+        self.assertEqual(sold + sum(left), seats)
+        self.assertLess(sum(left), 3) # Sold out as far as the largest booking goes
+
+    def test_concurrent_duplicates_book_once(self):
+        show = make_show(total_seats=20)
+        user = User.objects.create(username="retrier")
+        barrier = threading.Barrier(6)
+        results, failures = [], []
+
+        def worker():
+            barrier.wait()
+            try:
+                results.append(book_seats(user, Show.objects.get(pk=show.pk), 2, idempotency_key='same').pk)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(len(set(results)), 1)
+        show.refresh_from_db()
+        self.assertEqual(show.available_seats, 18)
+
+
+class LoadTestHelperTests(SimpleTestCase):
+    def test_percentile_and_mix_parsing(self):
+        values = sorted(range(1, 101))
+        self.assertEqual((percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)), (50, 95, 99))
+        self.assertEqual(parse_mix('list=3,book'), {'list': 3.0, 'book': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix('browse=1')
+
+
+class LoadTestTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Needs a test database that supports concurrent connections.")
+
+    def test_loadtest_writes_report_and_cleans_up(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'report.json')
+            call_command('loadtest', shows=2, users=3, seats=5, workers=3, requests=6, seed=1,
+                         mix='list=1,detail=1,book=3,login=1', output=path, stdout=open(os.devnull, 'w'))
+            with open(path) as f:
+                report = json.load(f)
+        self.assertEqual(report['total_requests'], 18)
+        self.assertEqual(report['integrity']['oversold'], 0)
+        self.assertEqual(report['integrity']['counter_drift'], 0)
+        self.assertIn('p99_ms', report['operations']['book'])
+        self.assertFalse(Show.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+        slower = json.loads(json.dumps(report))
+        slower['operations']['book']['p95_ms'] = report['operations']['book']['p95_ms'] * 2 + 1
+        self.assertEqual(len(compare(slower, report)), 1)
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='quinn', password='pw')
+        self.show = make_show()
+        for _ in range(3):
+            book_seats(self.user, self.show, 1)
+        self.client.force_login(self.user)
+
+    def assertNoFullScans(self, send):
+        with CaptureQueriesContext(connection) as queries:
+            send()
+        self.assertEqual(captured_full_scans(queries.captured_queries), {})
+
+    def test_history_pages(self):
+        url = reverse('booking_history')
+        cursor = self.client.get(url, {'page_size': 2}).context['page'].next_cursor
+        self.assertNoFullScans(lambda: self.client.get(url, {'page_size': 2}))
+        self.assertNoFullScans(lambda: self.client.get(url, {'page_size': 2, 'after': cursor}))
+
+    def test_holds(self):
+        self.assertNoFullScans(lambda: self.client.post(reverse('show_hold', kwargs={'pk': self.show.pk}), {'quantity': 1}))
+        hold = SeatHold.objects.get()
+        self.assertNoFullScans(lambda: self.client.get(reverse('hold_detail', kwargs={'pk': hold.pk})))
+        self.assertNoFullScans(lambda: self.client.post(reverse('hold_detail', kwargs={'pk': hold.pk})))
+
+    def test_background_jobs(self):
+        self.assertNoFullScans(sweep_expired_holds)
+        self.assertNoFullScans(purge_idempotency_keys)
+        self.assertNoFullScans(lambda: hold_metrics(since=timezone.now() - timezone.timedelta(days=1)))
+        self.assertEqual(full_scans(Booking.objects.filter(show=self.show)), [])
+
+    def test_quantity_must_be_positive(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Booking.objects.create(user=self.user, show=self.show, quantity=0, total_price=Decimal('0.00'))
+
+
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # replica_1 stands in for a replica: the one DATABASE_REPLICAS configures
+    # (a test mirror of the primary), or else a second connection to the test
+    # database added here. Either way it is in `databases` before setUpClass,
+    # which only allows queries on those aliases.
+    databases = {'default', 'replica_1'} if 'replica_1' in settings.DATABASES else {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.added_replica = 'replica_1' not in connections.settings
+        if cls.added_replica:
+            connections.settings['replica_1'] = dict(connections['default'].settings_dict, TEST={'MIRROR': 'default'})
+            cls.databases = cls.databases | {'replica_1'}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.added_replica:
+            connections['replica_1'].close()
+            del connections['replica_1']
+            del connections.settings['replica_1']
+            cls.databases = cls.databases - {'replica_1'}
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Needs a test database that a second connection can open.")
+        cache.clear() # The show catalogue is cached between requests
+        replicas._pool = None # Fresh health checks
+        self.user = User.objects.create_user(username='rita', password='pw')
+        self.show = make_show()
+        book_seats(self.user, self.show, 1)
+        self.client.force_login(self.user)
+
+    def replica_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connections['replica_1']) as queries:
+            response = getattr(self.client, method)(url, data)
+        return response, [q['sql'] for q in queries.captured_queries]
+
+    def test_read_only_views_read_from_the_replica(self):
+        response, queries = self.replica_queries('get', reverse('booking_history'))
+        self.assertContains(response, self.show.title)
+        self.assertTrue(any('bookings_booking' in sql for sql in queries))
+        self.assertFalse(any('django_session' in sql for sql in queries)) # Sessions stay on the primary
+
+    def test_booking_pins_the_client_to_the_primary(self):
+        response, queries = self.replica_queries('post', reverse('show_detail', kwargs={'pk': self.show.pk}), {'quantity': 1})
+        self.assertEqual(queries, [])
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        response, queries = self.replica_queries('get', reverse('booking_history'))
+        self.assertEqual(queries, [])
+        self.assertEqual(len(response.context['bookings']), 2)
+
+    def test_expired_pin_reads_from_the_replica_again(self):
+        self.client.cookies[replicas.PIN_COOKIE] = '1'
+        _, queries = self.replica_queries('get', reverse('booking_history'))
+        self.assertNotEqual(queries, [])
+
+    def test_unhealthy_replica_is_skipped(self):
+        replicas.get_pool().probe = lambda alias, max_lag: False
+        response, queries = self.replica_queries('get', reverse('booking_history'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
@@ -1,7 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from .views import BookingHistoryView, BookingConfirmationView
+from .views import (
+    BookingHistoryView, AsyncBookingHistoryView, BookingConfirmationView, HoldDetailView, HoldReleaseView,
+    CartView, CartRemoveView, BookingCancelView,
+)
+
+# ASGI deployments serve the history page with the async view
+history_view = AsyncBookingHistoryView if settings.ASYNC_VIEWS else BookingHistoryView
 
 urlpatterns = [
-    path('history/', BookingHistoryView.as_view(), name='booking_history'),
+    path('history/', history_view.as_view(), name='booking_history'),
     path('confirmation/', BookingConfirmationView.as_view(), name='booking_confirmation'),
+    path('<int:pk>/cancel/', BookingCancelView.as_view(), name='booking_cancel'),
+    path('holds/<int:pk>/', HoldDetailView.as_view(), name='hold_detail'),
+    path('holds/<int:pk>/release/', HoldReleaseView.as_view(), name='hold_release'),
+    path('cart/', CartView.as_view(), name='cart'),
+    path('cart/<int:pk>/remove/', CartRemoveView.as_view(), name='cart_remove'),
 ]
\ No newline at end of file
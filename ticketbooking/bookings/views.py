@@ -1,20 +1,169 @@
-from django.shortcuts import render
+import uuid
+
+from django.shortcuts import render, redirect, get_object_or_404
+from django.views import View
 from django.views.generic import ListView, TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin # Require user to be logged in
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+from django.views.decorators.csrf import csrf_protect
+from django.utils.decorators import method_decorator
+from django.urls import reverse
+from django.utils import timezone
+
+from ticket_booking_system.pagination import KeysetPaginationMixin, KeysetPaginator, InvalidCursor
+from ticket_booking_system.asyncviews import auser
+from shows.models import Show
+from .models import Booking, SeatHold
+from .services import confirm_hold, release_hold, checkout, cancel_booking, BookingError
+from . import cart
+
+def history_queryset(user):
+    # Return only the given user's confirmed bookings (an index range on
+    # user, status, booking_time), joining the show in the same query and
+    # loading only the columns the template uses
+    return (
+        Booking.objects.filter(user=user, status=Booking.CONFIRMED)
+        .select_related('show')
+        .only(
+            'id', 'quantity', 'total_price', 'booking_time', 'seats',
+            'show__id', 'show__title', 'show__date_time', 'show__location',
+        )
+    )
 
-from .models import Booking
 
-class BookingHistoryView(LoginRequiredMixin, ListView):
+class BookingHistoryView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Booking
     template_name = 'bookings/booking_history.html'
     context_object_name = 'bookings'
+    keyset_ordering = ('-booking_time', '-id') # Newest first, id breaks ties
 
     def get_queryset(self):
-        # Return only bookings for the current logged-in user
-        return Booking.objects.filter(user=self.request.user).order_by('-booking_time')
+        return history_queryset(self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['now'] = timezone.now() # Bookings for shows that have not started can be cancelled
+        context['errors'] = self.request.session.pop('history_errors', [])
+        return context
+
+
+class AsyncBookingHistoryView(KeysetPaginationMixin, View):
+    # Async twin of BookingHistoryView for ASGI deployments (see settings.ASYNC_VIEWS)
+    template_name = BookingHistoryView.template_name
+    keyset_ordering = BookingHistoryView.keyset_ordering
+
+    async def get(self, request):
+        user = await auser(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        paginator = KeysetPaginator(history_queryset(user), self.keyset_ordering, self.get_page_size())
+        try:
+            page = await paginator.apage(request.GET.get('after'))
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        context = {
+            'bookings': page.items, 'page': page, 'page_size': paginator.page_size,
+            'now': timezone.now(), 'errors': await request.session.apop('history_errors', []),
+        }
+        return render(request, self.template_name, context)
 
 
 class BookingConfirmationView(TemplateView):
     template_name = 'bookings/booking_confirmation.html'
     # This is a simple success page. Could be enhanced to show booking details
-    # by passing the booking ID in the redirect URL and fetching it here.
\ No newline at end of file
+    # by passing the booking ID in the redirect URL and fetching it here.
+
+
+@method_decorator(csrf_protect, name='post')
+class HoldDetailView(LoginRequiredMixin, View):
+    # Second step of the hold flow: show the reserved seats with the time left
+    # and let the user confirm them.
+    template_name = 'bookings/hold_detail.html'
+
+    def get_hold(self, request, pk):
+        # Users can only see and confirm their own holds
+        return get_object_or_404(SeatHold.objects.select_related('show'), pk=pk, user=request.user)
+
+    def get(self, request, pk):
+        hold = self.get_hold(request, pk)
+        context = {
+            'hold': hold,
+            'errors': request.session.pop('hold_errors', []),
+        }
+        return render(request, self.template_name, context)
+
+    def post(self, request, pk):
+        hold = self.get_hold(request, pk)
+        try:
+            confirm_hold(hold)
+        except BookingError as e:
+            request.session['booking_errors'] = [str(e)]
+            return redirect(reverse('show_detail', kwargs={'pk': hold.show_id}))
+        return redirect(reverse('booking_confirmation'))
+
+
+@method_decorator(csrf_protect, name='post')
+class HoldReleaseView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        hold = get_object_or_404(SeatHold, pk=pk, user=request.user)
+        release_hold(hold)
+        return redirect(reverse('show_detail', kwargs={'pk': hold.show_id}))
+
+
+@method_decorator(csrf_protect, name='post')
+class BookingCancelView(LoginRequiredMixin, View):
+    # Users can cancel their own bookings until the show starts
+    def post(self, request, pk):
+        booking = get_object_or_404(Booking.objects.select_related('show'), pk=pk, user=request.user)
+        if booking.show.date_time <= timezone.now():
+            request.session['history_errors'] = ["Bookings cannot be cancelled once the show has started."]
+        else:
+            try:
+                cancel_booking(booking)
+            except BookingError as e:
+                request.session['history_errors'] = [str(e)]
+        return redirect(reverse('booking_history'))
+
+
+@method_decorator(csrf_protect, name='post')
+class CartView(LoginRequiredMixin, View):
+    # The cart page; posting it checks out every line in one transaction
+    # (see services.checkout()).
+    template_name = 'bookings/cart.html'
+
+    def get(self, request):
+        lines = cart.get_lines(request.session)
+        shows = Show.objects.filter(pk__in=lines, is_active=True).only(
+            'id', 'title', 'date_time', 'location', 'price', 'available_seats',
+        ).order_by('date_time', 'id')
+        items = [{'show': show, 'quantity': lines[show.pk], 'subtotal': lines[show.pk] * show.price} for show in shows]
+        unavailable = len(lines) - len(items) # Shows cancelled or deleted since they were added
+        if unavailable:
+            # Dropped from the cart, or checkout would fail on them with nothing to remove
+            cart.save_lines(request.session, {item['show'].pk: item['quantity'] for item in items})
+        context = {
+            'items': items,
+            'total': sum(item['subtotal'] for item in items),
+            'unavailable': unavailable,
+            'errors': request.session.pop('cart_errors', []),
+            'idempotency_key': uuid.uuid4().hex, # One key per rendered form, so a double submit books only once
+        }
+        return render(request, self.template_name, context)
+
+    def post(self, request):
+        lines = cart.get_lines(request.session)
+        try:
+            checkout(request.user, lines, idempotency_key=request.POST.get('idempotency_key') or None)
+        except BookingError as e:
+            request.session['cart_errors'] = [str(e)]
+            return redirect(reverse('cart'))
+        cart.clear(request.session)
+        return redirect(reverse('booking_confirmation'))
+
+
+@method_decorator(csrf_protect, name='post')
+class CartRemoveView(LoginRequiredMixin, View):
+    def post(self, request, pk):
+        cart.remove(request.session, pk)
+        return redirect(reverse('cart'))
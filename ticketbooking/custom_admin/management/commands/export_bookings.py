@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from custom_admin import booking_export
+
+
+class Command(BaseCommand):
+    help = "Stream bookings to CSV for finance reconciliation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help="First booking day, YYYY-MM-DD (inclusive).")
+        parser.add_argument('--to', dest='date_to', help="Last booking day, YYYY-MM-DD (inclusive).")
+        parser.add_argument('--show', type=int, help="Only bookings for this show ID.")
+        parser.add_argument('--chunk-size', type=int, default=booking_export.EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', help="File to write to. Defaults to standard output.")
+
+    def handle(self, *args, **options):
+        try:
+            date_from = booking_export.parse_date(options['date_from'], 'from date')
+            date_to = booking_export.parse_date(options['date_to'], 'to date')
+        except booking_export.InvalidFilter as e:
+            raise CommandError(str(e))
+
+        bookings = booking_export.filter_bookings(date_from, date_to, options['show'])
+        out = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for line in booking_export.export_lines(bookings, chunk_size=options['chunk_size']):
+                out.write(line)
+        finally:
+            if options['output']:
+                out.close()
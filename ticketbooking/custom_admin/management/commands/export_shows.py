@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from custom_admin import show_io
+
+
+class Command(BaseCommand):
+    help = "Stream every show to CSV or JSON lines (same columns as import_shows)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', help="File to write to. Defaults to standard output.")
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for line in show_io.export_lines(options['format']):
+                out.write(line)
+        finally:
+            if options['output']:
+                out.close()
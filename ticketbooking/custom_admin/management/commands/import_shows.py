@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from custom_admin import show_io
+
+
+class Command(BaseCommand):
+    help = "Bulk import shows from a CSV or JSON-lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help="Defaults to the file extension (.jsonl/.ndjson = JSON lines, else CSV).")
+        parser.add_argument('--batch-size', type=int, default=show_io.IMPORT_BATCH_SIZE)
+        parser.add_argument('--partial', action='store_true', help="Import the valid lines even if some are invalid.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        started = time.perf_counter()
+        try:
+            with open(path, 'rb') as stream:
+                result = show_io.import_shows(
+                    stream, file_format=file_format, batch_size=options['batch_size'], partial=options['partial'],
+                )
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        elapsed = time.perf_counter() - started
+
+        for line, messages in result.errors:
+            self.stderr.write(f"line {line}: {' '.join(messages)}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more invalid lines")
+        if not result.committed:
+            raise CommandError(f"Nothing imported: {result.error_count} of {result.rows} lines are invalid.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} of {result.rows} shows in {elapsed:.1f}s."
+        ))
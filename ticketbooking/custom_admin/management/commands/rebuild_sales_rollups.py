@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from shows.models import Show
+from custom_admin import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard sales rollups from bookings, a chunk of shows at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Shows per transaction.")
+        parser.add_argument('--show', type=int, action='append', dest='shows', help="Only rebuild these show ids.")
+
+    def handle(self, *args, **options):
+        shows = Show.objects.order_by('pk')
+        if options['shows']:
+            shows = shows.filter(pk__in=options['shows'])
+
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            # Walk show ids by keyset so each chunk is a cheap index range scan
+            chunk = list(shows.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['chunk_size']])
+            if not chunk:
+                break
+            rebuilt += rollups.rebuild(chunk)
+            last_pk = chunk[-1]
+            self.stdout.write(f"Rebuilt {rebuilt} shows...")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups for {rebuilt} shows."))
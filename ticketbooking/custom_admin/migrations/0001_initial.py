@@ -0,0 +1,44 @@
+# Generated by Django 5.2 on 2026-10-18 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('shows', '0003_waiting_room'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShowSalesRollup',
+            fields=[
+                ('show', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_rollup', serialize=False, to='shows.show')),
+                ('bookings', models.IntegerField(default=0)),
+                ('tickets_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'ordering': ['-revenue'],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('bookings', models.IntegerField(default=0)),
+                ('tickets_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_sales', to='shows.show')),
+            ],
+            options={
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['hour'], name='custom_admi_hour_fb1a15_idx')],
+                'constraints': [models.UniqueConstraint(fields=('show', 'hour'), name='unique_show_hour_rollup')],
+            },
+        ),
+    ]
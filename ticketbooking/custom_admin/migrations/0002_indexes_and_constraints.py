@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_admin', '0001_initial'),
+        ('shows', '0004_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='showsalesrollup',
+            index=models.Index(fields=['-revenue'], name='custom_admi_revenue_8a2b51_idx'),
+        ),
+    ]
@@ -1,3 +1,49 @@
 from django.db import models
+from shows.models import Show
 
-# Create your models here.
+# Sales rollups for the admin dashboard. They are updated incrementally as
+# bookings are made or cancelled (see custom_admin/rollups.py) so the dashboard
+# never has to SUM() over the whole Booking table. The rebuild_sales_rollups
+# command recomputes them from bookings for backfill and drift repair.
+
+class ShowSalesRollup(models.Model):
+    show = models.OneToOneField(Show, on_delete=models.CASCADE, primary_key=True, related_name='sales_rollup')
+    bookings = models.IntegerField(default=0)
+    tickets_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Sales for {self.show.title}: {self.tickets_sold} tickets"
+
+    @property
+    def sell_through(self):
+        # Percentage of the show's seats sold
+        if not self.show.total_seats:
+            return 0
+        return 100 * self.tickets_sold / self.show.total_seats
+
+    class Meta:
+        ordering = ['-revenue']
+        indexes = [
+            models.Index(fields=['-revenue']), # Dashboard top shows
+        ]
+
+
+class HourlySalesRollup(models.Model):
+    show = models.ForeignKey(Show, on_delete=models.CASCADE, related_name='hourly_sales')
+    hour = models.DateTimeField() # Start of the hour, in UTC
+    bookings = models.IntegerField(default=0)
+    tickets_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Sales for {self.show.title} at {self.hour:%Y-%m-%d %H:00}"
+
+    class Meta:
+        ordering = ['-hour']
+        constraints = [
+            models.UniqueConstraint(fields=['show', 'hour'], name='unique_show_hour_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['hour']), # Dashboard "bookings per hour" window
+        ]
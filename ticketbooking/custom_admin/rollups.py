@@ -0,0 +1,133 @@
+"""
+Incremental maintenance of the sales rollups behind the admin dashboard.
+
+Booking code calls booking_created()/booking_cancelled() inside the same
+transaction that writes the booking, so the rollups move exactly in step with
+the Booking table.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from shows.models import Show
+from bookings.models import Booking
+from .models import ShowSalesRollup, HourlySalesRollup
+
+
+def truncate_hour(value):
+    return value.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _bump(model, lookup, deltas):
+    # UPDATE ... SET x = x + n; create the row the first time, and fall back to
+    # the UPDATE if a concurrent transaction created it first.
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(**updates)
+
+
+def _reduce(model, lookup, deltas):
+    # UPDATE ... SET x = x - n, only on an existing row with at least n left.
+    # Returns False if no row qualified: the rollup was already off.
+    guards = {f'{field}__gte': -value for field, value in deltas.items()}
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    return bool(model.objects.filter(**lookup, **guards).update(**updates))
+
+
+def apply_bookings(bookings, sign=1):
+    """
+    Add (sign=1) or remove (sign=-1) bookings from the rollups.
+
+    Removing never creates a row or takes one below zero. A show whose rollup
+    rows are missing or too small is rebuilt from the Booking table instead,
+    so removed bookings must no longer be confirmed there.
+    """
+    per_show = defaultdict(lambda: [0, 0, Decimal('0')])
+    per_hour = defaultdict(lambda: [0, 0, Decimal('0')])
+    for booking in bookings:
+        for key, totals in (
+            (booking.show_id, per_show),
+            ((booking.show_id, truncate_hour(booking.booking_time)), per_hour),
+        ):
+            totals[key][0] += sign
+            totals[key][1] += sign * booking.quantity
+            totals[key][2] += sign * Decimal(booking.total_price)
+
+    # Fixed (show, hour) order so concurrent transactions lock rows in the same order
+    stale = set() # Shows to rebuild
+    for show_id, (count, tickets, revenue) in sorted(per_show.items()):
+        deltas = {'bookings': count, 'tickets_sold': tickets, 'revenue': revenue}
+        if sign > 0:
+            _bump(ShowSalesRollup, {'show_id': show_id}, deltas)
+        elif not _reduce(ShowSalesRollup, {'show_id': show_id}, deltas):
+            stale.add(show_id)
+    for (show_id, hour), (count, tickets, revenue) in sorted(per_hour.items()):
+        deltas = {'bookings': count, 'tickets_sold': tickets, 'revenue': revenue}
+        if sign > 0:
+            _bump(HourlySalesRollup, {'show_id': show_id, 'hour': hour}, deltas)
+        elif show_id not in stale and not _reduce(HourlySalesRollup, {'show_id': show_id, 'hour': hour}, deltas):
+            stale.add(show_id)
+    if stale:
+        rebuild(sorted(stale))
+
+
+def booking_created(booking):
+    apply_bookings([booking], sign=1)
+
+
+def booking_cancelled(booking):
+    apply_bookings([booking], sign=-1)
+
+
+def rebuild(show_ids):
+    """
+    Recompute the rollups of the given shows from the Booking table.
+    The show rows are locked for the duration, which holds off new bookings
+    for exactly these shows so the rebuilt numbers cannot miss one.
+    """
+    with transaction.atomic():
+        show_ids = list(Show.objects.select_for_update().filter(pk__in=show_ids).values_list('pk', flat=True))
+        bookings = Booking.objects.filter(show_id__in=show_ids, status=Booking.CONFIRMED).order_by()
+        totals = bookings.values('show_id').annotate(
+            count=Count('id'), tickets=Sum('quantity'), revenue=Sum('total_price'),
+        )
+        hourly = bookings.annotate(
+            hour=TruncHour('booking_time', tzinfo=datetime.timezone.utc),
+        ).values('show_id', 'hour').annotate(
+            count=Count('id'), tickets=Sum('quantity'), revenue=Sum('total_price'),
+        )
+
+        ShowSalesRollup.objects.filter(show_id__in=show_ids).delete()
+        HourlySalesRollup.objects.filter(show_id__in=show_ids).delete()
+        ShowSalesRollup.objects.bulk_create([
+            ShowSalesRollup(show_id=row['show_id'], bookings=row['count'],
+                            tickets_sold=row['tickets'], revenue=row['revenue'])
+            for row in totals
+        ])
+        HourlySalesRollup.objects.bulk_create([
+            HourlySalesRollup(show_id=row['show_id'], hour=row['hour'], bookings=row['count'],
+                              tickets_sold=row['tickets'], revenue=row['revenue'])
+            for row in hourly
+        ], batch_size=1000)
+    return len(show_ids)
+
+
+def bookings_per_hour(hours=24):
+    """Bookings, tickets and revenue per hour across all shows, oldest first."""
+    since = truncate_hour(timezone.now()) - datetime.timedelta(hours=hours - 1)
+    return list(
+        HourlySalesRollup.objects.filter(hour__gte=since)
+        .values('hour')
+        .annotate(bookings=Sum('bookings'), tickets=Sum('tickets_sold'), revenue=Sum('revenue'))
+        .order_by('hour')
+    )
@@ -0,0 +1,192 @@
+"""
+Bulk show import and export (CSV or JSON lines).
+
+Both directions stream: the import reads one line at a time and inserts in
+bulk_create batches, the export yields rows straight from a server-side
+iterator. Memory use is bounded by the batch size, not the file size.
+
+Columns: title, description, date (YYYY-MM-DD), time (HH:MM), location,
+total_seats, price, is_active (optional, defaults to true).
+"""
+import csv
+import io
+import json
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from shows.models import Show
+from shows import catalogue
+from ticket_booking_system.pagination import keyset_iterator
+from .validation import validate_show_fields
+
+FIELDS = ['title', 'description', 'date', 'time', 'location', 'total_seats', 'price', 'is_active']
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+EXPORT_CHUNK_SIZE = 2000
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'off', 'n', 'f'}
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.rows = 0
+        self.error_count = 0
+        self.errors = [] # (line number, [messages]), capped at MAX_REPORTED_ERRORS
+        self.committed = False
+
+    def add_error(self, line, messages):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, messages))
+
+
+class ImportAborted(Exception):
+    pass
+
+
+def read_rows(stream, file_format):
+    """Yield (line number, dict) from a binary or text stream."""
+    if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)) or hasattr(stream, 'readinto'):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'jsonl':
+        for number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, None
+                continue
+            yield number, row if isinstance(row, dict) else None
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # line_num is the physical line, so quoted multi-line descriptions still report correctly
+            yield reader.line_num, row
+
+
+def clean_row(row):
+    """Validate one imported row. Returns (Show or None, errors)."""
+    if row is None:
+        return None, ["Line is not a valid record."]
+
+    def value(name):
+        raw = row.get(name)
+        return '' if raw is None else str(raw).strip()
+
+    title, description, location = value('title'), value('description'), value('location')
+    date_time, total_seats, price, errors = validate_show_fields(
+        title, description, value('date'), value('time'), location, value('total_seats'), value('price'),
+    )
+    is_active = value('is_active').lower() or 'true'
+    if is_active not in TRUE_VALUES | FALSE_VALUES:
+        errors.append("Invalid value for Is Active. Use true or false.")
+    if errors:
+        return None, errors
+    return Show(
+        title=title,
+        description=description,
+        date_time=date_time,
+        location=location,
+        total_seats=total_seats,
+        available_seats=total_seats, # bulk_create skips Show.save(), so set this here
+        price=price,
+        is_active=is_active in TRUE_VALUES,
+    ), []
+
+
+def insert_batch(batch, result):
+    # One bulk INSERT for the batch of (line number, Show). Should the database
+    # still reject it, the rows are retried one by one so the failing lines are
+    # reported like any other invalid line.
+    try:
+        with transaction.atomic():
+            Show.objects.bulk_create([show for _, show in batch])
+        result.created += len(batch)
+        return
+    except DatabaseError:
+        pass
+    for line, show in batch:
+        try:
+            with transaction.atomic():
+                Show.objects.bulk_create([show])
+            result.created += 1
+        except DatabaseError as e:
+            result.add_error(line, [f"Could not be saved: {e}"])
+
+
+def import_shows(stream, file_format='csv', batch_size=IMPORT_BATCH_SIZE, partial=False):
+    """
+    Import shows from `stream` in one transaction.
+
+    With partial=False (the default) nothing is saved if any line is invalid;
+    otherwise valid lines are saved and invalid ones are only reported.
+    """
+    result = ImportResult()
+    batch = []
+    try:
+        with transaction.atomic():
+            for line, row in read_rows(stream, file_format):
+                result.rows += 1
+                show, errors = clean_row(row)
+                if errors:
+                    result.add_error(line, errors)
+                    continue
+                if result.error_count and not partial:
+                    continue # Keep validating to report errors, but stop inserting
+                batch.append((line, show))
+                if len(batch) >= batch_size:
+                    insert_batch(batch, result)
+                    batch = []
+            if batch and (partial or not result.error_count):
+                insert_batch(batch, result)
+            if result.error_count and not partial:
+                raise ImportAborted()
+            # bulk_create does not send post_save, so invalidate the catalogue once here
+            catalogue.catalogue_changed()
+    except ImportAborted:
+        result.created = 0
+        return result
+    result.committed = True
+    return result
+
+
+def export_rows():
+    """Yield every show as a dict with the import columns."""
+    current_tz = timezone.get_current_timezone()
+    shows = Show.objects.values_list(
+        'pk', 'title', 'description', 'date_time', 'location', 'total_seats', 'price', 'is_active',
+    )
+    for _, title, description, date_time, location, total_seats, price, is_active in keyset_iterator(shows, EXPORT_CHUNK_SIZE):
+        local = timezone.localtime(date_time, current_tz)
+        yield {
+            'title': title,
+            'description': description,
+            'date': local.strftime('%Y-%m-%d'),
+            'time': local.strftime('%H:%M'),
+            'location': location,
+            'total_seats': total_seats,
+            'price': str(price),
+            'is_active': 'true' if is_active else 'false',
+        }
+
+
+class LineBuffer:
+    # csv.writer wants a file; this one just hands back what was written
+    def write(self, value):
+        return value
+
+
+def export_lines(file_format='csv'):
+    """Yield the export one encoded line at a time."""
+    if file_format == 'jsonl':
+        for row in export_rows():
+            yield json.dumps(row) + '\n'
+        return
+    writer = csv.DictWriter(LineBuffer(), fieldnames=FIELDS)
+    yield writer.writeheader()
+    for row in export_rows():
+        yield writer.writerow(row)
@@ -1,3 +1,420 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, DatabaseError
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from shows.models import Show
+from shows import shards
+from bookings.models import Booking
+from bookings.services import place_hold, book_seats, confirm_hold, cancel_booking
+from .models import ShowSalesRollup, HourlySalesRollup
+from . import rollups
+from . import show_io
+from . import booking_export
+from ticket_booking_system import metrics
+from ticket_booking_system.queryplans import captured_full_scans
+
+
+def make_show(**kwargs):
+    defaults = {
+        'title': "Test Show",
+        'description': "A show used in tests",
+        'date_time': timezone.now() + timezone.timedelta(days=7),
+        'location': "Main Hall",
+        'total_seats': 10,
+        'available_seats': 10,
+        'price': Decimal('25.00'),
+    }
+    defaults.update(kwargs)
+    return Show.objects.create(**defaults)
+
+
+class AdminDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.client.force_login(self.admin)
+
+    def test_dashboard_shows_hold_metrics(self):
+        place_hold(self.admin, make_show(), 2)
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['hold_metrics']['active'], 1)
+
+    def test_booking_list_query_count_is_constant(self):
+        for i in range(12):
+            user = User.objects.create_user(username=f"customer{i}", password='pw')
+            Booking.objects.create(user=user, show=make_show(title=f"Show {i}"), quantity=1, total_price=Decimal('25.00'))
+        url = reverse('admin_booking_list')
+        with self.assertNumQueries(3) as small:
+            self.client.get(url, {'page_size': 3})
+        with self.assertNumQueries(len(small.captured_queries)):
+            response = self.client.get(url, {'page_size': 12})
+        self.assertContains(response, "customer11")
+
+    def test_show_list_shows_delete_errors_once(self):
+        show = make_show()
+        Booking.objects.create(user=self.admin, show=show, quantity=1, total_price=Decimal('25.00'))
+        self.client.post(reverse('admin_show_delete', kwargs={'pk': show.pk}))
+        self.assertContains(self.client.get(reverse('admin_show_list')), "as it has associated bookings")
+        self.assertNotContains(self.client.get(reverse('admin_show_list')), "as it has associated bookings")
+
+    def test_admin_cancels_bookings_and_shows(self):
+        show = make_show(total_seats=10)
+        first = book_seats(self.admin, show, 2)
+        book_seats(self.admin, show, 3)
+        self.client.post(reverse('admin_booking_cancel', kwargs={'pk': first.pk}))
+        self.assertContains(self.client.get(reverse('admin_booking_list')), "Cancelled")
+        show.refresh_from_db()
+        self.assertEqual(show.available_seats, 7)
+
+        self.assertRedirects(self.client.post(reverse('admin_show_cancel', kwargs={'pk': show.pk})),
+                             reverse('admin_show_list'))
+        show.refresh_from_db()
+        self.assertEqual((show.is_active, show.available_seats), (False, 10))
+        self.assertEqual(set(Booking.objects.values_list('status', flat=True)), {Booking.CANCELLED})
+        export = b"".join(self.client.get(reverse('admin_booking_export')).streaming_content).decode()
+        self.assertIn(",cancelled,", export)
+
+    def test_show_update_moves_seats_by_the_change_in_total(self):
+        show = make_show(total_seats=10)
+        sharded = make_show(title="Sharded", total_seats=10)
+        shards.set_shards(sharded, 2)
+        for s in (show, sharded):
+            book_seats(self.admin, s, 4)
+            data = {'title': s.title, 'description': s.description, 'date': '2030-01-01', 'time': '20:00',
+                    'location': s.location, 'total_seats': '12', 'price': '25.00', 'is_active': 'on'}
+            self.assertRedirects(self.client.post(reverse('admin_show_update', kwargs={'pk': s.pk}), data),
+                                 reverse('admin_show_list'))
+            s.refresh_from_db()
+            self.assertEqual((s.total_seats, s.available_seats, shards.available_seats(s)), (12, 8, 8))
+            data['total_seats'] = '3'
+            response = self.client.post(reverse('admin_show_update', kwargs={'pk': s.pk}), data)
+            self.assertContains(response, "already booked (4)")
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='fred', password='pw')
+        self.show = make_show(total_seats=20)
+
+    def test_bookings_update_rollups_incrementally(self):
+        book_seats(self.user, self.show, 2)
+        confirm_hold(place_hold(self.user, self.show, 3))
+        rollup = ShowSalesRollup.objects.get(show=self.show)
+        self.assertEqual((rollup.bookings, rollup.tickets_sold), (2, 5))
+        self.assertEqual(rollup.revenue, Decimal('125.00'))
+        self.assertEqual(rollup.sell_through, 25)
+        self.assertEqual(rollups.bookings_per_hour()[-1]['tickets'], 5)
+
+        rollups.booking_cancelled(Booking.objects.filter(quantity=2).get())
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.bookings, rollup.tickets_sold), (1, 3))
+
+    def test_cancelling_without_rollup_rows_rebuilds_them(self):
+        kept = book_seats(self.user, self.show, 2)
+        cancelled = book_seats(self.user, self.show, 3)
+        ShowSalesRollup.objects.all().delete()
+        HourlySalesRollup.objects.all().delete()
+        cancel_booking(cancelled)
+        rollup = ShowSalesRollup.objects.get(show=self.show)
+        self.assertEqual((rollup.bookings, rollup.tickets_sold, rollup.revenue), (1, 2, kept.total_price))
+        self.assertEqual(HourlySalesRollup.objects.get(show=self.show).tickets_sold, 2)
+
+        ShowSalesRollup.objects.filter(show=self.show).update(tickets_sold=1) # Less than the booking holds
+        cancel_booking(kept)
+        self.assertFalse(ShowSalesRollup.objects.filter(bookings__lt=0).exists())
+        self.assertFalse(HourlySalesRollup.objects.filter(tickets_sold__lt=0).exists())
+        self.assertFalse(ShowSalesRollup.objects.filter(show=self.show).exists())
+
+    def test_rebuild_repairs_drift(self):
+        book_seats(self.user, self.show, 4)
+        # Bookings written behind the service's back (e.g. before rollups existed)
+        Booking.objects.create(user=self.user, show=self.show, quantity=1, total_price=Decimal('25.00'),
+                               booking_time=timezone.now() - timezone.timedelta(hours=3))
+        ShowSalesRollup.objects.filter(show=self.show).update(tickets_sold=99)
+
+        call_command('rebuild_sales_rollups', chunk_size=1, stdout=open(os.devnull, 'w'))
+        rollup = ShowSalesRollup.objects.get(show=self.show)
+        self.assertEqual((rollup.bookings, rollup.tickets_sold), (2, 5))
+        self.assertEqual(HourlySalesRollup.objects.filter(show=self.show).count(), 2)
+
+    def test_dashboard_reads_rollups_not_bookings(self):
+        admin = User.objects.create_superuser(username='boss', password='pw')
+        book_seats(self.user, self.show, 2)
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin_dashboard'))
+        self.assertContains(response, "10.0%")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('admin_dashboard'))
+        self.assertFalse(any('bookings_booking' in q['sql'] for q in queries.captured_queries))
+
+
+class ShowImportExportTests(TestCase):
+    HEADER = "title,description,date,time,location,total_seats,price,is_active\n"
+
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.client.force_login(self.admin)
+
+    def csv_file(self, *lines):
+        return io.BytesIO((self.HEADER + "".join(lines)).encode())
+
+    def test_csv_import_creates_shows_in_batches(self):
+        lines = [f"Show {i},Desc,2030-01-0{i % 9 + 1},19:30,Hall,{i + 1},12.50,\n" for i in range(7)]
+        result = show_io.import_shows(self.csv_file(*lines), batch_size=3)
+        self.assertTrue(result.committed)
+        self.assertEqual((result.created, result.rows), (7, 7))
+        show = Show.objects.get(title="Show 4")
+        self.assertEqual((show.total_seats, show.available_seats, show.is_active), (5, 5, True))
+
+    def test_invalid_line_aborts_whole_import_with_line_number(self):
+        result = show_io.import_shows(self.csv_file(
+            "Good,Desc,2030-01-01,19:30,Hall,10,5.00,true\n",
+            "Bad,Desc,2030-13-01,19:30,Hall,-1,5.00,maybe\n",
+        ))
+        self.assertFalse(result.committed)
+        self.assertEqual(result.created, 0)
+        self.assertEqual(result.errors[0][0], 3)
+        self.assertEqual(len(result.errors[0][1]), 3) # date, seats and is_active
+        self.assertFalse(Show.objects.exists())
+
+    def test_partial_import_keeps_valid_lines(self):
+        result = show_io.import_shows(self.csv_file(
+            "Good,Desc,2030-01-01,19:30,Hall,10,5.00,false\n",
+            ",Desc,2030-01-01,19:30,Hall,10,5.00,\n",
+        ), partial=True)
+        self.assertTrue(result.committed)
+        self.assertEqual((result.created, result.error_count), (1, 1))
+        self.assertFalse(Show.objects.get().is_active)
+
+    def test_prices_and_lengths_are_checked_per_line(self):
+        result = show_io.import_shows(self.csv_file(
+            "Good,Desc,2030-01-01,19:30,Hall,10,5.00,\n",
+            "NaN,Desc,2030-01-01,19:30,Hall,10,nan,\n",
+            "Inf,Desc,2030-01-01,19:30,Hall,10,inf,\n",
+            "Huge,Desc,2030-01-01,19:30,Hall,10,1e12,\n",
+            "Cents,Desc,2030-01-01,19:30,Hall,10,1.005,\n",
+            f"{'T' * 256},Desc,2030-01-01,19:30,Hall,10,5.00,\n",
+            "Seats,Desc,2030-01-01,19:30,Hall,99999999999999999999,5.00,\n",
+        ), partial=True)
+        self.assertTrue(result.committed)
+        self.assertEqual(result.created, 1)
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5, 6, 7, 8])
+        self.assertEqual(Show.objects.get().price, Decimal('5.00'))
+
+        upload = SimpleUploadedFile('shows.csv', self.csv_file("NaN,Desc,2030-01-01,19:30,Hall,10,nan,\n").getvalue())
+        response = self.client.post(reverse('admin_show_import'), {'file': upload, 'format': 'csv'})
+        self.assertContains(response, "Price must be a number.")
+
+    def test_rows_the_database_rejects_are_reported(self):
+        bulk_create = Show.objects.bulk_create
+
+        def reject_boom(shows, *args, **kwargs):
+            if any(show.title == "Boom" for show in shows):
+                raise DatabaseError("rejected")
+            return bulk_create(shows, *args, **kwargs)
+
+        with mock.patch.object(Show.objects, 'bulk_create', side_effect=reject_boom):
+            result = show_io.import_shows(self.csv_file(
+                "A,Desc,2030-01-01,19:30,Hall,10,5.00,\n",
+                "Boom,Desc,2030-01-01,19:30,Hall,10,5.00,\n",
+                "B,Desc,2030-01-01,19:30,Hall,10,5.00,\n",
+            ), partial=True)
+        self.assertEqual((result.created, result.errors[0][0]), (2, 3))
+        self.assertEqual(sorted(Show.objects.values_list('title', flat=True)), ["A", "B"])
+
+    def test_jsonl_import_reports_unparseable_lines(self):
+        good = json.dumps({'title': "J", 'description': "D", 'date': "2030-02-01", 'time': "20:00",
+                           'location': "Hall", 'total_seats': 8, 'price': "9.99"})
+        result = show_io.import_shows(io.BytesIO(f"{good}\n\nnot json\n".encode()), 'jsonl', partial=True)
+        self.assertEqual((result.created, result.errors[0][0]), (1, 3))
+
+    def test_import_invalidates_catalogue(self):
+        self.assertEqual(self.client.get(reverse('show_list')).context['shows'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            show_io.import_shows(self.csv_file("New,Desc,2030-01-01,19:30,Hall,10,5.00,\n"))
+        self.assertEqual(len(self.client.get(reverse('show_list')).context['shows']), 1)
+
+    def test_import_view_and_export_round_trip(self):
+        upload = SimpleUploadedFile('shows.csv', self.csv_file(
+            'Quoted,"Line one\nline two, with comma",2030-03-01,18:00,Hall,20,15.00,true\n',
+        ).getvalue())
+        response = self.client.post(reverse('admin_show_import'), {'file': upload, 'format': 'csv'})
+        self.assertContains(response, "Imported 1 of 1 shows.")
+
+        response = self.client.get(reverse('admin_show_export'))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="shows.csv"')
+        exported = b"".join(response.streaming_content)
+        Show.objects.all().delete()
+        result = show_io.import_shows(io.BytesIO(exported))
+        self.assertEqual(result.created, 1)
+        self.assertEqual(Show.objects.get().description, "Line one\nline two, with comma")
+
+
+class BookingExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.client.force_login(self.admin)
+        self.user = User.objects.create_user(username='fan', password='pw', email='fan@example.com')
+        self.show = make_show()
+        self.other = make_show(title="Other Show")
+        now = timezone.now()
+        for days_ago, show in ((0, self.show), (1, self.show), (10, self.show), (1, self.other)):
+            Booking.objects.create(user=self.user, show=show, quantity=2, total_price=Decimal('50.00'),
+                                   booking_time=now - timezone.timedelta(days=days_ago))
+
+    def export(self, **params):
+        response = self.client.get(reverse('admin_booking_export'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+
+    def test_exports_every_booking_across_chunks(self):
+        rows = booking_export.export_lines(Booking.objects.all(), chunk_size=1)
+        rows = list(csv.reader(io.StringIO("".join(rows))))
+        self.assertEqual(rows[0], booking_export.HEADER)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual([row[0] for row in rows[1:]], sorted(row[0] for row in rows[1:]))
+
+    def test_filters_by_date_range_and_show(self):
+        today = timezone.localdate()
+        since_yesterday = (today - timezone.timedelta(days=1)).isoformat()
+        rows = self.export(**{'from': since_yesterday, 'to': today.isoformat()})
+        self.assertEqual(len(rows) - 1, 3)
+        rows = self.export(**{'from': since_yesterday, 'show': self.show.pk})
+        self.assertEqual(len(rows) - 1, 2)
+        self.assertEqual({row[5] for row in rows[1:]}, {str(self.show.pk)})
+        self.assertEqual(rows[1][3:5], ['fan', 'fan@example.com'])
+
+    def test_invalid_filter_is_rejected(self):
+        response = self.client.get(reverse('admin_booking_export'), {'from': '2024-31-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            list(booking_export.export_lines(Booking.objects.all(), chunk_size=2))
+        self.assertEqual(len(queries), 3) # Two full chunks and a short one, no per-row lookups
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        metrics.REGISTRY.reset()
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.show = make_show()
+
+    def scrape(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_records_latency_queries_templates_and_cache_per_view(self):
+        self.client.get(reverse('show_list'))
+        self.client.get(reverse('show_list'))
+        text = self.scrape()
+        self.assertIn('ticketbooking_requests_total{view="show_list",method="GET",status="2xx"} 2', text)
+        self.assertIn('ticketbooking_request_duration_seconds_count{view="show_list"} 2', text)
+        self.assertIn('ticketbooking_request_duration_seconds_bucket{view="show_list",le="+Inf"} 2', text)
+        self.assertIn('ticketbooking_catalogue_cache_total{view="show_list",result="hits"} 1', text)
+        self.assertIn('ticketbooking_catalogue_cache_total{view="show_list",result="misses"} 1', text)
+        self.client.logout()
+        metrics.REGISTRY.reset()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('show_detail', kwargs={'pk': self.show.pk}))
+        view = metrics.REGISTRY.views['show_detail']
+        self.assertEqual(view.queries.sum, len(queries))
+        self.assertGreater(view.template_seconds, 0)
+
+    def test_unmatched_urls_share_one_label(self):
+        self.client.get('/no-such-page/')
+        self.assertIn('view="unmatched",method="GET",status="4xx"', self.scrape())
+
+    def test_scrape_adds_up_every_worker(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            other = metrics.Registry() # Another worker, whose file is flushed as pid + 1
+            other.observe('show_list', 'GET', 200, 0.01, metrics.RequestMetrics())
+            metrics.write_snapshot(metrics.worker_file(os.getpid() + 1), other.snapshot())
+            self.client.get(reverse('show_list'))
+            self.assertTrue(os.path.exists(metrics.worker_file(os.getpid()))) # This worker's, for the others
+            text = self.scrape()
+            self.assertIn('ticketbooking_requests_total{view="show_list",method="GET",status="2xx"} 2', text)
+            self.assertIn('ticketbooking_request_duration_seconds_count{view="show_list"} 2', text)
+
+            metrics.retire_worker(os.getpid() + 1) # It exited: its counts stay in the totals
+            self.assertFalse(os.path.exists(metrics.worker_file(os.getpid() + 1)))
+            self.assertIn('ticketbooking_requests_total{view="show_list",method="GET",status="2xx"} 2', self.scrape())
+
+            metrics.start_sharing() # A new server run starts from zero
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_endpoint_is_superuser_only(self):
+        user = User.objects.create_user(username='fan', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('admin_metrics')).status_code, 302)
+
+    @override_settings(QUERY_BUDGETS={'show_list': 0})
+    def test_exceeding_a_query_budget_logs_a_warning(self):
+        with self.assertLogs('ticket_booking_system.metrics', 'WARNING') as logs:
+            self.client.get(reverse('show_list'))
+        self.assertIn("(show_list) ran", logs.output[0])
+        self.assertIn('ticketbooking_query_budget_exceeded_total{view="show_list"} 1', self.scrape())
+
+    def test_public_pages_stay_within_their_budgets(self):
+        user = User.objects.create_user(username='fan', password='pw')
+        book_seats(user, self.show, 1)
+        self.client.force_login(user)
+        with self.assertNoLogs('ticket_booking_system.metrics', 'WARNING'):
+            self.client.get(reverse('show_list'))
+            self.client.get(reverse('show_detail', kwargs={'pk': self.show.pk}))
+            self.client.get(reverse('show_availability', kwargs={'pk': self.show.pk}))
+            self.client.get(reverse('booking_history'))
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.admin = User.objects.create_superuser(username='admin', password='pw')
+        self.show = make_show(total_seats=100)
+        for _ in range(3):
+            book_seats(self.admin, self.show, 1)
+        self.client.force_login(self.admin)
+
+    def assertNoFullScans(self, send):
+        with CaptureQueriesContext(connection) as queries:
+            send()
+        self.assertEqual(captured_full_scans(queries.captured_queries), {})
+
+    def test_admin_pages(self):
+        self.assertNoFullScans(lambda: self.client.get(reverse('admin_dashboard')))
+        self.assertNoFullScans(lambda: self.client.get(reverse('admin_show_list')))
+        url = reverse('admin_booking_list')
+        cursor = self.client.get(url, {'page_size': 2}).context['page'].next_cursor
+        self.assertNoFullScans(lambda: self.client.get(url, {'page_size': 2, 'after': cursor}))
+
+    def test_delete_guard(self):
+        self.assertNoFullScans(lambda: self.client.post(reverse('admin_show_delete', kwargs={'pk': self.show.pk})))
+        self.assertTrue(Show.objects.filter(pk=self.show.pk).exists())
+
+    def test_filtered_booking_export(self):
+        today = timezone.localdate().isoformat()
+        for params in ({'from': today, 'to': today}, {'from': today, 'show': self.show.pk}):
+            self.assertNoFullScans(
+                lambda: b"".join(self.client.get(reverse('admin_booking_export'), params).streaming_content)
+            )
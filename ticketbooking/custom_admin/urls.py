@@ -5,7 +5,13 @@ from .views import (
     AdminShowCreateView,
     AdminShowUpdateView,
     AdminShowDeleteView,
+    AdminShowCancelView,
+    AdminShowImportView,
+    AdminShowExportView,
     AdminBookingListView,
+    AdminBookingCancelView,
+    AdminBookingExportView,
+    AdminMetricsView,
 )
 
 urlpatterns = [
@@ -14,5 +20,11 @@ urlpatterns = [
     path('shows/create/', AdminShowCreateView.as_view(), name='admin_show_create'),
     path('shows/<int:pk>/update/', AdminShowUpdateView.as_view(), name='admin_show_update'),
     path('shows/<int:pk>/delete/', AdminShowDeleteView.as_view(), name='admin_show_delete'),
+    path('shows/<int:pk>/cancel/', AdminShowCancelView.as_view(), name='admin_show_cancel'),
+    path('shows/import/', AdminShowImportView.as_view(), name='admin_show_import'),
+    path('shows/export/', AdminShowExportView.as_view(), name='admin_show_export'),
     path('bookings/', AdminBookingListView.as_view(), name='admin_booking_list'),
+    path('bookings/export/', AdminBookingExportView.as_view(), name='admin_booking_export'),
+    path('bookings/<int:pk>/cancel/', AdminBookingCancelView.as_view(), name='admin_booking_cancel'),
+    path('metrics/', AdminMetricsView.as_view(), name='admin_metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,86 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from shows.models import Show
+
+
+def field_errors(name, value):
+    # What the model field's own validators (max_digits, the column's integer range) say about `value`
+    try:
+        Show._meta.get_field(name).run_validators(value)
+    except ValidationError as e:
+        return list(e.messages)
+    return []
+
+
+def validate_show_fields(title, description, date_str, time_str, location, total_seats_str, price_str):
+    """
+    Validation shared by the create/update views and the bulk show import.
+    Takes the stripped string values and returns (date_time, total_seats, price, errors).
+    """
+    errors = []
+    date_time = None
+    total_seats = None
+    price = None
+
+    # Manual Validation
+    if not title:
+        errors.append("Title is required.")
+    if not description:
+        errors.append("Description is required.")
+    if not date_str:
+        errors.append("Date is required.")
+    if not time_str:
+        errors.append("Time is required.")
+    if not location:
+        errors.append("Location is required.")
+    if not total_seats_str:
+        errors.append("Total Seats is required.")
+    if not price_str:
+         errors.append("Price is required.")
+    # Longer text would only fail (or be truncated) in the database
+    for label, value, name in (("Title", title, 'title'), ("Location", location, 'location')):
+        max_length = Show._meta.get_field(name).max_length
+        if len(value) > max_length:
+            errors.append(f"{label} must be at most {max_length} characters.")
+
+    # Validate and parse date/time
+    if date_str and time_str:
+        try:
+            # Assuming YYYY-MM-DD and HH:MM format
+            datetime_str = f"{date_str} {time_str}"
+            # Use a format string that matches expected input
+            date_time = datetime.datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
+            # Make the datetime timezone-aware (using settings.TIME_ZONE)
+            date_time = timezone.make_aware(date_time, timezone.get_current_timezone())
+        except ValueError:
+            errors.append("Invalid date or time format. Use YYYY-MM-DD and HH:MM.")
+
+    # Validate and parse total_seats
+    if total_seats_str:
+        try:
+            total_seats = int(total_seats_str)
+            if total_seats <= 0:
+                errors.append("Total Seats must be a positive integer.")
+            else:
+                errors.extend(f"Total Seats: {message}" for message in field_errors('total_seats', total_seats))
+        except ValueError:
+            errors.append("Invalid value for Total Seats.")
+
+    # Validate and parse price
+    if price_str:
+         try:
+             price = Decimal(price_str) # Exact, as stored
+             if not price.is_finite():
+                 errors.append("Price must be a number.") # nan, inf
+             elif price < 0:
+                 errors.append("Price cannot be negative.")
+             else:
+                 errors.extend(f"Price: {message}" for message in field_errors('price', price))
+         except InvalidOperation:
+             errors.append("Invalid value for Price.")
+
+    return date_time, total_seats, price, errors
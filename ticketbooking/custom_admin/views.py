@@ -1,4 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseBadRequest
 from django.views import View
 from django.views.generic import ListView, TemplateView, RedirectView
 from django.urls import reverse_lazy, reverse
@@ -6,10 +7,21 @@ from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import user_passes_test # Decorator to check user permissions
 from django.views.decorators.csrf import csrf_protect
 from django.utils import timezone
+from django.db import transaction
 import datetime # Import datetime module for parsing
 
 from shows.models import Show
 from bookings.models import Booking
+from bookings.services import hold_metrics, cancel_booking, cancel_show, BookingError
+from shows import catalogue
+from shows import shards
+from . import rollups
+from .validation import validate_show_fields
+from . import show_io
+from . import booking_export
+from .models import ShowSalesRollup
+from ticket_booking_system.pagination import KeysetPaginationMixin
+from ticket_booking_system import metrics
 
 # Helper function to check if a user is a superuser (our custom admin check)
 def is_superuser(user):
@@ -23,14 +35,34 @@ admin_required = method_decorator(user_passes_test(is_superuser), name='dispatch
 class AdminDashboardView(TemplateView):
     template_name = 'custom_admin/admin_dashboard.html'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Seat hold outcomes over the last day (conversion vs expiry)
+        context['hold_metrics'] = hold_metrics(since=timezone.now() - datetime.timedelta(days=1))
+        # Catalogue cache hit/miss counters for this worker process
+        context['catalogue_stats'] = catalogue.stats()
+        # Sales, served from the incrementally maintained rollup tables
+        context['show_sales'] = ShowSalesRollup.objects.select_related('show').only(
+            'bookings', 'tickets_sold', 'revenue', 'show__title', 'show__date_time', 'show__total_seats',
+        )[:50]
+        context['hourly_sales'] = rollups.bookings_per_hour(hours=24)
+        return context
+
 
 @admin_required
-class AdminShowListView(ListView):
+class AdminShowListView(KeysetPaginationMixin, ListView):
     model = Show
     template_name = 'custom_admin/shows/show_list_admin.html'
     context_object_name = 'shows'
     # Order by date/time by default, include inactive shows
-    queryset = Show.objects.all().order_by('date_time')
+    keyset_ordering = ('date_time', 'id')
+    queryset = Show.objects.defer('description') # The list never shows descriptions
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Errors left by AdminShowDeleteView, shown once
+        context['admin_show_errors'] = self.request.session.pop('admin_show_errors', [])
+        return context
 
 
 @admin_required
@@ -53,58 +85,9 @@ class AdminShowCreateView(View):
         price_str = request.POST.get('price', '').strip()
         is_active = request.POST.get('is_active') == 'on' # Check if checkbox is checked
 
-        errors = []
-        date_time = None
-        total_seats = None
-        price = None
-
-        # Manual Validation
-        if not title:
-            errors.append("Title is required.")
-        if not description:
-            errors.append("Description is required.")
-        if not date_str:
-            errors.append("Date is required.")
-        if not time_str:
-            errors.append("Time is required.")
-        if not location:
-            errors.append("Location is required.")
-        if not total_seats_str:
-            errors.append("Total Seats is required.")
-        if not price_str:
-             errors.append("Price is required.")
-
-        # Validate and parse date/time
-        if date_str and time_str:
-            try:
-                # Assuming YYYY-MM-DD and HH:MM format
-                datetime_str = f"{date_str} {time_str}"
-                # Use a format string that matches expected input
-                date_time = datetime.datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
-                # Make the datetime timezone-aware (using settings.TIME_ZONE)
-                date_time = timezone.make_aware(date_time, timezone.get_current_timezone())
-            except ValueError:
-                errors.append("Invalid date or time format. Use YYYY-MM-DD and HH:MM.")
-
-
-        # Validate and parse total_seats
-        if total_seats_str:
-            try:
-                total_seats = int(total_seats_str)
-                if total_seats <= 0:
-                    errors.append("Total Seats must be a positive integer.")
-            except ValueError:
-                errors.append("Invalid value for Total Seats.")
-
-        # Validate and parse price
-        if price_str:
-             try:
-                 price = float(price_str) # Use float for parsing decimal
-                 if price < 0:
-                     errors.append("Price cannot be negative.")
-             except ValueError:
-                 errors.append("Invalid value for Price.")
-
+        date_time, total_seats, price, errors = validate_show_fields(
+            title, description, date_str, time_str, location, total_seats_str, price_str,
+        )
 
         if errors:
             # Re-render template with errors and submitted data
@@ -185,56 +168,36 @@ class AdminShowUpdateView(View):
         total_seats_str = request.POST.get('total_seats', '').strip()
         price_str = request.POST.get('price', '').strip()
         is_active = request.POST.get('is_active') == 'on' # Check if checkbox is checked
-
-        errors = []
-        date_time = None
-        total_seats = None
-        price = None
-
-        # Manual Validation (similar to create view)
-        if not title:
-            errors.append("Title is required.")
-        if not description:
-            errors.append("Description is required.")
-        if not date_str:
-            errors.append("Date is required.")
-        if not time_str:
-            errors.append("Time is required.")
-        if not location:
-            errors.append("Location is required.")
-        if not total_seats_str:
-            errors.append("Total Seats is required.")
-        if not price_str:
-             errors.append("Price is required.")
-
-        if date_str and time_str:
+        queue_enabled = request.POST.get('queue_enabled') == 'on'
+        queue_rate_str = request.POST.get('queue_rate', '').strip()
+
+        queue_rate = show.queue_rate
+
+        # Manual Validation (same rules as the create view)
+        date_time, total_seats, price, errors = validate_show_fields(
+            title, description, date_str, time_str, location, total_seats_str, price_str,
+        )
+
+        if total_seats is not None:
+            # Important validation: Cannot reduce total seats below booked quantity
+            available_seats = shards.available_seats(show) # Summed from the seat shards if it has them
+            booked_quantity = show.total_seats - available_seats
+            if total_seats < booked_quantity:
+                 errors.append(f"Cannot reduce total seats below the number of tickets already booked ({booked_quantity}).")
+            # Seat-mapped shows get their capacity from the seat map
+            if show.has_seat_map and total_seats != show.total_seats:
+                 errors.append("Total Seats is set by the show's seat map and cannot be edited here.")
+
+        # Waiting room admission rate, only required when the queue is turned on
+        if queue_rate_str:
             try:
-                datetime_str = f"{date_str} {time_str}"
-                date_time = datetime.datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
-                date_time = timezone.make_aware(date_time, timezone.get_current_timezone())
+                queue_rate = int(queue_rate_str)
+                if queue_rate <= 0:
+                    errors.append("Queue admissions per second must be a positive integer.")
             except ValueError:
-                errors.append("Invalid date or time format. Use YYYY-MM-DD and HH:MM.")
-
-        if total_seats_str:
-            try:
-                total_seats = int(total_seats_str)
-                if total_seats <= 0:
-                    errors.append("Total Seats must be a positive integer.")
-                # Important validation: Cannot reduce total seats below booked quantity
-                booked_quantity = show.total_seats - show.available_seats
-                if total_seats < booked_quantity:
-                     errors.append(f"Cannot reduce total seats below the number of tickets already booked ({booked_quantity}).")
-
-            except ValueError:
-                errors.append("Invalid value for Total Seats.")
-
-        if price_str:
-             try:
-                 price = float(price_str)
-                 if price < 0:
-                     errors.append("Price cannot be negative.")
-             except ValueError:
-                 errors.append("Invalid value for Price.")
+                errors.append("Invalid value for queue admissions per second.")
+        elif queue_enabled:
+            errors.append("Queue admissions per second is required when the waiting room is on.")
 
 
         if errors:
@@ -250,32 +213,57 @@ class AdminShowUpdateView(View):
                 'total_seats_str': total_seats_str,
                 'price_str': price_str,
                 'is_active': is_active,
+                'queue_enabled': queue_enabled,
+                'queue_rate_str': queue_rate_str,
             }
             return render(request, self.template_name, context)
 
         # If validation passes, update the Show object
         try:
-            # Calculate change in available seats based on change in total seats
-            old_total_seats = show.total_seats
-            new_total_seats = total_seats # Use the validated integer
-
-            # Update the show object fields
-            show.title = title
-            show.description = description
-            show.date_time = date_time # Use the validated datetime object
-            show.location = location
-            show.total_seats = new_total_seats
-            # Recalculate available seats based on the *change* in total seats
-            # available_seats = old_available + (new_total - old_total)
-            show.available_seats += (new_total_seats - old_total_seats)
-            show.price = price # Use the validated float
-            show.is_active = is_active
-
-            # Ensure available_seats doesn't accidentally go below zero (should be caught by total_seats validation, but double-check)
-            if show.available_seats < 0:
-                 show.available_seats = 0 # Or raise a more specific error
-
-            show.save()
+            with transaction.atomic():
+                # Re-read under the lock: the seat counts above may be stale by
+                # now, and saving them would undo bookings made meanwhile
+                show = Show.objects.select_for_update().get(pk=pk)
+                new_total_seats = total_seats # Use the validated integer
+                # Available seats move by the *change* in total seats
+                seats_added = new_total_seats - show.total_seats
+                booked_quantity = show.total_seats - shards.available_seats(show)
+                available_seats = new_total_seats - booked_quantity
+                if available_seats < 0:
+                    # Booked past the new total since the form was validated
+                    errors.append(f"Cannot reduce total seats below the number of tickets already booked ({booked_quantity}).")
+                else:
+                    # Update the show object fields
+                    show.title = title
+                    show.description = description
+                    show.date_time = date_time # Use the validated datetime object
+                    show.location = location
+                    show.total_seats = new_total_seats
+                    show.available_seats = available_seats # For sharded shows, the total of the shards adjusted below
+                    show.price = price # Use the validated Decimal
+                    show.is_active = is_active
+                    show.queue_enabled = queue_enabled
+                    show.queue_rate = queue_rate
+                    show.save()
+                    if show.seat_shards and seats_added:
+                        shards.adjust(show, seats_added) # Locks the shards after the show, like every other seat change
+
+            if errors:
+                context = {
+                    'show': show,
+                    'errors': errors,
+                    'title': title,
+                    'description': description,
+                    'date_str': date_str,
+                    'time_str': time_str,
+                    'location': location,
+                    'total_seats_str': total_seats_str,
+                    'price_str': price_str,
+                    'is_active': is_active,
+                    'queue_enabled': queue_enabled,
+                    'queue_rate_str': queue_rate_str,
+                }
+                return render(request, self.template_name, context)
 
             # Redirect to the admin show list
             return redirect(reverse_lazy('admin_show_list'))
@@ -292,6 +280,8 @@ class AdminShowUpdateView(View):
                 'total_seats_str': total_seats_str,
                 'price_str': price_str,
                 'is_active': is_active,
+                'queue_enabled': queue_enabled,
+                'queue_rate_str': queue_rate_str,
             }
              return render(request, self.template_name, context)
 
@@ -308,7 +298,9 @@ class AdminShowDeleteView(View):
         # Optional: Add checks like "only delete if no bookings exist"
         if Booking.objects.filter(show=show).exists():
              # Handle error - maybe redirect back with a message
-             request.session['admin_show_errors'] = [f"Cannot delete show '{show.title}' as it has associated bookings."]
+             request.session['admin_show_errors'] = [
+                 f"Cannot delete show '{show.title}' as it has associated bookings. Cancel the show to cancel its bookings instead."
+             ]
              return redirect(reverse_lazy('admin_show_list'))
 
 
@@ -324,9 +316,112 @@ class AdminShowDeleteView(View):
 
 
 @admin_required
-class AdminBookingListView(ListView):
+@method_decorator(csrf_protect, name='post') # Protect the POST method
+class AdminShowImportView(View):
+    # Bulk create shows from a CSV or JSON-lines upload (see custom_admin/show_io.py)
+    template_name = 'custom_admin/shows/show_import_admin.html'
+
+    def get(self, request):
+        return render(request, self.template_name, {'fields': show_io.FIELDS})
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        file_format = request.POST.get('format', 'csv')
+        partial = request.POST.get('partial') == 'on'
+
+        errors = []
+        if not upload:
+            errors.append("Please choose a file to import.")
+        if file_format not in ('csv', 'jsonl'):
+            errors.append("Format must be CSV or JSON lines.")
+        if errors:
+            return render(request, self.template_name, {'errors': errors, 'fields': show_io.FIELDS})
+
+        result = show_io.import_shows(upload.file, file_format=file_format, partial=partial)
+        context = {
+            'result': result,
+            'fields': show_io.FIELDS,
+            'format': file_format,
+            'partial': partial,
+        }
+        return render(request, self.template_name, context)
+
+
+@admin_required
+class AdminShowExportView(View):
+    def get(self, request):
+        file_format = 'jsonl' if request.GET.get('format') == 'jsonl' else 'csv'
+        content_type = 'application/x-ndjson' if file_format == 'jsonl' else 'text/csv'
+        response = StreamingHttpResponse(show_io.export_lines(file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="shows.{file_format}"'
+        return response
+
+
+@admin_required
+@method_decorator(csrf_protect, name='post')
+class AdminShowCancelView(View):
+    # Takes the show off sale and cancels all of its bookings and holds in
+    # one transaction (see bookings.services.cancel_show())
+    def post(self, request, pk):
+        show = get_object_or_404(Show, pk=pk)
+        cancel_show(show)
+        return redirect(reverse_lazy('admin_show_list'))
+
+
+@admin_required
+@method_decorator(csrf_protect, name='post')
+class AdminBookingCancelView(View):
+    # Admins can cancel any booking, whenever the show is
+    def post(self, request, pk):
+        booking = get_object_or_404(Booking, pk=pk)
+        try:
+            cancel_booking(booking)
+        except BookingError as e:
+            request.session['admin_booking_errors'] = [str(e)]
+        return redirect(reverse_lazy('admin_booking_list'))
+
+
+@admin_required
+class AdminBookingListView(KeysetPaginationMixin, ListView):
     model = Booking
     template_name = 'custom_admin/bookings/booking_list_admin.html'
     context_object_name = 'bookings'
     # Order by newest booking first
-    queryset = Booking.objects.all().order_by('-booking_time')
\ No newline at end of file
+    keyset_ordering = ('-booking_time', '-id')
+    # Join show and user up front instead of one query per row in the template
+    queryset = Booking.objects.select_related('show', 'user').only(
+        'id', 'quantity', 'total_price', 'booking_time', 'seats', 'status',
+        'show__id', 'show__title', 'show__date_time', 'show__location',
+        'user__id', 'user__username',
+    )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Errors left by AdminBookingCancelView, shown once
+        context['admin_booking_errors'] = self.request.session.pop('admin_booking_errors', [])
+        return context
+
+@admin_required
+class AdminBookingExportView(View):
+    # Streams every matching booking as CSV. Filters: ?from=YYYY-MM-DD&to=YYYY-MM-DD&show=<id>
+    def get(self, request):
+        try:
+            date_from = booking_export.parse_date(request.GET.get('from'), 'from date')
+            date_to = booking_export.parse_date(request.GET.get('to'), 'to date')
+            show_id = int(request.GET['show']) if request.GET.get('show') else None
+        except booking_export.InvalidFilter as e:
+            return HttpResponseBadRequest(str(e))
+        except ValueError:
+            return HttpResponseBadRequest("Invalid show.")
+
+        bookings = booking_export.filter_bookings(date_from, date_to, show_id)
+        response = StreamingHttpResponse(booking_export.export_lines(bookings), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="bookings.csv"'
+        return response
+
+
+@admin_required
+class AdminMetricsView(View):
+    # Request metrics of every server worker (see METRICS_DIR), for Prometheus to scrape
+    def get(self, request):
+        return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,285 @@
+"""
+Read-through cache for the public show catalogue.
+
+Cached show data is keyed by a catalogue version number. Any change to a show
+made by an admin (or any Show.save()/delete(), see shows/signals.py) bumps the
+version, so every older entry simply stops being read and ages out.
+The public show list (a search, see shows/search.py) is cached the same way.
+
+Seat counts change far more often than the rest of the catalogue, so they are
+cached separately per show with a short timeout, under a per-show seat version
+that every booking, hold or sweep bumps. Changing seat counts therefore never
+invalidates the catalogue itself. A seat count read before a change committed
+is stored under the old seat version, so it can never be served after it.
+The seat count of a sharded show (shows/shards.py) is summed from its shards.
+
+The two versions together also make a cheap validator for the JSON
+availability API: availability_etag() reads nothing but version numbers from
+the cache.
+
+Cached shows carry their dates already formatted for display, see
+shows/rendering.py.
+
+Everything read here is cached under the current versions, so it is always
+read from the primary database: a lagging replica's copy would otherwise be
+served until the next version bump.
+
+The a-prefixed functions at the end are the same reads for async views, using
+the async cache and ORM APIs.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Sum
+from django.dispatch import Signal
+
+from ticket_booking_system import metrics
+from .models import Show, SeatShard
+from . import rendering
+
+VERSION_KEY = 'catalogue:version'
+MISSING = 'missing' # Cached marker for "no such active show"
+
+# Sent after commit whenever seat counts or the catalogue change, with
+# show_ids=[...] or show_ids=None for "any show" (see shows/live.py).
+availability_changed = Signal()
+
+_stats = {'hits': 0, 'misses': 0, 'seat_hits': 0, 'seat_misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _record(name, count=1):
+    with _stats_lock:
+        _stats[name] += count
+    metrics.record_cache(name, count) # Per-view counts for the metrics endpoint
+
+
+def stats():
+    """Hit/miss counters for this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _initial_version():
+    # Start from the clock rather than 1, so a version key that was evicted
+    # can never come back as a number that older entries were stored under.
+    return int(time.time() * 1000)
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError: # Key missing (never set or evicted)
+        return get_version()
+
+
+def primary_shows():
+    return Show.objects.using(DEFAULT_DB_ALIAS)
+
+
+def _key(version, name):
+    return f'catalogue:v{version}:{name}'
+
+
+def _seat_version_key(show_id):
+    return f'catalogue:seatver:{show_id}'
+
+
+def _seat_key(show_id, seat_version):
+    return f'catalogue:seats:{show_id}:{seat_version}'
+
+
+def seat_versions(show_ids):
+    """The current seat version of each show, from the cache alone."""
+    keys = {_seat_version_key(show_id): show_id for show_id in show_ids}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, _initial_version(), timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        versions[key] = cache.get(key)
+    return {show_id: versions[key] for key, show_id in keys.items()}
+
+
+def bump_seat_versions(show_ids):
+    for show_id in show_ids:
+        try:
+            cache.incr(_seat_version_key(show_id))
+        except ValueError: # Missing keys start from the clock on the next read anyway
+            pass
+
+
+def availability_etag(show_ids):
+    """
+    A strong ETag for the availability of `show_ids`, which changes whenever
+    any of their seat counts or the catalogue itself changes.
+    """
+    versions = seat_versions(show_ids)
+    tag = f'{get_version()}:' + ','.join(f'{pk}.{versions[pk]}' for pk in show_ids)
+    return '"%s"' % hashlib.md5(tag.encode()).hexdigest()
+
+
+def availability_dict(show):
+    return {
+        'id': show.pk,
+        'available_seats': show.available_seats,
+        'total_seats': show.total_seats,
+        'sold_out': show.available_seats <= 0,
+    }
+
+
+def _seat_shard_totals(show_ids):
+    return (
+        SeatShard.objects.using(DEFAULT_DB_ALIAS).filter(show_id__in=show_ids).order_by()
+        .values_list('show_id').annotate(seats=Sum('available_seats'))
+    )
+
+
+def seat_shard_totals(show_ids):
+    """{show id: unreserved seats} for sharded shows, summed from their seat shards (shows/shards.py)."""
+    if not show_ids:
+        return {}
+    return dict(_seat_shard_totals(show_ids))
+
+
+def overlay_seats(shows):
+    """Set the current seat counts on cached Show objects."""
+    if not shows:
+        return shows
+    versions = seat_versions({show.pk for show in shows})
+    keys = {_seat_key(show.pk, versions[show.pk]): show for show in shows}
+    cached = cache.get_many(keys)
+    _record('seat_hits', len(cached))
+    missing = {show.pk: key for key, show in keys.items() if key not in cached}
+    if missing:
+        _record('seat_misses', len(missing))
+        rows = list(primary_shows().filter(pk__in=missing).values_list('pk', 'available_seats', 'seat_shards'))
+        fresh = {pk: seats for pk, seats, _ in rows}
+        fresh.update(seat_shard_totals([pk for pk, _, seat_shards in rows if seat_shards]))
+        fresh = {missing[pk]: seats for pk, seats in fresh.items()}
+        cache.set_many(fresh, timeout=settings.CATALOGUE_SEATS_TIMEOUT)
+        cached.update(fresh)
+    for key, show in keys.items():
+        if key in cached:
+            show.available_seats = cached[key]
+    return shows
+
+
+def seats_changed(show_ids):
+    """Retire the given shows' cached seat counts once the current transaction commits."""
+    show_ids = list(show_ids)
+
+    def invalidate():
+        bump_seat_versions(show_ids)
+        availability_changed.send(sender=Show, show_ids=show_ids)
+
+    transaction.on_commit(invalidate)
+
+
+def catalogue_changed(show_ids=()):
+    """Invalidate the whole catalogue (and the given shows' seat counts) on commit."""
+    show_ids = list(show_ids)
+
+    def invalidate():
+        bump_seat_versions(show_ids)
+        bump_version()
+        availability_changed.send(sender=Show, show_ids=show_ids or None)
+
+    transaction.on_commit(invalidate)
+
+
+def get_active_show(pk):
+    """A single active show, or None if it does not exist or is hidden."""
+    return get_active_shows_by_id([pk]).get(pk)
+
+
+def get_active_shows_by_id(show_ids):
+    """{pk: Show} for the active shows among `show_ids`, in one cache round trip when warm."""
+    version = get_version()
+    keys = {_key(version, f'show:{pk}'): pk for pk in show_ids}
+    cached = cache.get_many(keys)
+    _record('hits', len(cached))
+    missing = {pk: key for key, pk in keys.items() if key not in cached}
+    if missing:
+        _record('misses', len(missing))
+        found = {show.pk: show for show in primary_shows().filter(is_active=True, pk__in=missing)}
+        rendering.precompute(found.values()) # Cached with the dates already formatted
+        fresh = {key: found.get(pk, MISSING) for pk, key in missing.items()}
+        cache.set_many(fresh, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        cached.update(fresh)
+    shows = {keys[key]: show for key, show in cached.items() if show != MISSING}
+    overlay_seats(list(shows.values()))
+    return shows
+
+
+# Async versions of the reads above, for the async views (see shows/views.py)
+
+async def aget_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, _initial_version(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+async def aseat_versions(show_ids):
+    keys = {_seat_version_key(show_id): show_id for show_id in show_ids}
+    versions = await cache.aget_many(keys)
+    for key in keys.keys() - versions.keys():
+        await cache.aadd(key, _initial_version(), timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        versions[key] = await cache.aget(key)
+    return {show_id: versions[key] for key, show_id in keys.items()}
+
+
+async def aoverlay_seats(shows):
+    if not shows:
+        return shows
+    versions = await aseat_versions({show.pk for show in shows})
+    keys = {_seat_key(show.pk, versions[show.pk]): show for show in shows}
+    cached = await cache.aget_many(keys)
+    _record('seat_hits', len(cached))
+    missing = {show.pk: key for key, show in keys.items() if key not in cached}
+    if missing:
+        _record('seat_misses', len(missing))
+        rows = [
+            row async for row in
+            primary_shows().filter(pk__in=missing).values_list('pk', 'available_seats', 'seat_shards')
+        ]
+        fresh = {pk: seats for pk, seats, _ in rows}
+        sharded = [pk for pk, _, seat_shards in rows if seat_shards]
+        if sharded:
+            fresh.update({pk: seats async for pk, seats in _seat_shard_totals(sharded)})
+        fresh = {missing[pk]: seats for pk, seats in fresh.items()}
+        await cache.aset_many(fresh, timeout=settings.CATALOGUE_SEATS_TIMEOUT)
+        cached.update(fresh)
+    for key, show in keys.items():
+        if key in cached:
+            show.available_seats = cached[key]
+    return shows
+
+
+async def aget_active_show(pk):
+    version = await aget_version()
+    key = _key(version, f'show:{pk}')
+    show = await cache.aget(key)
+    if show is None:
+        _record('misses')
+        show = await primary_shows().filter(is_active=True, pk=pk).afirst() or MISSING
+        if show != MISSING:
+            rendering.precompute([show])
+        await cache.aset(key, show, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+    else:
+        _record('hits')
+    if show == MISSING:
+        return None
+    return (await aoverlay_seats([show]))[0]
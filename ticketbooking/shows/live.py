@@ -0,0 +1,173 @@
+"""
+Live seat availability for server-sent event streams.
+
+One Hub per event loop (so one per ASGI worker) tracks which shows the open
+streams are watching. Booking, hold, sweep and admin writes announce the shows
+they touched through catalogue.availability_changed (see shows/signals.py); the
+hub then reads the new seat counts once, from the catalogue cache, and hands
+them to every subscribed stream. No stream ever queries the database itself.
+
+Writes made by other processes are picked up by comparing the catalogue and
+per-show seat versions in the shared cache every LIVE_POLL_INTERVAL seconds:
+one cache read per hub, not one per connection.
+
+Each Subscription keeps only the latest payload per show, so a slow client or
+a hot show can never queue up more than one pending update per show, and a
+stream sends at most LIVE_MAX_UPDATES_PER_SECOND batches per second.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import catalogue
+
+
+def fetch_availability(show_ids):
+    """Current seat versions and availability payloads for `show_ids`."""
+    versions = version_tokens(show_ids)
+    shows = catalogue.get_active_shows_by_id(show_ids)
+    payloads = {
+        pk: catalogue.availability_dict(shows[pk]) if pk in shows else {'id': pk, 'not_found': True}
+        for pk in show_ids
+    }
+    return versions, payloads
+
+
+def version_tokens(show_ids):
+    # (catalogue version, seat version) per show, from the cache alone
+    version = catalogue.get_version()
+    return {pk: (version, seat_version) for pk, seat_version in catalogue.seat_versions(show_ids).items()}
+
+
+class Subscription:
+    def __init__(self, show_ids, max_rate):
+        self.show_ids = frozenset(show_ids)
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.pending = {} # show_id -> latest payload; a newer one replaces an unsent one
+        self.coalesced = 0 # Updates replaced before they were sent
+        self.event = asyncio.Event()
+        self.last_sent = 0.0
+
+    def offer(self, show_id, payload):
+        if show_id in self.pending:
+            self.coalesced += 1
+        self.pending[show_id] = payload
+        self.event.set()
+
+    async def next(self, timeout):
+        """Wait for the next batch of updates. Returns [] after `timeout` seconds without one."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        wait = self.last_sent + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait) # Anything arriving meanwhile is coalesced into pending
+        self.event.clear()
+        updates, self.pending = list(self.pending.values()), {}
+        self.last_sent = time.monotonic()
+        return updates
+
+
+class Hub:
+    def __init__(self, poll_interval=None, max_rate=None):
+        self.poll_interval = poll_interval or settings.LIVE_POLL_INTERVAL
+        self.max_rate = max_rate or settings.LIVE_MAX_UPDATES_PER_SECOND
+        self.subscribers = {} # show_id -> set of Subscription
+        self.versions = {} # show_id -> last version token published
+        self.dirty = set()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def subscribe(self, show_ids):
+        subscription = Subscription(show_ids, self.max_rate)
+        for pk in subscription.show_ids:
+            self.subscribers.setdefault(pk, set()).add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for pk in subscription.show_ids:
+            subscribers = self.subscribers.get(pk)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscribers[pk]
+                self.versions.pop(pk, None)
+                self.dirty.discard(pk)
+
+    def mark_dirty(self, show_ids):
+        # Runs on the hub's event loop; None means every watched show
+        if show_ids is None:
+            self.dirty.update(self.subscribers)
+        else:
+            self.dirty.update(pk for pk in show_ids if pk in self.subscribers)
+        if self.dirty:
+            self.wakeup.set()
+
+    async def run(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                await self.check_versions()
+            self.wakeup.clear()
+            if self.dirty:
+                await self.publish()
+                # Bursts of writes to a hot show collapse into one read per interval
+                await asyncio.sleep(1 / self.max_rate)
+
+    async def check_versions(self):
+        # Catch writes made by other processes through the shared cache
+        watched = list(self.subscribers)
+        if not watched:
+            return
+        tokens = await sync_to_async(version_tokens, thread_sensitive=False)(watched)
+        self.dirty.update(pk for pk, token in tokens.items() if pk in self.versions and self.versions[pk] != token)
+
+    async def publish(self):
+        show_ids, self.dirty = list(self.dirty), set()
+        versions, payloads = await sync_to_async(fetch_availability)(show_ids)
+        for pk in show_ids:
+            if self.versions.get(pk) == versions[pk]:
+                continue # Already sent (e.g. announced directly and then seen in the cache)
+            self.versions[pk] = versions[pk]
+            for subscription in self.subscribers.get(pk, ()):
+                subscription.offer(pk, payloads[pk])
+
+    async def snapshot(self, show_ids):
+        """Current availability of `show_ids`, for a newly opened stream."""
+        versions, payloads = await sync_to_async(fetch_availability)(list(show_ids))
+        for pk, token in versions.items():
+            self.versions.setdefault(pk, token)
+        return [payloads[pk] for pk in show_ids]
+
+
+_hubs = weakref.WeakKeyDictionary() # event loop -> Hub
+_hubs_lock = threading.Lock()
+
+
+def get_hub():
+    """The Hub for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _hubs_lock:
+        hub = _hubs.get(loop)
+        if hub is None:
+            hub = _hubs[loop] = Hub()
+    return hub
+
+
+def notify(show_ids=None):
+    """Announce changed shows to every hub. Safe to call from any thread."""
+    show_ids = None if show_ids is None else list(show_ids)
+    with _hubs_lock:
+        hubs = list(_hubs.items())
+    for loop, hub in hubs:
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(hub.mark_dirty, show_ids)
@@ -0,0 +1,128 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template import RequestContext
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+from django.utils import timezone
+
+from shows.models import Show
+from shows import rendering
+from shows.search import SearchQuery, SearchResults
+
+# The show list rows as they were rendered before shows/rendering.py: every
+# cell on every render, with a {% timezone %} block per row. Kept here only so
+# the benchmark has something to compare against.
+LEGACY_LIST = """{% extends 'base.html' %}
+{% load tz %}
+{% block content %}
+<table><tbody>
+{% for show in shows %}
+    <tr>
+        <td><a href="{% url 'show_detail' pk=show.pk %}" class="show-title">{{ show.title }}</a></td>
+        <td>{% if show.date_time %}{% timezone TIME_ZONE %}{{ show.date_time|date:"Y-m-d H:i" }}{% endtimezone %}{% else %}N/A{% endif %}</td>
+        <td>{{ show.location }}</td>
+        <td>
+            {% if show.available_seats == 0 %}
+                <span class="no-availability">Sold Out</span>
+            {% elif show.available_seats < 10 %}
+                <span class="low-availability">{{ show.available_seats }} left!</span>
+            {% else %}
+                {{ show.available_seats }}
+            {% endif %} / {{ show.total_seats }}
+        </td>
+        <td>${{ show.price|floatformat:2 }}</td>
+        <td>{% if show.available_seats > 0 %}<a href="{% url 'show_detail' pk=show.pk %}">Book Now</a>{% else %}Sold Out{% endif %}</td>
+    </tr>
+{% endfor %}
+</tbody></table>
+{% endblock %}"""
+
+
+def make_engine(cached):
+    # The project's template settings, with or without the cached loader
+    options = dict(settings.TEMPLATES[0]['OPTIONS'])
+    loaders = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+    options['loaders'] = [('django.template.loaders.cached.Loader', loaders)] if cached else loaders
+    backend = DjangoTemplates({
+        'NAME': f'bench-{cached}', 'DIRS': settings.TEMPLATES[0]['DIRS'], 'APP_DIRS': False, 'OPTIONS': options,
+    })
+    return backend.engine
+
+
+class Command(BaseCommand):
+    help = "Time rendering a show list of many shows, before and after cached templates and show cards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20, help="Renders of each variant.")
+
+    def make_shows(self, count):
+        # Unsaved shows with ids: rendering never touches the database
+        start = timezone.now()
+        return [
+            Show(
+                pk=i + 1,
+                title=f"Benchmark Show {i}",
+                description="Benchmark show",
+                date_time=start + datetime.timedelta(hours=i),
+                location=f"Hall {i % 20}",
+                total_seats=500,
+                available_seats=(i * 7) % 500,
+                price=Decimal('25.00'),
+            )
+            for i in range(count)
+        ]
+
+    def time(self, repeat, render):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get('/shows/')
+        request.user = AnonymousUser()
+        count = options['shows']
+        shows = self.make_shows(count)
+        context = {
+            'shows': shows,
+            'results': SearchResults(shows=shows, total=count),
+            'query': SearchQuery(),
+        }
+
+        def legacy(engine):
+            template = engine.from_string(LEGACY_LIST) # base.html still comes through the engine's loaders
+            return lambda: template.render(RequestContext(request, context))
+
+        def current(engine, warm):
+            def render():
+                if not warm:
+                    cache.clear()
+                    for show in shows: # As loaded from the database, before precompute()
+                        show.__dict__.pop('dates_locale', None)
+                rendering.add_cards(shows)
+                return engine.get_template('shows/show_list.html').render(RequestContext(request, context))
+            return render
+
+        variants = {
+            'before, uncached loader': legacy(make_engine(cached=False)),
+            'before, cached loader': legacy(make_engine(cached=True)),
+            'after, cold card cache': current(make_engine(cached=True), warm=False),
+            'after, warm card cache': current(make_engine(cached=True), warm=True),
+        }
+        try:
+            for label, render in variants.items():
+                render() # Fill whatever the variant caches
+                p50, p95 = self.time(options['repeat'], render)
+                self.stdout.write(f"{label:>24}: {count} shows p50={p50 * 1000:.1f}ms p95={p95 * 1000:.1f}ms")
+        finally:
+            cache.clear()
@@ -0,0 +1,113 @@
+import dataclasses
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shows.models import Show
+from shows import search
+
+MARKER = 'benchsearch' # In every seeded description, so cleanup finds them
+
+CITIES = [
+    'Amsterdam', 'Athens', 'Barcelona', 'Berlin', 'Bristol', 'Brussels', 'Budapest', 'Chicago', 'Copenhagen',
+    'Dublin', 'Edinburgh', 'Glasgow', 'Hamburg', 'Helsinki', 'Lisbon', 'London', 'Los Angeles', 'Lyon',
+    'Madrid', 'Manchester', 'Milan', 'Montreal', 'Munich', 'New York', 'Oslo', 'Paris', 'Prague', 'Rome',
+    'San Francisco', 'Seattle', 'Stockholm', 'Toronto', 'Vienna', 'Warsaw', 'Zurich',
+]
+GENRES = ['rock', 'jazz', 'opera', 'ballet', 'comedy', 'folk', 'techno', 'blues', 'musical', 'symphony']
+WORDS = [
+    'night', 'live', 'tour', 'festival', 'orchestra', 'quartet', 'acoustic', 'summer', 'winter', 'gala',
+    'premiere', 'tribute', 'session', 'legends', 'unplugged', 'matinee', 'revival', 'showcase', 'classics',
+    'midnight', 'open', 'air', 'grand', 'hall', 'stage', 'encore', 'anniversary', 'special', 'world', 'strings',
+]
+
+
+class Command(BaseCommand):
+    help = "Time catalogue searches (text, date, price and location filters, facets) on many seeded shows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shows', type=int, default=500000)
+        parser.add_argument('--repeat', type=int, default=20, help="Runs of each search.")
+        parser.add_argument('--keep', action='store_true', help="Leave the seeded shows in place.")
+
+    def seed(self, count):
+        rng = random.Random(0)
+        start = timezone.now()
+        existing = Show.objects.filter(description__contains=MARKER).count()
+        batch = []
+        for i in range(existing, count):
+            genre = rng.choice(GENRES)
+            title = f"{' '.join(rng.sample(WORDS, 2)).title()} {genre.title()} {i}"
+            total = rng.randint(50, 5000)
+            batch.append(Show(
+                title=title,
+                description=f"{genre} {' '.join(rng.sample(WORDS, 6))} {MARKER}",
+                date_time=start + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+                location=rng.choice(CITIES),
+                total_seats=total,
+                available_seats=total,
+                price=Decimal(rng.randint(500, 25000)) / 100,
+            ))
+            if len(batch) == 5000:
+                Show.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Show.objects.bulk_create(batch)
+
+    def searches(self):
+        today = timezone.localdate()
+        return {
+            'first page': search.SearchQuery(),
+            'text': search.SearchQuery(text='jazz'),
+            'text, 2 words': search.SearchQuery(text='acoustic blues'),
+            'rare text': search.SearchQuery(text='Tribute Opera 12345'),
+            'prefix': search.SearchQuery(text='sympho'),
+            'location': search.SearchQuery(location='Berlin'),
+            'text + location': search.SearchQuery(text='rock', location='Lisbon'),
+            'date range': search.SearchQuery(
+                date_from=today + datetime.timedelta(days=30), date_to=today + datetime.timedelta(days=37),
+            ),
+            'price range': search.SearchQuery(min_price=Decimal('20'), max_price=Decimal('40')),
+            'everything': search.SearchQuery(
+                text='jazz', location='Paris', min_price=Decimal('10'), max_price=Decimal('120'),
+                date_from=today, date_to=today + datetime.timedelta(days=90),
+            ),
+        }
+
+    def time(self, query, repeat, cached):
+        timings = []
+        for _ in range(repeat):
+            if not cached:
+                cache.clear()
+            started = time.perf_counter()
+            results = search.search(query)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return results, timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.seed(options['shows'])
+        self.stdout.write(f"Seeded {options['shows']} shows in {time.perf_counter() - started:.1f}s")
+        try:
+            for label, query in self.searches().items():
+                results, p50, p95 = self.time(query, options['repeat'], cached=False)
+                if results.has_next: # And the page after it
+                    next_page = self.time(dataclasses.replace(query, after=results.next_cursor),
+                                          options['repeat'], cached=False)
+                    page_2 = f"page 2 p50={next_page[1] * 1000:.1f}ms"
+                else:
+                    page_2 = ''
+                _, cached_p50, _ = self.time(query, options['repeat'], cached=True)
+                self.stdout.write(
+                    f"{label:>16}: {results.total:>7} matches  uncached p50={p50 * 1000:.1f}ms "
+                    f"p95={p95 * 1000:.1f}ms  cached p50={cached_p50 * 1000:.2f}ms  {page_2}"
+                )
+        finally:
+            if not options['keep']:
+                Show.objects.filter(description__contains=MARKER).delete()
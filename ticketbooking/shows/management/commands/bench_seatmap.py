@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from shows.models import Show
+from shows import seatmap
+
+
+class Command(BaseCommand):
+    help = "Time building, rendering and allocating seats on a large seat-mapped show."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500)
+        parser.add_argument('--seats-per-row', type=int, default=100)
+        parser.add_argument('--allocations', type=int, default=200)
+        parser.add_argument('--quantity', type=int, default=4)
+
+    def timed(self, label, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f"{label:>24}: {(time.perf_counter() - started) * 1000:.1f} ms")
+        return result
+
+    def handle(self, *args, **options):
+        show = Show.objects.create(
+            title=f"bench-seatmap-{int(time.time())}",
+            description="Benchmark show",
+            date_time=timezone.now(),
+            location="Stadium",
+            total_seats=1,
+            price=10,
+        )
+        try:
+            layout = [("Stadium", options['rows'], options['seats_per_row'])]
+            self.timed("build seat map", seatmap.build_seat_map, show, layout)
+            self.stdout.write(f"{'seats':>24}: {show.total_seats}")
+            rows = self.timed("load + render", seatmap.availability, show)
+            self.stdout.write(f"{'rendered rows':>24}: {len(rows)}")
+
+            quantity = options['quantity']
+            started = time.perf_counter()
+            for _ in range(options['allocations']):
+                choice = seatmap.find_best_available(show, quantity)
+                if choice is None:
+                    break
+                with transaction.atomic():
+                    seatmap.claim_seats(choice[0], choice[1], quantity)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{'allocate + claim':>24}: {elapsed * 1000 / options['allocations']:.2f} ms per booking "
+                f"of {quantity}"
+            )
+            self.timed("popcount resync", seatmap.sync_available_seats, show)
+        finally:
+            show.delete()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shows.models import Show
+from shows.seatmap import build_seat_map
+
+
+def parse_section(value):
+    # "Floor:20x30" -> ("Floor", 20, 30)
+    try:
+        name, dims = value.rsplit(':', 1)
+        rows, width = (int(part) for part in dims.lower().split('x'))
+    except ValueError:
+        raise CommandError(f"Invalid section '{value}'. Use NAME:ROWSxSEATS, e.g. Floor:20x30.")
+    if not name or rows <= 0 or width <= 0:
+        raise CommandError(f"Invalid section '{value}'. Rows and seats must be positive.")
+    return name, rows, width
+
+
+class Command(BaseCommand):
+    help = "Create (or replace) the assigned-seating map for a show."
+
+    def add_arguments(self, parser):
+        parser.add_argument('show_id', type=int)
+        parser.add_argument(
+            '--section', action='append', required=True, dest='sections',
+            help="Section as NAME:ROWSxSEATS. Repeat for several sections, best first.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            show = Show.objects.get(pk=options['show_id'])
+        except Show.DoesNotExist:
+            raise CommandError(f"Show {options['show_id']} does not exist.")
+        if show.bookings.exists():
+            raise CommandError("Cannot replace the seat map of a show that already has bookings.")
+
+        layout = [parse_section(value) for value in options['sections']]
+        build_seat_map(show, layout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created seat map for '{show.title}' with {show.total_seats} seats."
+        ))
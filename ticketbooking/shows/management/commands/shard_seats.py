@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shows.models import Show
+from shows import shards
+from custom_admin import rollups
+
+
+class Command(BaseCommand):
+    help = "Split a show's seat inventory over several counter rows (0 to keep it on the show)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('show_id', type=int)
+        parser.add_argument('shards', type=int, help=f"Number of seat shards, 0 to {shards.MAX_SHARDS}.")
+
+    def handle(self, *args, **options):
+        try:
+            show = Show.objects.get(pk=options['show_id'])
+        except Show.DoesNotExist:
+            raise CommandError(f"Show {options['show_id']} does not exist.")
+        try:
+            shards.set_shards(show, options['shards'])
+        except shards.ShardingError as e:
+            raise CommandError(str(e))
+        # Bookings of sharded shows skip the rollups, so bring them up to date either way
+        rollups.rebuild([show.pk])
+        if show.seat_shards:
+            self.stdout.write(self.style.SUCCESS(
+                f"Split the {show.available_seats} unreserved seats of '{show.title}' over {show.seat_shards} shards."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"'{show.title}' keeps its {show.available_seats} seats on the show again."))
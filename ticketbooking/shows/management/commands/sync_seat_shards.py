@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shows.models import Show
+from shows import shards
+from custom_admin import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the seat shard totals of sharded shows back to Show.available_seats and rebuild "
+        "their sales rollups, a chunk of shows at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100, help="Shows per transaction.")
+        parser.add_argument('--loop', action='store_true', help="Keep syncing until interrupted.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between syncs with --loop.")
+
+    def sync(self, chunk_size):
+        shows = Show.objects.filter(seat_shards__gt=0).order_by('pk')
+        synced = 0
+        last_pk = 0
+        while True:
+            chunk = list(shows.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+            if not chunk:
+                return synced
+            shards.sync_available_seats(chunk)
+            rollups.rebuild(chunk)
+            synced += len(chunk)
+            last_pk = chunk[-1]
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            synced = self.sync(options['chunk_size'])
+            self.stdout.write(f"Synced {synced} sharded shows.")
+            return
+
+        try:
+            while True:
+                close_old_connections()
+                self.sync(options['chunk_size'])
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
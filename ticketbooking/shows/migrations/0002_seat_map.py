@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 19:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shows', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='show',
+            name='has_seat_map',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='SeatSection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='shows.show')),
+            ],
+            options={
+                'ordering': ['position', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SeatRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=20)),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('width', models.PositiveIntegerField()),
+                ('occupancy', models.BinaryField()),
+                ('free_seats', models.PositiveIntegerField()),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='shows.seatsection')),
+            ],
+            options={
+                'ordering': ['position', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shows', '0002_seat_map'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='show',
+            name='queue_enabled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='show',
+            name='queue_rate',
+            field=models.PositiveIntegerField(default=10),
+        ),
+    ]
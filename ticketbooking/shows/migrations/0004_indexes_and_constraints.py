@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shows', '0003_waiting_room'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='seatrow',
+            index=models.Index(fields=['section', 'position', 'id'], name='shows_seatr_section_87e1db_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seatsection',
+            index=models.Index(fields=['show', 'position', 'id'], name='shows_seats_show_id_e14da4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['is_active', 'date_time'], name='shows_show_is_acti_c1ec05_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['date_time', 'id'], name='shows_show_date_ti_894e9c_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='seatrow',
+            constraint=models.CheckConstraint(condition=models.Q(('free_seats__lte', models.F('width'))), name='seatrow_free_seats_lte_width'),
+        ),
+        migrations.AddConstraint(
+            model_name='show',
+            constraint=models.CheckConstraint(condition=models.Q(('available_seats__lte', models.F('total_seats'))), name='show_available_seats_lte_total'),
+        ),
+        migrations.AddConstraint(
+            model_name='show',
+            constraint=models.CheckConstraint(condition=models.Q(('available_seats__gte', 0)), name='show_available_seats_non_negative'),
+        ),
+        migrations.AddConstraint(
+            model_name='show',
+            constraint=models.CheckConstraint(condition=models.Q(('price__gte', 0)), name='show_price_non_negative'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+# The full-text index behind shows/search.py. MySQL keeps a FULLTEXT index up
+# to date by itself. SQLite gets an FTS5 table over shows_show kept in step
+# by triggers; the UPDATE trigger only fires for the text columns, so seat
+# count updates never touch it.
+#
+# Note for later migrations: SQLite rebuilds a table (dropping its triggers)
+# for most ALTERs. One that alters shows_show must run create_fts5() again.
+
+MYSQL_CREATE = 'CREATE FULLTEXT INDEX shows_show_search ON shows_show (title, description, location)'
+MYSQL_DROP = 'DROP INDEX shows_show_search ON shows_show'
+
+FTS5_CREATE = [
+    """
+    CREATE VIRTUAL TABLE shows_show_fts USING fts5(
+        title, description, location,
+        content='shows_show', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER shows_show_fts_insert AFTER INSERT ON shows_show BEGIN
+        INSERT INTO shows_show_fts(rowid, title, description, location)
+        VALUES (new.id, new.title, new.description, new.location);
+    END
+    """,
+    """
+    CREATE TRIGGER shows_show_fts_delete AFTER DELETE ON shows_show BEGIN
+        INSERT INTO shows_show_fts(shows_show_fts, rowid, title, description, location)
+        VALUES ('delete', old.id, old.title, old.description, old.location);
+    END
+    """,
+    """
+    CREATE TRIGGER shows_show_fts_update AFTER UPDATE OF title, description, location ON shows_show BEGIN
+        INSERT INTO shows_show_fts(shows_show_fts, rowid, title, description, location)
+        VALUES ('delete', old.id, old.title, old.description, old.location);
+        INSERT INTO shows_show_fts(rowid, title, description, location)
+        VALUES (new.id, new.title, new.description, new.location);
+    END
+    """,
+    "INSERT INTO shows_show_fts(shows_show_fts) VALUES ('rebuild')", # Index the existing shows
+]
+
+FTS5_DROP = [
+    'DROP TRIGGER IF EXISTS shows_show_fts_insert',
+    'DROP TRIGGER IF EXISTS shows_show_fts_delete',
+    'DROP TRIGGER IF EXISTS shows_show_fts_update',
+    'DROP TABLE IF EXISTS shows_show_fts',
+]
+
+
+def create_fts5(schema_editor):
+    for statement in FTS5_DROP + FTS5_CREATE:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(MYSQL_CREATE)
+    elif vendor == 'sqlite':
+        create_fts5(schema_editor)
+    # Other databases search with icontains, without an index
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(MYSQL_DROP)
+    elif vendor == 'sqlite':
+        for statement in FTS5_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shows', '0004_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='show',
+            index=models.Index(fields=['is_active', 'location'], name='shows_show_is_acti_96c767_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
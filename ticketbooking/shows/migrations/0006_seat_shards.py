@@ -0,0 +1,45 @@
+# Generated by Django 5.2 on 2026-10-18 19:21
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+search_index = import_module('shows.migrations.0005_search_index')
+
+
+def restore_search_index(apps, schema_editor):
+    # Adding or removing a column rebuilds shows_show on SQLite, which drops
+    # the triggers that keep the search index up to date
+    if schema_editor.connection.vendor == 'sqlite':
+        search_index.create_fts5(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shows', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='show',
+            name='seat_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SeatShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('available_seats', models.PositiveIntegerField()),
+                ('show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='shows.show')),
+            ],
+            options={
+                'ordering': ['show', 'shard'],
+                'constraints': [models.UniqueConstraint(fields=('show', 'shard'), name='unique_show_seat_shard'), models.CheckConstraint(condition=models.Q(('available_seats__gte', 0)), name='seatshard_available_seats_non_negative')],
+            },
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
@@ -10,6 +10,10 @@ class Show(models.Model):
     available_seats = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     is_active = models.BooleanField(default=True) # Option to hide shows
+    has_seat_map = models.BooleanField(default=False) # Assigned seating, see shows/seatmap.py
+    queue_enabled = models.BooleanField(default=False) # Send booking attempts through the waiting room
+    queue_rate = models.PositiveIntegerField(default=10) # Waiting room admissions per second
+    seat_shards = models.PositiveSmallIntegerField(default=0) # Seats split over this many SeatShard rows, see shows/shards.py (0: kept here)
 
     def __str__(self):
         # Format date/time nicely for display
@@ -24,4 +28,76 @@ class Show(models.Model):
         super().save(*args, **kwargs)
 
     class Meta:
-        ordering = ['date_time'] # Order shows by date/time by default
\ No newline at end of file
+        ordering = ['date_time'] # Order shows by date/time by default
+        indexes = [
+            models.Index(fields=['is_active', 'date_time']), # Public listing (shows/catalogue.py)
+            models.Index(fields=['date_time', 'id']), # Admin show list pages
+            models.Index(fields=['is_active', 'location']), # Location facets and filter (shows/search.py)
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(available_seats__lte=models.F('total_seats')),
+                name='show_available_seats_lte_total',
+            ),
+            models.CheckConstraint(condition=models.Q(available_seats__gte=0), name='show_available_seats_non_negative'),
+            models.CheckConstraint(condition=models.Q(price__gte=0), name='show_price_non_negative'),
+        ]
+
+
+class SeatSection(models.Model):
+    show = models.ForeignKey(Show, on_delete=models.CASCADE, related_name='sections')
+    name = models.CharField(max_length=100)
+    position = models.PositiveIntegerField(default=0) # Lower sections are offered first
+
+    def __str__(self):
+        return f"{self.name} ({self.show.title})"
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['show', 'position', 'id']), # A show's sections in offer order
+        ]
+
+
+class SeatRow(models.Model):
+    # Occupancy of a whole row is stored as a bitmap (bit i set = seat i+1 taken)
+    # instead of one database row per seat. See shows/seatmap.py for the helpers.
+    section = models.ForeignKey(SeatSection, on_delete=models.CASCADE, related_name='rows')
+    label = models.CharField(max_length=20)
+    position = models.PositiveIntegerField(default=0) # Lower rows are offered first
+    width = models.PositiveIntegerField() # Number of seats in the row
+    occupancy = models.BinaryField()
+    free_seats = models.PositiveIntegerField() # Popcount of the free bits, kept in sync with occupancy
+
+    def __str__(self):
+        return f"Row {self.label} ({self.section.name})"
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['section', 'position', 'id']), # A section's rows in offer order
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(free_seats__lte=models.F('width')), name='seatrow_free_seats_lte_width'),
+        ]
+
+
+class SeatShard(models.Model):
+    # One slice of the unreserved seats of a sharded show (Show.seat_shards > 0).
+    # Bookings take seats from one shard, so concurrent bookings for the same
+    # show lock different rows instead of all queueing on the Show row. See
+    # shows/shards.py.
+    show = models.ForeignKey(Show, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField() # 0 .. show.seat_shards - 1
+    available_seats = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"Shard {self.shard} of {self.show.title}: {self.available_seats} seats"
+
+    class Meta:
+        ordering = ['show', 'shard']
+        constraints = [
+            models.UniqueConstraint(fields=['show', 'shard'], name='unique_show_seat_shard'),
+            models.CheckConstraint(condition=models.Q(available_seats__gte=0), name='seatshard_available_seats_non_negative'),
+        ]
+
@@ -0,0 +1,76 @@
+"""
+Pre-rendered pieces of the public show pages.
+
+A row of the show list is mostly static. Its title, date and location only
+change when an admin edits the show, while its seat count changes with every
+booking. The static cells (the show's "card", templates/shows/show_card.html)
+are therefore rendered once and cached under the show's card version, a hash
+of the fields the public pages display. The detail page caches its static
+part under the same version. The seat count cells around them are rendered on
+every request from the overlaid seat counts (catalogue.overlay_seats()). A
+page of cards is fetched with one cache round trip.
+
+Show dates (and the price and detail URL) are formatted once, when a show is
+loaded into the catalogue cache (precompute()), instead of by {% timezone %},
+|date and {% url %} on every render. The formatted strings travel with the
+cached Show objects.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.defaultfilters import floatformat
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils import dateformat, timezone, translation
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'shows/show_card.html'
+LIST_DATE_FORMAT = 'Y-m-d H:i'
+DETAIL_DATE_FORMAT = 'l, F d, Y P'
+
+
+def card_version(show, locale):
+    """Changes whenever anything the public pages show about the show (bar seats) changes."""
+    values = '\0'.join([show.title, show.description, show.date_time.isoformat(), show.location, str(show.price), locale])
+    return hashlib.md5(values.encode()).hexdigest()
+
+
+def precompute(shows):
+    """
+    Set show.list_date and show.detail_date (in the current time zone and
+    language), show.price_display, show.url and show.card_version on each
+    show. Shows that already have them are skipped.
+    """
+    locale = f'{timezone.get_current_timezone_name()}:{translation.get_language()}'
+    for show in shows:
+        if getattr(show, 'dates_locale', None) == locale:
+            continue
+        local = timezone.localtime(show.date_time)
+        show.list_date = dateformat.format(local, LIST_DATE_FORMAT)
+        show.detail_date = dateformat.format(local, DETAIL_DATE_FORMAT)
+        show.price_display = f'${floatformat(show.price, 2)}'
+        show.url = reverse('show_detail', kwargs={'pk': show.pk})
+        show.card_version = card_version(show, locale)
+        show.dates_locale = locale
+    return shows
+
+
+def _card_key(show):
+    return f'showcard:{show.pk}:{show.card_version}'
+
+
+def add_cards(shows):
+    """Set show.card to the show's rendered list cells, from the cache when warm."""
+    precompute(shows)
+    keys = {_card_key(show): show for show in shows}
+    cached = cache.get_many(keys)
+    missing = {key: show for key, show in keys.items() if key not in cached}
+    if missing:
+        template = get_template(CARD_TEMPLATE)
+        fresh = {key: template.render({'show': show}) for key, show in missing.items()}
+        cache.set_many(fresh, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        cached.update(fresh)
+    for key, show in keys.items():
+        show.card = mark_safe(cached[key])
+    return shows
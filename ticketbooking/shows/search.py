@@ -0,0 +1,232 @@
+"""
+Search and faceted filtering for the public show list.
+
+Text search covers title, description and location through the database's
+own full-text index:
+
+* MySQL: a FULLTEXT index on (title, description, location), queried with
+  MATCH ... AGAINST in boolean mode.
+* SQLite: an FTS5 table (shows_show_fts) that indexes shows_show as external
+  content.
+* Anything else: a plain icontains filter, with no index.
+
+Both indexes are created by migration shows/0005_search_index and updated by
+the database itself whenever a show is inserted, edited or deleted: InnoDB
+maintains FULLTEXT indexes on commit, and triggers keep the FTS5 table in
+step. Seat count updates do not touch the text columns and so never reach the
+index.
+
+Every search term must match, as a word prefix ("roc" finds "Rock"). Results
+can be narrowed by date range, price range and location, and are paged with
+keyset pagination in date order. Each search also returns how many shows match
+per location (the facets), counted without the location filter itself so the
+other locations stay selectable.
+
+Results and facets are cached under the catalogue version (shows/catalogue.py),
+so any admin change to a show retires them, while seat counts are overlaid
+from the per-show seat cache like the rest of the catalogue. As with the
+catalogue, everything is read from the primary database.
+"""
+import datetime
+import hashlib
+import json
+import re
+from dataclasses import asdict, dataclass, field, replace
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from ticket_booking_system.pagination import KeysetPaginator
+from . import catalogue
+from . import rendering
+
+FTS_TABLE = 'shows_show_fts' # SQLite only, see migration 0005_search_index
+SEARCH_FIELDS = ('title', 'description', 'location')
+ORDERING = ('date_time', 'id')
+PAGE_SIZE = 50
+FACET_LIMIT = 20 # Locations listed; the total still counts every one
+MAX_TERMS = 10
+MAX_QUERY_LENGTH = 200
+MYSQL_MIN_TERM_LENGTH = 3 # innodb_ft_min_token_size; shorter words are not indexed
+
+TERM = re.compile(r'\w+')
+
+# Request parameters that make a search, rather than the plain first page
+PARAMS = ('q', 'from', 'to', 'min_price', 'max_price', 'location', 'after')
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    text: str = ''
+    date_from: datetime.date = None
+    date_to: datetime.date = None # Inclusive
+    min_price: Decimal = None
+    max_price: Decimal = None
+    location: str = ''
+    after: str = '' # Page cursor
+
+    @classmethod
+    def from_params(cls, params):
+        """(SearchQuery, errors) from request.GET. Invalid values are left out."""
+        errors = []
+
+        def parse(name, convert, message):
+            value = params.get(name, '').strip()
+            if not value:
+                return None
+            try:
+                return convert(value)
+            except (ValueError, InvalidOperation):
+                errors.append(message)
+                return None
+
+        def price(value):
+            value = Decimal(value)
+            if not value.is_finite() or value < 0:
+                raise ValueError(value)
+            return value
+
+        query = cls(
+            text=params.get('q', '').strip()[:MAX_QUERY_LENGTH],
+            date_from=parse('from', datetime.date.fromisoformat, "Enter the start date as YYYY-MM-DD."),
+            date_to=parse('to', datetime.date.fromisoformat, "Enter the end date as YYYY-MM-DD."),
+            min_price=parse('min_price', price, "Enter the minimum price as a positive number."),
+            max_price=parse('max_price', price, "Enter the maximum price as a positive number."),
+            location=params.get('location', '').strip(),
+            after=params.get('after', '').strip(),
+        )
+        return query, errors
+
+    def terms(self):
+        return TERM.findall(self.text.lower())[:MAX_TERMS]
+
+    def cache_key(self, name):
+        values = json.dumps(asdict(self), default=str, sort_keys=True)
+        return catalogue._key(catalogue.get_version(), f'{name}:{hashlib.md5(values.encode()).hexdigest()}')
+
+
+@dataclass
+class SearchResults:
+    shows: list
+    next_cursor: str = None
+    facets: list = field(default_factory=list) # [(location, count)] for the top locations
+    total: int = 0 # Shows matching the search, across all pages
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+# Text matching, per database
+
+def fts5_query(terms):
+    # Each term as a quoted prefix; FTS5 ANDs them together
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def mysql_boolean_query(terms):
+    return ' '.join(f'+{term}*' for term in terms)
+
+
+def contains_all(queryset, terms):
+    for term in terms:
+        queryset = queryset.filter(
+            Q(title__icontains=term) | Q(description__icontains=term) | Q(location__icontains=term)
+        )
+    return queryset
+
+
+def match_text(queryset, terms):
+    """`queryset` narrowed to the shows that contain every term."""
+    if not terms:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [fts5_query(terms)],
+        ))
+    if vendor == 'mysql':
+        indexed = [term for term in terms if len(term) >= MYSQL_MIN_TERM_LENGTH]
+        if indexed:
+            columns = ', '.join(connections[queryset.db].ops.quote_name(name) for name in SEARCH_FIELDS)
+            queryset = queryset.alias(relevance=RawSQL(
+                f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)', [mysql_boolean_query(indexed)],
+                output_field=FloatField(),
+            )).filter(relevance__gt=0)
+        # Words too short for the index are checked on the rows it found
+        return contains_all(queryset, [term for term in terms if term not in indexed])
+    return contains_all(queryset, terms)
+
+
+# Searching
+
+def day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def filtered_shows(query, with_location=True):
+    """Active shows matching everything in `query` but its page cursor."""
+    shows = match_text(catalogue.primary_shows().filter(is_active=True), query.terms())
+    if query.date_from:
+        shows = shows.filter(date_time__gte=day_start(query.date_from))
+    if query.date_to:
+        shows = shows.filter(date_time__lt=day_start(query.date_to + datetime.timedelta(days=1)))
+    if query.min_price is not None:
+        shows = shows.filter(price__gte=query.min_price)
+    if query.max_price is not None:
+        shows = shows.filter(price__lte=query.max_price)
+    if with_location and query.location:
+        shows = shows.filter(location=query.location)
+    return shows
+
+
+def location_facets(query):
+    """[(location, count)] for every location with matching shows, largest first."""
+    counts = list(
+        filtered_shows(query, with_location=False)
+        .order_by().values_list('location').annotate(shows=Count('id'))
+    )
+    counts.sort(key=lambda item: (-item[1], item[0]))
+    return counts
+
+
+def search(query, page_size=PAGE_SIZE):
+    """
+    One page of SearchResults for `query`, cached under the catalogue version.
+    Raises pagination.InvalidCursor for a malformed cursor.
+    """
+    page_key = query.cache_key(f'search:{page_size}')
+    page = cache.get(page_key)
+    if page is None:
+        catalogue._record('misses')
+        paginator = KeysetPaginator(filtered_shows(query), ORDERING, page_size)
+        keyset_page = paginator.page(query.after or None)
+        page = (rendering.precompute(keyset_page.items), keyset_page.next_cursor)
+        cache.set(page_key, page, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+    else:
+        catalogue._record('hits')
+
+    # Facets do not depend on the location picked or the page shown
+    facet_query = replace(query, location='', after='')
+    facet_key = facet_query.cache_key('facets')
+    facets = cache.get(facet_key)
+    if facets is None:
+        facets = location_facets(facet_query)
+        cache.set(facet_key, facets, timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+
+    if query.location:
+        total = dict(facets).get(query.location, 0)
+    else:
+        total = sum(count for _, count in facets)
+    shows, next_cursor = page
+    return SearchResults(
+        shows=catalogue.overlay_seats(shows),
+        next_cursor=next_cursor,
+        facets=facets[:FACET_LIMIT],
+        total=total,
+    )
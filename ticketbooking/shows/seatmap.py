@@ -0,0 +1,237 @@
+"""
+Seat-map inventory for assigned-seating shows.
+
+Each SeatRow stores its occupancy as a little-endian bitmap: bit i is set when
+seat i+1 is taken. Working on the bitmap as one Python int keeps every
+operation (popcount, "find N adjacent free seats", claiming) to a handful of
+big-int operations per row instead of one database row per seat.
+"""
+from django.db import transaction
+from django.db.models import BinaryField, Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Show, SeatSection, SeatRow
+from . import catalogue
+
+
+class SeatsTaken(Exception):
+    """Raised when seats picked from a stale bitmap were claimed by someone else."""
+
+
+# --- Bitmap helpers ----------------------------------------------------------
+
+def empty_bitmap(width):
+    return bytes((width + 7) // 8)
+
+
+def to_int(bitmap):
+    return int.from_bytes(bytes(bitmap), 'little')
+
+
+def to_bytes(value, width):
+    return value.to_bytes((width + 7) // 8, 'little')
+
+
+def full_mask(width):
+    return (1 << width) - 1
+
+
+def taken_count(bitmap):
+    return to_int(bitmap).bit_count()
+
+
+def free_count(bitmap, width):
+    return width - taken_count(bitmap)
+
+
+def find_run(bitmap, width, quantity):
+    """
+    Return the 0-based start of `quantity` adjacent free seats, preferring the
+    run closest to the middle of the row, or None if the row has no such run.
+    """
+    if quantity <= 0 or quantity > width:
+        return None
+    starts = ~to_int(bitmap) & full_mask(width)
+    # After k rounds bit i is set only if seats i..i+k are all free.
+    for _ in range(quantity - 1):
+        starts &= starts >> 1
+    if not starts:
+        return None
+
+    centre = (width - quantity) / 2
+    best = None
+    while starts:
+        lowest = starts & -starts
+        start = lowest.bit_length() - 1
+        if best is None or abs(start - centre) < abs(best - centre):
+            best = start
+        elif start > centre:
+            break # Candidates only get further from the centre from here on
+        starts ^= lowest
+    return best
+
+
+def occupy(bitmap, width, start, quantity):
+    """Return a new bitmap with seats start..start+quantity-1 marked taken."""
+    if start < 0 or start + quantity > width:
+        raise SeatsTaken("Seats are outside the row.")
+    value = to_int(bitmap)
+    mask = ((1 << quantity) - 1) << start
+    if value & mask:
+        raise SeatsTaken("Some of those seats have just been taken.")
+    return to_bytes(value | mask, width)
+
+
+def vacate(bitmap, width, start, quantity):
+    """Return a new bitmap with seats start..start+quantity-1 marked free."""
+    mask = ((1 << quantity) - 1) << start
+    return to_bytes(to_int(bitmap) & ~mask & full_mask(width), width)
+
+
+def render_row(bitmap, width, free='o', taken='x'):
+    """Render a row as a string with one character per seat, seat 1 first."""
+    bits = format(to_int(bitmap), f'0{width}b')[::-1] if width else ''
+    return bits.replace('0', free).replace('1', taken)
+
+
+def seat_label(row, start, quantity):
+    first, last = start + 1, start + quantity
+    seats = str(first) if quantity == 1 else f"{first}-{last}"
+    return f"{row.section.name} Row {row.label}, Seat{'s' if quantity > 1 else ''} {seats}"
+
+
+# --- Database operations -----------------------------------------------------
+
+def build_seat_map(show, layout):
+    """
+    Create the seat map for `show`.
+
+    `layout` is a list of (section_name, rows, seats_per_row) tuples in the
+    order sections should be offered. Rows are labelled 1, 2, 3... and all
+    seats start free. The show's seat counters are reset to match the map.
+    """
+    with transaction.atomic():
+        Show.objects.select_for_update().filter(pk=show.pk).values_list('pk').get() # The show first, as bookings lock it
+        SeatSection.objects.filter(show=show).delete()
+        rows = []
+        for position, (name, row_count, width) in enumerate(layout):
+            section = SeatSection.objects.create(show=show, name=name, position=position)
+            rows.extend(
+                SeatRow(
+                    section=section,
+                    label=str(i + 1),
+                    position=i,
+                    width=width,
+                    occupancy=empty_bitmap(width),
+                    free_seats=width,
+                )
+                for i in range(row_count)
+            )
+        SeatRow.objects.bulk_create(rows, batch_size=1000)
+        total = sum(row.width for row in rows)
+        Show.objects.filter(pk=show.pk).update(
+            has_seat_map=True, total_seats=total, available_seats=total,
+        )
+        catalogue.catalogue_changed([show.pk])
+    show.refresh_from_db()
+    return show
+
+
+def free_seats():
+    # SUM(free_seats) of the outer show's rows, i.e. its seat map's popcount, as a subquery
+    total = SeatRow.objects.filter(section__show=OuterRef('pk')).order_by().values('section__show').annotate(total=Sum('free_seats')).values('total')
+    return Coalesce(Subquery(total), 0, output_field=IntegerField())
+
+
+def set_available_seats(show_ids):
+    """
+    Set the seat counter of seat-mapped shows to their seat maps' free seats,
+    with one UPDATE. Bookings and cancellations call it in the transaction
+    that flipped the bits, with the show locked, so the counter is derived
+    from the bitmaps rather than moved alongside them.
+    """
+    Show.objects.filter(pk__in=show_ids).update(available_seats=free_seats())
+    catalogue.seats_changed(show_ids)
+
+
+def sync_available_seats(show):
+    """Recompute `show.available_seats` from the per-row popcounts."""
+    set_available_seats([show.pk])
+    return Show.objects.filter(pk=show.pk).values_list('available_seats', flat=True).get()
+
+
+def availability(show):
+    """Per-row availability of a show, for rendering the seat map."""
+    rows = (
+        SeatRow.objects.filter(section__show=show)
+        .select_related('section')
+        .order_by('section__position', 'section_id', 'position', 'id')
+        .only('label', 'width', 'occupancy', 'free_seats', 'section__name')
+    )
+    return [
+        {
+            'section': row.section.name,
+            'label': row.label,
+            'free_seats': row.free_seats,
+            'width': row.width,
+            'seats': render_row(row.occupancy, row.width),
+        }
+        for row in rows
+    ]
+
+
+def find_best_available(show, quantity):
+    """Return (row_id, start) for the best block of `quantity` adjacent free seats, or None."""
+    rows = (
+        SeatRow.objects.filter(section__show=show, free_seats__gte=quantity)
+        .order_by('section__position', 'section_id', 'position', 'id')
+        .only('id', 'width', 'occupancy')
+    )
+    for row in rows.iterator(chunk_size=500):
+        start = find_run(row.occupancy, row.width, quantity)
+        if start is not None:
+            return row.pk, start
+    return None
+
+
+def claim_seats(row_id, start, quantity):
+    """
+    Flip the bits for the chosen seats while holding a lock on the row.
+    Must be called inside a transaction. Raises SeatsTaken if any of the seats
+    were claimed since the bitmap was read.
+    """
+    row = SeatRow.objects.select_for_update().select_related('section').get(pk=row_id)
+    row.occupancy = occupy(row.occupancy, row.width, start, quantity)
+    row.free_seats = row.width - taken_count(row.occupancy)
+    row.save(update_fields=['occupancy', 'free_seats'])
+    return row
+
+
+def release_seats(row_id, start, quantity):
+    """
+    Free seats start..start+quantity-1 of a row while holding a lock on it
+    (a booking's seat_row and seat_start). Must be called inside a
+    transaction. Returns the row, or None if it no longer exists.
+    """
+    row = SeatRow.objects.select_for_update().filter(pk=row_id).first() if row_id is not None else None
+    if row is None:
+        return None
+    row.occupancy = vacate(row.occupancy, row.width, start, quantity)
+    row.free_seats = row.width - taken_count(row.occupancy)
+    row.save(update_fields=['occupancy', 'free_seats'])
+    return row
+
+
+def clear_seat_map(show):
+    """Mark every seat of `show` free, with one UPDATE. Must be called inside a transaction."""
+    rows = SeatRow.objects.filter(section__show=show)
+    widths = set(rows.values_list('width', flat=True))
+    if not widths:
+        return 0
+    return rows.update(
+        occupancy=Case(
+            *[When(width=width, then=Value(empty_bitmap(width))) for width in widths],
+            output_field=BinaryField(),
+        ),
+        free_seats=F('width'),
+    )
@@ -0,0 +1,195 @@
+"""
+Sharded seat inventory for shows that sell faster than one row can be locked.
+
+Normally a show's unreserved seats are a single counter, Show.available_seats,
+and every booking for the show updates (and so locks) that one row until its
+transaction commits. With Show.seat_shards = K the counter is split across K
+SeatShard rows instead:
+
+* A booking takes all its seats from one shard with enough of them, picked at
+  random, with one conditional UPDATE. Concurrent bookings for the show mostly
+  lock different rows, so up to K of them can proceed at once.
+* Only when no single shard has enough seats left (near sell-out) does a
+  booking lock every shard of the show, in shard order, and take the seats
+  from several.
+* Released seats go back to a random shard.
+
+Show.available_seats is then an aggregate. The catalogue sums the shards on
+demand (catalogue.seat_shard_totals()), and `manage.py sync_seat_shards`
+writes the sums back to the Show rows periodically for everything else that
+reads the column (the admin list, exports). The sales rollups of sharded shows are rebuilt by the
+same job rather than bumped by every booking, since a per-show rollup row
+would otherwise become the next hot row.
+
+Seat-mapped shows already spread their inventory over SeatRow rows and cannot
+be sharded.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Show, SeatShard
+from . import catalogue
+
+MAX_SHARDS = 64
+# Shards with enough seats tried by a booking before it locks the whole show
+FAST_PATH_ATTEMPTS = 3
+
+
+class ShardingError(Exception):
+    pass
+
+
+class ModeChanged(Exception):
+    """The show's seats were sharded or unsharded since its mode was read."""
+
+
+def split(seats, count):
+    """`seats` spread as evenly as possible over `count` shards."""
+    base, extra = divmod(seats, count)
+    return [base + (1 if i < extra else 0) for i in range(count)]
+
+
+def set_shards(show, count):
+    """
+    Split the unreserved seats of `show` over `count` shards, or with count=0
+    put them back on the Show row. Safe while bookings are being made: the
+    show, then its shards, are locked while the seats move.
+    """
+    if not 0 <= count <= MAX_SHARDS:
+        raise ShardingError(f"A show can have between 0 and {MAX_SHARDS} seat shards.")
+    if show.has_seat_map and count:
+        raise ShardingError("Seat-mapped shows cannot have seat shards.")
+    with transaction.atomic():
+        # Same lock order as a cart checkout (the show, then its shards). A
+        # sharded booking locks only the shard it takes seats from
+        locked = Show.objects.select_for_update().get(pk=show.pk)
+        current = list(SeatShard.objects.select_for_update().filter(show=show).order_by('shard'))
+        available = sum(s.available_seats for s in current) if locked.seat_shards else locked.available_seats
+        SeatShard.objects.filter(show=show).delete()
+        if count:
+            SeatShard.objects.bulk_create([
+                SeatShard(show=show, shard=i, available_seats=seats)
+                for i, seats in enumerate(split(available, count))
+            ])
+        Show.objects.filter(pk=show.pk).update(seat_shards=count, available_seats=available)
+        catalogue.catalogue_changed([show.pk])
+    show.seat_shards = count
+    show.available_seats = available
+    return show
+
+
+def reserve(show_id, quantity, count):
+    """
+    Take `quantity` seats from the shards of a show with `count` shards.
+    Must be called inside a transaction. Returns True if the seats were taken.
+    """
+    # A subquery, not a join: Django would split an UPDATE with a join into a
+    # SELECT and an UPDATE on MySQL, and the seat check must stay in the UPDATE
+    active = Exists(Show.objects.filter(pk=OuterRef('show_id'), is_active=True))
+    shards = SeatShard.objects.filter(active, show_id=show_id)
+    # Fast path: one shard, one row lock
+    candidates = [random.randrange(count)] if count else []
+    for _ in range(FAST_PATH_ATTEMPTS):
+        if not candidates:
+            candidates = list(shards.filter(available_seats__gte=quantity).values_list('shard', flat=True))
+            if not candidates:
+                break
+            random.shuffle(candidates)
+        shard = candidates.pop()
+        taken = shards.filter(shard=shard, available_seats__gte=quantity).update(
+            available_seats=F('available_seats') - quantity,
+        )
+        if taken:
+            catalogue.seats_changed([show_id])
+            return True
+        candidates = [] # Lost it to another booking; look again
+
+    # Slow path: no shard has enough on its own, take from several
+    locked = list(shards.select_for_update().order_by('shard').values_list('pk', 'available_seats'))
+    if sum(seats for _, seats in locked) < quantity:
+        return False
+    takes, remaining = {}, quantity
+    for pk, seats in sorted(locked, key=lambda item: -item[1]): # Fewest rows touched
+        if remaining <= 0:
+            break
+        takes[pk] = min(seats, remaining)
+        remaining -= takes[pk]
+    SeatShard.objects.filter(pk__in=takes).update(
+        available_seats=F('available_seats') - Case(
+            *[When(pk=pk, then=Value(take)) for pk, take in takes.items()],
+            default=Value(0),
+        )
+    )
+    catalogue.seats_changed([show_id])
+    return True
+
+
+def release(released, counts):
+    """
+    Give seats back to sharded shows with one UPDATE. `released` maps show id
+    -> seats to return and `counts` show id -> its number of shards. Raises
+    ModeChanged, having changed nothing, if a show's shards are not as counted.
+    """
+    picks = {show_id: random.randrange(counts[show_id]) for show_id in released}
+    target = Q()
+    for show_id, shard in picks.items():
+        target |= Q(show_id=show_id, shard=shard)
+    with transaction.atomic():
+        updated = SeatShard.objects.filter(target).update(
+            available_seats=F('available_seats') + Case(
+                *[When(show_id=show_id, then=Value(quantity)) for show_id, quantity in released.items()],
+                default=Value(0),
+            )
+        )
+        if updated != len(picks):
+            raise ModeChanged()
+
+
+def adjust(show, delta):
+    """
+    Add `delta` seats (negative to remove) to a sharded show's inventory, e.g.
+    after its total was edited. Must be called inside a transaction, after
+    the show row itself has been locked or updated.
+    """
+    shards = list(SeatShard.objects.select_for_update().filter(show=show).order_by('shard'))
+    if not shards:
+        raise ShardingError("The show's seats are not sharded.")
+    if delta >= 0:
+        changes = {random.choice(shards).pk: delta}
+    else:
+        changes, remaining = {}, -delta
+        for shard in shards:
+            take = min(shard.available_seats, remaining)
+            if take:
+                changes[shard.pk] = -take
+                remaining -= take
+        if remaining:
+            raise ShardingError("Not enough unreserved seats to remove.")
+    SeatShard.objects.filter(pk__in=changes).update(
+        available_seats=F('available_seats') + Case(
+            *[When(pk=pk, then=Value(change)) for pk, change in changes.items()],
+            default=Value(0),
+        )
+    )
+    catalogue.seats_changed([show.pk])
+
+
+def available_seats(show):
+    """`show.available_seats`, or for a sharded show the current total of its shards."""
+    if not show.seat_shards:
+        return show.available_seats
+    return catalogue.seat_shard_totals([show.pk]).get(show.pk, 0)
+
+
+def sync_available_seats(show_ids):
+    """Write the shard totals of the given sharded shows back to Show.available_seats."""
+    seats = (
+        SeatShard.objects.filter(show=OuterRef('pk')).order_by()
+        .values('show').annotate(seats=Sum('available_seats')).values('seats')
+    )
+    return Show.objects.filter(pk__in=show_ids, seat_shards__gt=0).update(
+        available_seats=Coalesce(Subquery(seats), 0),
+    )
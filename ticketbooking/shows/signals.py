@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Show
+from . import catalogue
+from . import live
+
+
+@receiver(post_save, sender=Show)
+@receiver(post_delete, sender=Show)
+def show_changed(sender, instance, **kwargs):
+    # Any full save or delete of a show (admin create/update/delete) invalidates
+    # the cached catalogue. Seat-count updates go through QuerySet.update() and
+    # only drop the per-show seat counters instead.
+    catalogue.catalogue_changed([instance.pk])
+
+
+@receiver(catalogue.availability_changed)
+def push_availability(sender, show_ids, **kwargs):
+    # Wake the live availability streams (server-sent events) in this process
+    live.notify(show_ids)
@@ -1,3 +1,700 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.test import TestCase, SimpleTestCase
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, IntegrityError, transaction
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.core.management import call_command
+from django.urls import reverse, path, include
+from django.utils import timezone
+
+from bookings.services import book_seats, cancel_booking, place_hold, release_hold, InsufficientSeats
+from .models import Show, SeatRow, SeatShard
+from .views import AsyncShowListView, AsyncShowDetailView
+from bookings.views import AsyncBookingHistoryView
+from bookings.models import Booking
+from custom_admin.models import ShowSalesRollup
+from . import seatmap
+from . import waiting_room
+from . import catalogue
+from . import live
+from . import search
+from . import shards
+from . import rendering
+from ticket_booking_system.queryplans import captured_full_scans, full_scans
+from ticket_booking_system import server
+
+
+def make_show(**kwargs):
+    defaults = {
+        'title': "Test Show",
+        'description': "A show used in tests",
+        'date_time': timezone.now() + timezone.timedelta(days=7),
+        'location': "Main Hall",
+        'total_seats': 10,
+        'available_seats': 10,
+        'price': Decimal('25.00'),
+    }
+    defaults.update(kwargs)
+    return Show.objects.create(**defaults)
+
+
+class BitmapTests(SimpleTestCase):
+    def test_find_run_prefers_centre_of_row(self):
+        bitmap = seatmap.empty_bitmap(10)
+        self.assertEqual(seatmap.find_run(bitmap, 10, 2), 4)
+
+    def test_find_run_skips_taken_seats(self):
+        # Seats 1-3 and 6-10 taken, only 4-5 are free together
+        bitmap = seatmap.to_bytes(0b1111100111, 10)
+        self.assertEqual(seatmap.find_run(bitmap, 10, 2), 3)
+        self.assertIsNone(seatmap.find_run(bitmap, 10, 3))
+
+    def test_occupy_and_counts(self):
+        bitmap = seatmap.occupy(seatmap.empty_bitmap(12), 12, 9, 3)
+        self.assertEqual(seatmap.free_count(bitmap, 12), 9)
+        self.assertEqual(seatmap.render_row(bitmap, 12), 'ooooooooo' + 'xxx')
+        with self.assertRaises(seatmap.SeatsTaken):
+            seatmap.occupy(bitmap, 12, 8, 2)
+
+
+class SeatMapBookingTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='bob', password='pw')
+        self.show = seatmap.build_seat_map(make_show(), [("Stalls", 2, 4), ("Balcony", 1, 6)])
+
+    def test_build_sets_counters_from_map(self):
+        self.assertTrue(self.show.has_seat_map)
+        self.assertEqual(self.show.total_seats, 14)
+        self.assertEqual(self.show.available_seats, 14)
+
+    def test_booking_assigns_adjacent_seats_in_best_row(self):
+        booking = book_seats(self.user, self.show, 2)
+        self.assertEqual(booking.seats, "Stalls Row 1, Seats 2-3")
+        booking = book_seats(self.user, self.show, 3)
+        self.assertEqual(booking.seats, "Stalls Row 2, Seats 1-3")
+        booking = book_seats(self.user, self.show, 5)
+        self.assertEqual(booking.seats, "Balcony Row 1, Seats 1-5")
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 4)
+        self.assertEqual(seatmap.sync_available_seats(self.show), 4)
+
+    def test_counter_is_set_from_the_bitmaps(self):
+        Show.objects.filter(pk=self.show.pk).update(available_seats=10) # Drifted by hand
+        with CaptureQueriesContext(connection) as queries:
+            booking = book_seats(self.user, self.show, 2)
+        counter_updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "shows_show"')]
+        self.assertEqual(len(counter_updates), 1)
+        self.assertIn('FROM "shows_seatrow"', counter_updates[0]) # Derived from the rows in the UPDATE, not decremented
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 12)
+        Show.objects.filter(pk=self.show.pk).update(available_seats=0)
+        cancel_booking(booking)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 14)
+
+    def test_inactive_show_is_refused_before_claiming_seats(self):
+        Show.objects.filter(pk=self.show.pk).update(is_active=False)
+        with self.assertRaises(InsufficientSeats):
+            book_seats(self.user, self.show, 2)
+        self.assertEqual(sum(row.free_seats for row in SeatRow.objects.all()), 14)
+
+    def test_no_adjacent_block_is_rejected_without_side_effects(self):
+        with self.assertRaises(InsufficientSeats):
+            book_seats(self.user, self.show, 7)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 14)
+        self.assertEqual(sum(row.free_seats for row in SeatRow.objects.all()), 14)
+
+    def test_detail_page_renders_seat_map(self):
+        book_seats(self.user, self.show, 2)
+        response = self.client.get(reverse('show_detail', kwargs={'pk': self.show.pk}))
+        self.assertContains(response, "<code>oxxo</code>", html=False)
+
+
+class CatalogueCacheTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='dora', password='pw')
+        self.show = make_show()
+        make_show(title="Hidden", is_active=False)
+
+    def test_list_is_served_from_cache_with_live_seat_counts(self):
+        self.client.get(reverse('show_list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('show_list'))
+        self.assertEqual([s.title for s in response.context['shows']], ["Test Show"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book_seats(self.user, self.show, 3)
+        version = catalogue.get_version()
+        with self.assertNumQueries(1): # Only the seat counter is reloaded
+            response = self.client.get(reverse('show_list'))
+        self.assertEqual(response.context['shows'][0].available_seats, 7)
+        self.assertEqual(catalogue.get_version(), version)
+
+    def test_show_save_bumps_version(self):
+        catalogue.get_active_show(self.show.pk)
+        version = catalogue.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.show.title = "New Title"
+            self.show.save()
+        self.assertGreater(catalogue.get_version(), version)
+        self.assertEqual(catalogue.get_active_show(self.show.pk).title, "New Title")
+
+    def test_hidden_show_is_404(self):
+        hidden = Show.objects.get(title="Hidden")
+        self.assertEqual(self.client.get(reverse('show_detail', kwargs={'pk': hidden.pk})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('show_detail', kwargs={'pk': hidden.pk})).status_code, 404)
+        self.assertGreaterEqual(catalogue.stats()['hits'], 1)
+
+
+class RenderingTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='rita', password='pw')
+        self.show = make_show(date_time=timezone.make_aware(timezone.datetime(2030, 5, 17, 20, 30)))
+
+    def test_templates_are_parsed_once(self):
+        self.assertIsInstance(engines.all()[0].engine.template_loaders[0], CachedLoader)
+
+    @override_settings(TIME_ZONE='Europe/Paris')
+    def test_dates_are_formatted_when_cached(self):
+        show = catalogue.get_active_show(self.show.pk)
+        self.assertEqual(show.list_date, "2030-05-17 22:30") # Stored as 20:30 UTC
+        self.assertEqual(show.detail_date, "Friday, May 17, 2030 10:30 p.m.")
+
+    def test_cards_are_cached_and_seats_stay_live(self):
+        self.client.get(reverse('show_list'))
+        with mock.patch.object(rendering, 'get_template') as get_template:
+            with self.captureOnCommitCallbacks(execute=True):
+                book_seats(self.user, self.show, 3)
+            self.assertContains(self.client.get(reverse('show_list')), "7 left!")
+            with self.captureOnCommitCallbacks(execute=True):
+                Show.objects.get(pk=self.show.pk).save() # Reloads the catalogue, but the card is unchanged
+            self.client.get(reverse('show_list'))
+        get_template.assert_not_called()
+
+    def test_edits_reach_the_cached_fragments(self):
+        detail = reverse('show_detail', kwargs={'pk': self.show.pk})
+        self.client.get(reverse('show_list'))
+        self.client.get(detail)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.show.title = "Renamed"
+            self.show.description = "New description"
+            self.show.save()
+        self.assertContains(self.client.get(reverse('show_list')), "Renamed")
+        self.assertContains(self.client.get(detail), "New description")
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        now = timezone.now()
+        self.rock = make_show(title="Rock Night", description="Loud guitars", location="Berlin",
+                              date_time=now + timezone.timedelta(days=2), price=Decimal('30.00'))
+        self.jazz = make_show(title="Jazz Evening", description="Smooth saxophone", location="Paris",
+                              date_time=now + timezone.timedelta(days=10), price=Decimal('60.00'))
+        self.opera = make_show(title="Opera Gala", description="Rock opera classics", location="Berlin",
+                               date_time=now + timezone.timedelta(days=20), price=Decimal('90.00'))
+        make_show(title="Hidden Rock", is_active=False)
+
+    def titles(self, **params):
+        response = self.client.get(reverse('show_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return [show.title for show in response.context['shows']]
+
+    def test_text_matches_word_prefixes_in_every_field(self):
+        self.assertEqual(self.titles(q="rock"), ["Rock Night", "Opera Gala"])
+        self.assertEqual(self.titles(q="SAXO"), ["Jazz Evening"])
+        self.assertEqual(self.titles(q="paris"), ["Jazz Evening"])
+        self.assertEqual(self.titles(q="rock berlin gala"), ["Opera Gala"]) # Every term must match
+        self.assertEqual(self.titles(q='"rock" - (*'), ["Rock Night", "Opera Gala"]) # Not query syntax
+        self.assertEqual(self.titles(q="tuba"), [])
+
+    def test_index_follows_edits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jazz.title = "Blues Evening"
+            self.jazz.save()
+        self.assertEqual(self.titles(q="blues"), ["Blues Evening"])
+        self.assertEqual(self.titles(q="jazz"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rock.delete()
+        self.assertEqual(self.titles(q="rock"), ["Opera Gala"])
+
+    def test_date_and_price_ranges(self):
+        today = timezone.localdate()
+        self.assertEqual(self.titles(**{'from': today + timezone.timedelta(days=5)}), ["Jazz Evening", "Opera Gala"])
+        self.assertEqual(self.titles(to=today + timezone.timedelta(days=10)), ["Rock Night", "Jazz Evening"])
+        self.assertEqual(self.titles(min_price='60', max_price='90'), ["Jazz Evening", "Opera Gala"])
+        self.assertEqual(self.titles(q="rock", max_price='50'), ["Rock Night"])
+
+    def test_invalid_filters_are_reported_and_ignored(self):
+        response = self.client.get(reverse('show_list'), {'from': 'soon', 'min_price': '-5'})
+        self.assertEqual(len(response.context['shows']), 3)
+        self.assertContains(response, "Enter the start date as YYYY-MM-DD.")
+        self.assertContains(response, "Enter the minimum price as a positive number.")
+
+    def test_location_facets(self):
+        response = self.client.get(reverse('show_list'), {'q': 'rock'})
+        self.assertEqual(response.context['results'].facets, [("Berlin", 2)])
+        self.assertEqual(response.context['results'].total, 2)
+
+        response = self.client.get(reverse('show_list'), {'location': 'Paris'})
+        self.assertEqual([s.title for s in response.context['shows']], ["Jazz Evening"])
+        self.assertEqual(response.context['results'].total, 1)
+        # The other locations stay listed, with their own counts
+        self.assertEqual(response.context['results'].facets, [("Berlin", 2), ("Paris", 1)])
+        facets = {facet['location']: facet for facet in response.context['facets']}
+        self.assertTrue(facets["Paris"]['selected'])
+        self.assertEqual(facets["Paris"]['url'], '?') # Selecting it again clears it
+        self.assertEqual(facets["Berlin"]['url'], '?location=Berlin')
+
+    def test_pages(self):
+        first = search.search(search.SearchQuery(), page_size=2)
+        self.assertEqual([s.title for s in first.shows], ["Rock Night", "Jazz Evening"])
+        self.assertEqual(first.total, 3)
+        second = search.search(search.SearchQuery(after=first.next_cursor), page_size=2)
+        self.assertEqual([s.title for s in second.shows], ["Opera Gala"])
+        self.assertFalse(second.has_next)
+        self.assertEqual(self.client.get(reverse('show_list'), {'after': 'garbage'}).status_code, 404)
+
+    def test_search_is_cached_until_the_catalogue_changes(self):
+        self.titles(q="rock")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(q="rock"), ["Rock Night", "Opera Gala"])
+        with self.captureOnCommitCallbacks(execute=True):
+            make_show(title="Rock Matinee", date_time=timezone.now() + timezone.timedelta(days=30))
+        self.assertEqual(self.titles(q="rock"), ["Rock Night", "Opera Gala", "Rock Matinee"])
+
+
+class SeatShardTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='sam', password='pw')
+        self.show = make_show(total_seats=10)
+
+    def shard_seats(self):
+        return list(SeatShard.objects.filter(show=self.show).values_list('available_seats', flat=True))
+
+    def test_split_and_unsplit_keep_the_seat_count(self):
+        book_seats(self.user, self.show, 3)
+        shards.set_shards(self.show, 3)
+        self.assertEqual(self.shard_seats(), [3, 2, 2])
+        shards.set_shards(self.show, 0)
+        self.show.refresh_from_db()
+        self.assertEqual((self.show.seat_shards, self.show.available_seats), (0, 7))
+        self.assertFalse(SeatShard.objects.exists())
+        with self.assertRaises(shards.ShardingError):
+            shards.set_shards(self.show, shards.MAX_SHARDS + 1)
+
+    def test_bookings_take_from_shards_and_never_oversell(self):
+        shards.set_shards(self.show, 4)
+        book_seats(self.user, self.show, 2) # Fits in one shard
+        self.assertEqual(sum(self.shard_seats()), 8)
+        book_seats(self.user, self.show, 7) # Needs several
+        self.assertEqual(sum(self.shard_seats()), 1)
+        with self.assertRaises(InsufficientSeats):
+            book_seats(self.user, self.show, 2)
+        self.assertEqual(min(self.shard_seats()), 0)
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 10) # Only the sync job writes the total back
+        self.assertEqual(shards.available_seats(self.show), 1)
+
+    def test_released_holds_go_back_to_the_shards(self):
+        shards.set_shards(self.show, 2)
+        hold = place_hold(self.user, self.show, 4)
+        self.assertEqual(sum(self.shard_seats()), 6)
+        self.assertTrue(release_hold(hold))
+        self.assertEqual(sum(self.shard_seats()), 10)
+
+    def test_stale_show_books_in_either_mode(self):
+        stale = Show.objects.get(pk=self.show.pk)
+        shards.set_shards(self.show, 2)
+        book_seats(self.user, stale, 1) # Still thinks the seats are on the show
+        self.assertEqual(sum(self.shard_seats()), 9)
+        stale = Show.objects.get(pk=self.show.pk)
+        shards.set_shards(self.show, 0)
+        book_seats(self.user, stale, 1) # Still thinks they are sharded
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 8)
+
+    def test_catalogue_sums_the_shards(self):
+        shards.set_shards(self.show, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            book_seats(self.user, self.show, 4)
+        response = self.client.get(reverse('show_list'))
+        self.assertEqual(response.context['shows'][0].available_seats, 6)
+
+    def test_sync_writes_totals_and_rollups(self):
+        call_command('shard_seats', self.show.pk, 2, stdout=open(os.devnull, 'w'))
+        book_seats(self.user, self.show, 3)
+        self.assertFalse(ShowSalesRollup.objects.filter(show=self.show, tickets_sold=3).exists())
+        call_command('sync_seat_shards', stdout=open(os.devnull, 'w'))
+        self.show.refresh_from_db()
+        self.assertEqual(self.show.available_seats, 7)
+        self.assertEqual(ShowSalesRollup.objects.get(show=self.show).tickets_sold, 3)
+
+    def test_admin_total_seat_change_goes_to_the_shards(self):
+        shards.set_shards(self.show, 2)
+        book_seats(self.user, self.show, 4)
+        admin = User.objects.create_superuser(username='root', password='pw')
+        self.client.force_login(admin)
+        local = timezone.localtime(self.show.date_time)
+        data = {
+            'title': self.show.title, 'description': self.show.description,
+            'date': local.strftime('%Y-%m-%d'), 'time': local.strftime('%H:%M'),
+            'location': self.show.location, 'price': '25.00', 'is_active': 'on',
+        }
+        url = reverse('admin_show_update', kwargs={'pk': self.show.pk})
+        response = self.client.post(url, {**data, 'total_seats': '3'})
+        self.assertContains(response, "already booked (4)")
+        self.client.post(url, {**data, 'total_seats': '6'})
+        self.assertEqual(sum(self.shard_seats()), 2)
+        self.show.refresh_from_db()
+        self.assertEqual((self.show.total_seats, self.show.available_seats), (6, 2))
+
+
+class AvailabilityApiTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='ann', password='pw')
+        self.show = make_show()
+        self.other = make_show(title="Other")
+        Show.objects.filter(pk=self.other.pk).update(available_seats=0)
+
+    def test_single_show_and_conditional_get(self):
+        url = reverse('show_availability', kwargs={'pk': self.show.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'id': self.show.pk, 'available_seats': 10, 'total_seats': 10, 'sold_out': False})
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotIn('sessionid', response.cookies)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_when_seats_are_booked(self):
+        url = reverse('show_availability', kwargs={'pk': self.show.pk})
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            book_seats(self.user, self.show, 4)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['available_seats'], 6)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_batch(self):
+        hidden = make_show(title="Hidden", is_active=False)
+        url = reverse('show_availability_batch')
+        response = self.client.get(url, {'ids': f'{self.show.pk},{self.other.pk},{hidden.pk}'})
+        data = response.json()
+        self.assertEqual([s['id'] for s in data['shows']], [self.show.pk, self.other.pk])
+        self.assertTrue(data['shows'][1]['sold_out'])
+        self.assertEqual(data['not_found'], [hidden.pk])
+        self.assertEqual(self.client.get(url, {'ids': 'a,b'}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_missing_show_is_404(self):
+        response = self.client.get(reverse('show_availability', kwargs={'pk': self.other.pk + 100}))
+        self.assertEqual(response.status_code, 404)
+
+
+class LiveAvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='eve', password='pw')
+        self.show = make_show()
+
+    def book(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            book_seats(self.user, self.show, quantity)
+
+    async def test_subscription_coalesces_and_rate_limits(self):
+        subscription = live.Subscription([1], max_rate=10)
+        for seats in (9, 8, 7):
+            subscription.offer(1, {'id': 1, 'available_seats': seats})
+        self.assertEqual(await subscription.next(timeout=1), [{'id': 1, 'available_seats': 7}])
+        self.assertEqual(subscription.coalesced, 2)
+        subscription.offer(1, {'id': 1, 'available_seats': 6})
+        started = asyncio.get_running_loop().time()
+        await subscription.next(timeout=1)
+        self.assertGreaterEqual(asyncio.get_running_loop().time() - started, 0.05)
+        self.assertEqual(await subscription.next(timeout=0.01), []) # Keep-alive timeout
+
+    async def test_booking_is_pushed_to_every_subscriber(self):
+        hub = live.get_hub()
+        hub.max_rate = 100
+        subscriptions = [hub.subscribe([self.show.pk]) for _ in range(3)]
+        snapshot = await hub.snapshot([self.show.pk])
+        self.assertEqual(snapshot[0]['available_seats'], 10)
+
+        await sync_to_async(self.book)(3)
+        for subscription in subscriptions:
+            updates = await subscription.next(timeout=2)
+            self.assertEqual(updates, [{'id': self.show.pk, 'available_seats': 7, 'total_seats': 10, 'sold_out': False}])
+        for subscription in subscriptions:
+            hub.unsubscribe(subscription)
+        self.assertEqual(hub.subscribers, {})
+
+    async def test_hub_notices_changes_from_other_processes(self):
+        hub = live.Hub(poll_interval=0.02, max_rate=100)
+        subscription = hub.subscribe([self.show.pk])
+        await hub.snapshot([self.show.pk])
+        # What another worker's booking leaves behind: a new count and a bumped seat version
+        await Show.objects.filter(pk=self.show.pk).aupdate(available_seats=4)
+        await sync_to_async(catalogue.bump_seat_versions)([self.show.pk])
+        updates = await subscription.next(timeout=2)
+        self.assertEqual(updates[0]['available_seats'], 4)
+        hub.unsubscribe(subscription)
+
+    @override_settings(ASYNC_VIEWS=True)
+    async def test_stream_view_sends_snapshot(self):
+        response = await self.async_client.get(reverse('show_availability_stream'), {'ids': str(self.show.pk)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertNotIn('sessionid', response.cookies)
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry:'))
+        self.assertEqual(
+            await anext(chunks),
+            f'event: availability\ndata: {{"id": {self.show.pk}, "available_seats": 10, "total_seats": 10, "sold_out": false}}\n\n'.encode(),
+        )
+        await chunks.aclose()
+        bad = await self.async_client.get(reverse('show_availability_stream'), {'ids': 'x'})
+        self.assertEqual(bad.status_code, 400)
+
+    def test_stream_view_refused_under_wsgi(self):
+        # The test client goes through the WSGI handler, as the default server does
+        with mock.patch.object(live, 'get_hub') as get_hub:
+            response = self.client.get(reverse('show_availability_stream'), {'ids': str(self.show.pk)})
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+        get_hub.assert_not_called() # Nothing subscribed, nothing left buffering
+
+
+class AsyncUrls:
+    # The URLconf an ASGI deployment builds (settings.ASYNC_VIEWS): the async
+    # views first, everything else as usual
+    urlpatterns = [
+        path('shows/', AsyncShowListView.as_view(), name='show_list'),
+        path('shows/<int:pk>/', AsyncShowDetailView.as_view(), name='show_detail'),
+        path('bookings/history/', AsyncBookingHistoryView.as_view(), name='booking_history'),
+        path('', include('ticket_booking_system.urls')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='ash', password='pw')
+        self.show = make_show()
+        make_show(title="Hidden", is_active=False)
+
+    async def test_list_and_detail(self):
+        response = await self.async_client.get(reverse('show_list'))
+        self.assertEqual([s.title for s in response.context['shows']], ["Test Show"])
+        self.assertContains(response, "Login") # Anonymous navigation rendered from the resolved user
+
+        response = await self.async_client.get(reverse('show_detail', kwargs={'pk': self.show.pk}))
+        self.assertEqual(response.context['show'], self.show)
+        hidden = await Show.objects.aget(title="Hidden")
+        response = await self.async_client.get(reverse('show_detail', kwargs={'pk': hidden.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_booking_post_and_history(self):
+        url = reverse('show_detail', kwargs={'pk': self.show.pk})
+        response = await self.async_client.post(url, {'quantity': '3'})
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(url, {'quantity': '3'})
+        self.assertEqual(response['Location'], reverse('booking_confirmation'))
+        self.assertEqual((await Show.objects.aget(pk=self.show.pk)).available_seats, 7)
+
+        response = await self.async_client.post(url, {'quantity': '8'})
+        self.assertEqual(response['Location'], url)
+        response = await self.async_client.get(url)
+        self.assertEqual(len(response.context['errors']), 1) # Seat counts are only re-read after commit
+        self.assertEqual(await Booking.objects.acount(), 1)
+
+        response = await self.async_client.get(reverse('booking_history'))
+        self.assertEqual([b.quantity for b in response.context['bookings']], [3])
+        self.assertContains(response, "ash")
+
+
+class WaitingRoomBackendTests(SimpleTestCase):
+    def check_backend(self, room, clock):
+        clock.return_value = 1000.0
+        first = room.join(1, rate=2)
+        second = room.join(1, rate=2)
+        third = room.join(1, rate=2)
+        self.assertTrue(first.admitted)
+        self.assertTrue(second.admitted)
+        self.assertFalse(third.admitted)
+        self.assertEqual(third.position, 1)
+        self.assertEqual(third.estimated_wait, 0.5)
+
+        clock.return_value = 1000.5
+        self.assertTrue(room.status(1, third.token).admitted)
+        self.assertIsNone(room.status(2, third.token)) # Tickets belong to one show
+        room.consume(1, third.token)
+        self.assertIsNone(room.status(1, third.token))
+
+    def test_in_memory_backend(self):
+        with mock.patch('shows.waiting_room.time.monotonic') as clock:
+            self.check_backend(waiting_room.InMemoryWaitingRoom(), clock)
+
+    def test_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch('shows.waiting_room.time.time') as clock:
+                self.check_backend(waiting_room.SQLiteWaitingRoom(path=os.path.join(tmp, 'queue.sqlite3')), clock)
+
+    def check_pruning(self, room, clock):
+        room.PRUNE_EVERY = 10
+        clock.return_value = 1000.0
+        kept = room.join(1, rate=1)
+        for minute in range(1, 11):
+            # Each burst is abandoned; only `kept` keeps polling
+            clock.return_value = 1000.0 + minute * 60
+            for _ in range(10):
+                room.join(minute, rate=1)
+            self.assertIsNotNone(room.status(1, kept.token))
+            self.assertLessEqual(room.ticket_count(), 1 + 70) # Tickets checked within the ttl and this burst
+        clock.return_value += room.ticket_ttl
+        self.assertIsNone(room.status(1, kept.token)) # Expired once not checked for ticket_ttl
+        for _ in range(10):
+            room.join(1, rate=1)
+        self.assertLessEqual(room.ticket_count(), 10)
+
+    def test_in_memory_backend_prunes_tickets(self):
+        with mock.patch('shows.waiting_room.time.monotonic') as clock:
+            self.check_pruning(waiting_room.InMemoryWaitingRoom(ticket_ttl=300), clock)
+
+    def test_sqlite_backend_prunes_tickets(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch('shows.waiting_room.time.time') as clock:
+                self.check_pruning(waiting_room.SQLiteWaitingRoom(path=os.path.join(tmp, 'queue.sqlite3'), ticket_ttl=300), clock)
+
+
+@mock.patch.dict(os.environ)
+@mock.patch.object(server, 'Server')
+class ServerSharedStateTests(SimpleTestCase):
+    SHARED = {
+        'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379/0'}},
+        'WAITING_ROOM': {'BACKEND': 'shows.waiting_room.SQLiteWaitingRoom', 'OPTIONS': {}},
+    }
+
+    def test_several_workers_refused_with_per_process_state(self, Server):
+        # The test settings use LocMem and the in-memory waiting room
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()) as stderr:
+            server.main(['--workers', '4'])
+        self.assertIn('CACHE_BACKEND', stderr.getvalue())
+        self.assertIn('WAITING_ROOM_BACKEND', stderr.getvalue())
+        Server.assert_not_called()
+
+    def test_one_worker_allowed_with_per_process_state(self, Server):
+        server.main(['--workers', '1'])
+        Server.return_value.run.assert_called_once()
+
+    def test_several_workers_allowed_with_shared_state(self, Server):
+        with self.settings(**self.SHARED):
+            server.main(['--workers', '4'])
+        self.assertEqual(Server.call_args.args[0]['workers'], 4)
+
+    def test_several_workers_share_metrics_through_a_directory(self, Server):
+        os.environ.pop('METRICS_DIR', None)
+        with self.settings(**self.SHARED):
+            server.main(['--workers', '4'])
+        self.assertIn(f'ticketbooking-metrics-{os.getpid()}', os.environ['METRICS_DIR'])
+        os.environ.pop('METRICS_DIR')
+        server.main(['--workers', '1'])
+        self.assertNotIn('METRICS_DIR', os.environ) # One worker serves its own numbers
+
+
+class WaitingRoomViewTests(TestCase):
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.show = make_show(queue_enabled=True, queue_rate=1)
+        self.room = waiting_room.InMemoryWaitingRoom()
+        patcher = mock.patch('shows.views.get_waiting_room', return_value=self.room)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_second_customer_waits_and_polls_without_touching_show(self):
+        first = User.objects.create_user(username='first', password='pw')
+        second = User.objects.create_user(username='second', password='pw')
+        url = reverse('show_hold', kwargs={'pk': self.show.pk})
+
+        self.client.force_login(first)
+        response = self.client.post(url, {'quantity': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotEqual(response['Location'], reverse('show_queue', kwargs={'pk': self.show.pk}))
+
+        self.client.force_login(second)
+        response = self.client.post(url, {'quantity': '1'})
+        self.assertRedirects(response, reverse('show_queue', kwargs={'pk': self.show.pk}))
+        token = self.client.session['queue_tickets'][str(self.show.pk)]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse('show_queue_status', kwargs={'pk': self.show.pk}), {'ticket': token}
+            )
+        self.assertEqual(response.json()['position'], 1)
+        self.assertFalse(response.json()['admitted'])
+
+
+class QueryPlanTests(TestCase):
+    # Every statement the public pages run must be able to use an index
+    def setUp(self):
+        cache.clear() # The show catalogue is cached between requests
+        self.user = User.objects.create_user(username='quinn', password='pw')
+        self.show = make_show()
+        self.mapped = seatmap.build_seat_map(make_show(title="Mapped"), [("Stalls", 2, 4)])
+        self.client.force_login(self.user)
+
+    def assertNoFullScans(self, send):
+        with CaptureQueriesContext(connection) as queries:
+            send()
+        self.assertEqual(captured_full_scans(queries.captured_queries), {})
+
+    def test_unindexed_filter_is_reported(self):
+        self.assertEqual(full_scans(Show.objects.filter(location="Main Hall").order_by()), ['shows_show'])
+        self.assertEqual(full_scans(Show.objects.filter(is_active=True, date_time__gte=timezone.now())), [])
+
+    def test_listing_and_detail(self):
+        self.assertNoFullScans(lambda: self.client.get(reverse('show_list')))
+        self.assertNoFullScans(lambda: self.client.get(reverse('show_list'), {'q': 'test', 'location': 'Main Hall'}))
+        self.assertNoFullScans(lambda: self.client.get(reverse('show_list'), {'min_price': '10', 'to': '2099-01-01'}))
+        self.assertNoFullScans(lambda: self.client.get(reverse('show_detail', kwargs={'pk': self.show.pk})))
+        self.assertNoFullScans(lambda: self.client.get(reverse('show_availability', kwargs={'pk': self.show.pk})))
+
+    def test_booking(self):
+        for show in (self.show, self.mapped):
+            url = reverse('show_detail', kwargs={'pk': show.pk})
+            self.assertNoFullScans(lambda: self.client.post(url, {'quantity': 2, 'idempotency_key': f'k{show.pk}'}))
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+class SeatConstraintTests(TestCase):
+    def test_available_seats_cannot_exceed_total(self):
+        show = make_show(total_seats=5)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Show.objects.filter(pk=show.pk).update(available_seats=6)
+
+    def test_price_cannot_be_negative(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            make_show(price=Decimal('-1.00'))
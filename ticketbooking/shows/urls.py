@@ -1,7 +1,24 @@
+from django.conf import settings
 from django.urls import path
-from .views import ShowListView, ShowDetailView
+from .views import (
+    ShowListView, ShowDetailView, ShowHoldView, ShowQueueView, ShowQueueStatusView, ShowAvailabilityView,
+    ShowAvailabilityStreamView, AsyncShowListView, AsyncShowDetailView, ShowCartAddView,
+)
+
+# ASGI deployments browse and book through the async views
+if settings.ASYNC_VIEWS:
+    list_view, detail_view = AsyncShowListView, AsyncShowDetailView
+else:
+    list_view, detail_view = ShowListView, ShowDetailView
 
 urlpatterns = [
-    path('', ShowListView.as_view(), name='show_list'),
-    path('<int:pk>/', ShowDetailView.as_view(), name='show_detail'),
+    path('', list_view.as_view(), name='show_list'),
+    path('availability/', ShowAvailabilityView.as_view(), name='show_availability_batch'),
+    path('availability/stream/', ShowAvailabilityStreamView.as_view(), name='show_availability_stream'),
+    path('<int:pk>/', detail_view.as_view(), name='show_detail'),
+    path('<int:pk>/hold/', ShowHoldView.as_view(), name='show_hold'),
+    path('<int:pk>/cart/', ShowCartAddView.as_view(), name='show_cart_add'),
+    path('<int:pk>/queue/', ShowQueueView.as_view(), name='show_queue'),
+    path('<int:pk>/queue/status/', ShowQueueStatusView.as_view(), name='show_queue_status'),
+    path('<int:pk>/availability/', ShowAvailabilityView.as_view(), name='show_availability'),
 ]
\ No newline at end of file
@@ -1,20 +1,145 @@
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse, Http404, StreamingHttpResponse
 from django.views.generic import ListView, DetailView, View
 from django.urls import reverse
 from django.contrib.auth.mixins import LoginRequiredMixin # Useful mixin for CBVs
 from django.views.decorators.csrf import csrf_protect
 from django.utils.decorators import method_decorator
-from django.utils import timezone # Import timezone module
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
 from .models import Show
-from bookings.models import Booking # Import Booking model from bookings app
+from . import seatmap
+from . import catalogue
+from . import live
+from . import search
+from . import rendering
+from .waiting_room import get_waiting_room
+from bookings.services import book_seats, place_hold, BookingError, idempotency_key_used
+from bookings import cart
+from ticket_booking_system.asyncviews import auser
+from ticket_booking_system.pagination import InvalidCursor
+
+def validate_quantity(quantity_str, show):
+    # Shared by the direct booking and the hold flows. Returns (quantity, errors).
+    errors = []
+    quantity = 0
+
+    if not quantity_str:
+        errors.append("Please enter the number of tickets.")
+    else:
+        try:
+            quantity = int(quantity_str)
+            if quantity <= 0:
+                errors.append("Quantity must be a positive number.")
+        except ValueError:
+            errors.append("Invalid quantity entered.")
+
+    if not errors: # Only perform seat check if quantity is valid number
+        if quantity > show.available_seats:
+            errors.append(f"Only {show.available_seats} seats available.")
+        if quantity > show.total_seats: # Should not happen if quantity > 0, but good check
+             errors.append(f"Cannot book more than total seats available ({show.total_seats}).")
+    return quantity, errors
+
+
+def idempotency_key(request):
+    # From the booking form's hidden field, or the Idempotency-Key header for API clients
+    return request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key') or None
+
+
+def waiting_room_redirect(request, show, key=None):
+    """
+    For shows with the admission queue on, return a redirect to the waiting
+    room unless the user's ticket has been admitted. Returns None when the
+    booking attempt may go ahead.
+    """
+    if not show.queue_enabled:
+        return None
+    if idempotency_key_used(request.user, key):
+        return None # A resubmission already went through the queue; it only replays its outcome
+    room = get_waiting_room()
+    tickets = request.session.get('queue_tickets', {})
+    token = tickets.get(str(show.pk))
+    status = room.status(show.pk, token) if token else None
+    if status is None:
+        status = room.join(show.pk, show.queue_rate)
+        tickets[str(show.pk)] = status.token
+        request.session['queue_tickets'] = tickets
+    if status.admitted:
+        return None
+    request.session['booking_quantity'] = request.POST.get('quantity', '')
+    return redirect(reverse('show_queue', kwargs={'pk': show.pk}))
+
+
+def leave_waiting_room(request, show):
+    # An admitted ticket is good for one successful booking
+    tickets = request.session.get('queue_tickets', {})
+    token = tickets.pop(str(show.pk), None)
+    if token:
+        get_waiting_room().consume(show.pk, token)
+        request.session['queue_tickets'] = tickets
+
+
+def search_url(params, **changes):
+    # The current search with some parameters changed (None drops one)
+    params = params.copy()
+    for name, value in changes.items():
+        params.pop(name, None)
+        if value is not None:
+            params[name] = value
+    return '?' + params.urlencode()
+
+
+def search_context(request, query, results, errors):
+    # Template context shared by ShowListView and AsyncShowListView
+    params = request.GET.copy()
+    params.pop('after', None) # A changed search starts from the first page
+    facets = [
+        {
+            'location': location,
+            'count': count,
+            'selected': location == query.location,
+            'url': search_url(params, location=None if location == query.location else location),
+        }
+        for location, count in results.facets
+    ]
+    return {
+        'query': query,
+        'results': results,
+        'search_errors': errors,
+        'facets': facets,
+        'searching': any(request.GET.get(name) for name in search.PARAMS),
+        'next_url': search_url(params, after=results.next_cursor) if results.has_next else None,
+        'first_url': search_url(params) if query.after else None,
+    }
+
 
 class ShowListView(ListView):
     model = Show
     template_name = 'shows/show_list.html'
     context_object_name = 'shows'
-    # Only show active shows in the public list
-    queryset = Show.objects.filter(is_active=True).order_by('date_time')
+
+    def get_queryset(self):
+        # One page of the active shows matching the search form, served from the
+        # catalogue cache (see shows/search.py)
+        self.query, self.search_errors = search.SearchQuery.from_params(self.request.GET)
+        try:
+            self.results = search.search(self.query)
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        return self.results.shows
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(search_context(self.request, self.query, self.results, self.search_errors))
+        rendering.add_cards(self.results.shows) # The static cells of each row, cached per show
+        return context
 
 @method_decorator(csrf_protect, name='post') # Protect the POST method
 class ShowDetailView(DetailView):
@@ -27,11 +152,24 @@ class ShowDetailView(DetailView):
         # Ensure only active shows are viewable publicly
         return Show.objects.filter(is_active=True)
 
+    def get_object(self, queryset=None):
+        # Served from the catalogue cache, with live seat counts overlaid
+        show = catalogue.get_active_show(self.kwargs.get(self.pk_url_kwarg))
+        if show is None:
+            raise Http404("No show found matching the query")
+        return show
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Pass any errors from POST request back to the template
         context['errors'] = self.request.session.pop('booking_errors', [])
         context['submitted_quantity'] = self.request.session.pop('booking_quantity', '')
+        # One key per rendered form, so a double submit books only once
+        context['idempotency_key'] = uuid.uuid4().hex
+        rendering.precompute([self.object]) # Usually done already when the show was cached
+        context['fragment_timeout'] = settings.CATALOGUE_CACHE_TIMEOUT
+        if self.object.has_seat_map:
+            context['seat_rows'] = seatmap.availability(self.object)
         return context
 
 
@@ -50,24 +188,7 @@ class ShowDetailView(DetailView):
 
         # Manual data retrieval and validation from request.POST
         quantity_str = request.POST.get('quantity')
-        errors = []
-        quantity = 0
-
-        if not quantity_str:
-            errors.append("Please enter the number of tickets.")
-        else:
-            try:
-                quantity = int(quantity_str)
-                if quantity <= 0:
-                    errors.append("Quantity must be a positive number.")
-            except ValueError:
-                errors.append("Invalid quantity entered.")
-
-        if not errors: # Only perform seat check if quantity is valid number
-            if quantity > show.available_seats:
-                errors.append(f"Only {show.available_seats} seats available.")
-            if quantity > show.total_seats: # Should not happen if quantity > 0, but good check
-                 errors.append(f"Cannot book more than total seats available ({show.total_seats}).")
+        quantity, errors = validate_quantity(quantity_str, show)
 
         if errors:
             # Store errors and submitted quantity in session and redirect back to the detail page
@@ -75,42 +196,284 @@ class ShowDetailView(DetailView):
             request.session['booking_quantity'] = quantity_str
             return redirect(reverse('show_detail', kwargs={'pk': show.pk})) # Redirect to GET
 
-        # If validation passes, create the booking
-        try:
-            # Use a database transaction for atomicity (optional but recommended for real systems)
-            # from django.db import transaction
-            # with transaction.atomic():
-
-            # Double-check availability just before saving (optimistic locking check)
-            # Reload show from DB to get latest available_seats
-            show.refresh_from_db()
-            if quantity > show.available_seats:
-                 # This can happen in high concurrency, handle again
-                 request.session['booking_errors'] = ["Sorry, available seats changed. Please try again."]
-                 request.session['booking_quantity'] = quantity_str
-                 return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
-
-
-            total_price = quantity * show.price
-
-            booking = Booking.objects.create(
-                user=request.user,
-                show=show,
-                quantity=quantity,
-                total_price=total_price,
-                booking_time=timezone.now() # Use timezone.now()
-            )
-
-            # Update show's available seats
-            show.available_seats -= quantity
-            show.save()
-
-            # Redirect to a confirmation page or booking history
-            # We can pass booking ID to confirmation page if needed
-            return redirect(reverse('booking_confirmation')) # Redirect to GET for confirmation
+        key = idempotency_key(request)
+        queued = waiting_room_redirect(request, show, key)
+        if queued:
+            return queued
 
+        # If validation passes, create the booking.
+        # The availability check, seat decrement and Booking insert all happen
+        # in one transaction inside the booking service (see bookings/services.py).
+        # A repeated idempotency key gets the first attempt's outcome instead.
+        try:
+            book_seats(request.user, show, quantity, idempotency_key=key)
+        except BookingError as e:
+            request.session['booking_errors'] = [str(e)]
+            request.session['booking_quantity'] = quantity_str
+            return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
         except Exception as e:
             errors.append(f"An unexpected error occurred during booking: {e}")
             request.session['booking_errors'] = errors
             request.session['booking_quantity'] = quantity_str
-            return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
\ No newline at end of file
+            return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
+
+        leave_waiting_room(request, show)
+        # Redirect to a confirmation page or booking history
+        return redirect(reverse('booking_confirmation')) # Redirect to GET for confirmation
+
+
+class AsyncShowListView(View):
+    # Async twin of ShowListView for ASGI deployments (see settings.ASYNC_VIEWS)
+    template_name = 'shows/show_list.html'
+
+    async def get(self, request):
+        await auser(request)
+        query, errors = search.SearchQuery.from_params(request.GET)
+        try:
+            results = await sync_to_async(search.search)(query)
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        context = {'shows': results.shows, **search_context(request, query, results, errors)}
+        await sync_to_async(rendering.add_cards)(results.shows)
+        return render(request, self.template_name, context)
+
+
+@method_decorator(csrf_protect, name='post')
+class AsyncShowDetailView(View):
+    # Async twin of ShowDetailView. Reads go through the async cache and ORM
+    # APIs; the booking itself stays one sync call (book_seats runs the seat
+    # decrement and Booking insert in a single transaction, which the async
+    # ORM cannot span) made on a worker thread.
+    template_name = 'shows/show_detail.html'
+
+    async def get_show(self, pk):
+        show = await catalogue.aget_active_show(pk)
+        if show is None:
+            raise Http404("No show found matching the query")
+        return show
+
+    async def get(self, request, pk):
+        await auser(request)
+        show = await self.get_show(pk)
+        context = {
+            'show': show,
+            'object': show,
+            'errors': await request.session.apop('booking_errors', []),
+            'submitted_quantity': await request.session.apop('booking_quantity', ''),
+            'idempotency_key': uuid.uuid4().hex,
+            'fragment_timeout': settings.CATALOGUE_CACHE_TIMEOUT,
+        }
+        rendering.precompute([show])
+        if show.has_seat_map:
+            context['seat_rows'] = await sync_to_async(seatmap.availability)(show)
+        return render(request, self.template_name, context)
+
+    async def post(self, request, pk):
+        user = await auser(request)
+        show = await self.get_show(pk)
+        quantity_str = request.POST.get('quantity')
+
+        if not user.is_authenticated:
+            await request.session.aset('booking_quantity', quantity_str or '')
+            return redirect(f'{reverse("login")}?next={request.get_full_path()}')
+
+        quantity, errors = validate_quantity(quantity_str, show)
+        if not errors:
+            key = idempotency_key(request)
+            if show.queue_enabled:
+                queued = await sync_to_async(waiting_room_redirect)(request, show, key)
+                if queued:
+                    return queued
+            try:
+                await sync_to_async(book_seats)(user, show, quantity, idempotency_key=key)
+            except BookingError as e:
+                errors.append(str(e))
+            except Exception as e:
+                errors.append(f"An unexpected error occurred during booking: {e}")
+            else:
+                if show.queue_enabled:
+                    await sync_to_async(leave_waiting_room)(request, show)
+                return redirect(reverse('booking_confirmation'))
+
+        await request.session.aset('booking_errors', errors)
+        await request.session.aset('booking_quantity', quantity_str)
+        return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
+
+
+class ShowHoldView(ShowDetailView):
+    # First step of the two-phase booking flow: reserve the seats for a few
+    # minutes, then let the user confirm the hold (see bookings.views.HoldDetailView).
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        show = self.object
+
+        if not request.user.is_authenticated:
+            request.session['booking_quantity'] = request.POST.get('quantity', '')
+            return redirect(f'{reverse("login")}?next={reverse("show_detail", kwargs={"pk": show.pk})}')
+
+        quantity_str = request.POST.get('quantity')
+        quantity, errors = validate_quantity(quantity_str, show)
+
+        if not errors:
+            key = idempotency_key(request)
+            queued = waiting_room_redirect(request, show, key)
+            if queued:
+                return queued
+            try:
+                hold = place_hold(request.user, show, quantity, idempotency_key=key)
+                leave_waiting_room(request, show)
+                return redirect(reverse('hold_detail', kwargs={'pk': hold.pk}))
+            except BookingError as e:
+                errors.append(str(e))
+
+        request.session['booking_errors'] = errors
+        request.session['booking_quantity'] = quantity_str
+        return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
+
+
+class ShowCartAddView(ShowDetailView):
+    # Put tickets for this show in the cart; they are booked together with
+    # the rest of it at checkout (see bookings.views.CartView).
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        show = self.object
+
+        if not request.user.is_authenticated:
+            request.session['booking_quantity'] = request.POST.get('quantity', '')
+            return redirect(f'{reverse("login")}?next={reverse("show_detail", kwargs={"pk": show.pk})}')
+
+        quantity_str = request.POST.get('quantity')
+        quantity, errors = validate_quantity(quantity_str, show)
+        if show.queue_enabled:
+            # A checkout cannot wait in several queues at once
+            errors.append("This show has a waiting room. Please book it on its own.")
+
+        if not errors:
+            try:
+                cart.add(request.session, show.pk, quantity)
+                return redirect(reverse('cart'))
+            except BookingError as e:
+                errors.append(str(e))
+
+        request.session['booking_errors'] = errors
+        request.session['booking_quantity'] = quantity_str
+        return redirect(reverse('show_detail', kwargs={'pk': show.pk}))
+
+
+class ShowQueueView(View):
+    # Waiting room page. Deliberately does not load the Show: the page only
+    # polls ShowQueueStatusView until the user's ticket is admitted.
+    template_name = 'shows/queue.html'
+
+    def get(self, request, pk):
+        token = request.session.get('queue_tickets', {}).get(str(pk))
+        if not token:
+            return redirect(reverse('show_detail', kwargs={'pk': pk}))
+        status = get_waiting_room().status(pk, token)
+        context = {'show_pk': pk, 'token': token, 'status': status}
+        return render(request, self.template_name, context)
+
+
+class ShowQueueStatusView(View):
+    # Cheap JSON status for polling clients: no session, no Show query.
+    def get(self, request, pk):
+        token = request.GET.get('ticket', '')
+        status = get_waiting_room().status(pk, token) if token else None
+        if status is None:
+            return JsonResponse({'error': "Unknown ticket."}, status=404)
+        return JsonResponse(status.as_dict())
+
+
+MAX_AVAILABILITY_IDS = 100
+
+
+def availability_ids(request, pk=None):
+    # The show IDs asked for, or None if ?ids= is missing, malformed or too long
+    if pk is not None:
+        return [pk]
+    try:
+        ids = list(dict.fromkeys(int(value) for value in request.GET.get('ids', '').split(',') if value))
+    except ValueError:
+        return None
+    if not ids or len(ids) > MAX_AVAILABILITY_IDS:
+        return None
+    return ids
+
+
+def availability_etag(request, pk=None):
+    ids = availability_ids(request, pk)
+    return catalogue.availability_etag(ids) if ids else None
+
+
+@method_decorator(condition(etag_func=availability_etag), name='get')
+class ShowAvailabilityView(View):
+    # Read-only seat counts for polling clients. Never reads the session or the
+    # user, so no session is created, and a client whose ETag is still current
+    # gets a 304 from the cache alone (see catalogue.availability_etag).
+    def get(self, request, pk=None):
+        ids = availability_ids(request, pk)
+        if ids is None:
+            return JsonResponse(
+                {'error': f"Pass ?ids= with 1 to {MAX_AVAILABILITY_IDS} comma-separated show IDs."}, status=400,
+            )
+        shows = catalogue.get_active_shows_by_id(ids)
+        if pk is not None:
+            if pk not in shows:
+                return JsonResponse({'error': "Show not found."}, status=404)
+            response = JsonResponse(catalogue.availability_dict(shows[pk]))
+        else:
+            response = JsonResponse({
+                'shows': [catalogue.availability_dict(shows[show_id]) for show_id in ids if show_id in shows],
+                'not_found': [show_id for show_id in ids if show_id not in shows],
+            })
+        patch_cache_control(response, no_cache=True) # Always revalidate, the ETag makes that cheap
+        return response
+
+
+def sse_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+class ShowAvailabilityStreamView(View):
+    # Server-sent events: one `availability` event per show on connect, then one
+    # per change (coalesced, see shows/live.py), with a comment line as a
+    # keep-alive. Like the JSON endpoint it never touches the session.
+    #
+    # Needs an ASGI server (settings.ASYNC_VIEWS): under WSGI Django has to read
+    # an async iterator to the end before sending anything, and this one never
+    # ends, so it would tie up a worker thread forever without sending a byte.
+    async def get(self, request):
+        if not settings.ASYNC_VIEWS:
+            return JsonResponse(
+                {'error': "Live availability needs the ASGI server; poll the availability endpoint instead."},
+                status=501,
+            )
+        ids = availability_ids(request)
+        if ids is None:
+            return JsonResponse(
+                {'error': f"Pass ?ids= with 1 to {MAX_AVAILABILITY_IDS} comma-separated show IDs."}, status=400,
+            )
+        response = StreamingHttpResponse(self.stream(ids), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no' # Stop nginx from buffering the stream
+        return response
+
+    async def stream(self, ids):
+        hub = live.get_hub()
+        subscription = hub.subscribe(ids)
+        try:
+            yield f'retry: {settings.LIVE_RETRY_MS}\n\n'
+            for payload in await hub.snapshot(ids):
+                yield sse_event('availability', payload)
+            while True:
+                updates = await subscription.next(timeout=settings.LIVE_KEEPALIVE_SECONDS)
+                if not updates:
+                    yield ': keep-alive\n\n'
+                for payload in updates:
+                    yield sse_event('availability', payload)
+        finally:
+            hub.unsubscribe(subscription)
@@ -0,0 +1,285 @@
+"""
+Virtual waiting room for high-demand shows.
+
+Booking attempts for a show with `queue_enabled` first take a numbered ticket.
+Tickets are admitted in order by a token bucket that releases `queue_rate`
+admissions per second (with at most one second's worth banked while the queue
+is empty). Checking a ticket only touches the waiting-room backend, never the
+Show row, so waiting clients can poll as often as they like.
+
+The backend is chosen with settings.WAITING_ROOM, in the same shape as CACHES:
+
+    WAITING_ROOM = {
+        'BACKEND': 'shows.waiting_room.SQLiteWaitingRoom',
+        'OPTIONS': {'path': '/var/run/ticketbooking/waiting_room.sqlite3'},
+    }
+
+InMemoryWaitingRoom only works within one process; SQLiteWaitingRoom is shared
+by every worker on one host. A multi-host deployment needs a backend on shared
+storage (e.g. Redis) implementing the same three methods.
+
+A ticket that has not been checked for `ticket_ttl` seconds (OPTIONS, default
+TICKET_TTL_SECONDS) has been abandoned, or was admitted and never used, and is
+treated as unknown. Both backends drop such tickets, and queues left with no
+tickets, every PRUNE_EVERY joins, so their size is bounded by recent traffic.
+Dropping tickets never moves the others: positions come from sequence numbers.
+"""
+import math
+import secrets
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Seconds a ticket is kept without being checked (waiting clients poll far more often)
+TICKET_TTL_SECONDS = 300
+
+
+@dataclass
+class QueueStatus:
+    token: str
+    admitted: bool
+    position: int # Tickets still ahead of this one
+    estimated_wait: float # Seconds
+
+    def as_dict(self):
+        return {
+            'admitted': self.admitted,
+            'position': self.position,
+            'estimated_wait_seconds': math.ceil(self.estimated_wait),
+        }
+
+
+def advance(issued, frontier, updated, rate, now):
+    # Let `rate` more tickets in per elapsed second, banking at most one
+    # second's worth beyond the last ticket issued.
+    elapsed = max(now - updated, 0)
+    return min(frontier + elapsed * rate, issued + rate)
+
+
+def make_status(token, seq, frontier, rate):
+    position = max(seq - math.floor(frontier), 0)
+    return QueueStatus(
+        token=token,
+        admitted=position == 0,
+        position=position,
+        estimated_wait=position / rate if rate else 0,
+    )
+
+
+class BaseWaitingRoom:
+    # Expired tickets are dropped every PRUNE_EVERY joins
+    PRUNE_EVERY = 1000
+
+    def __init__(self, ticket_ttl=TICKET_TTL_SECONDS, **options):
+        self.ticket_ttl = ticket_ttl
+        self.options = options
+        self._joins = 0 # Approximate across threads, only paces pruning
+
+    def _should_prune(self):
+        self._joins += 1
+        return self._joins % self.PRUNE_EVERY == 0
+
+    def join(self, show_id, rate):
+        """Issue a new ticket for `show_id` and return its QueueStatus."""
+        raise NotImplementedError
+
+    def status(self, show_id, token):
+        """Return the QueueStatus of a ticket, or None if it is unknown."""
+        raise NotImplementedError
+
+    def consume(self, show_id, token):
+        """Forget a ticket once it has been used to book."""
+        raise NotImplementedError
+
+    def ticket_count(self):
+        """Tickets currently stored, expired or not (for tests and monitoring)."""
+        raise NotImplementedError
+
+
+class InMemoryWaitingRoom(BaseWaitingRoom):
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._lock = threading.Lock()
+        self._queues = {} # show id -> queue state, with 'tickets': token -> [seq, last checked]
+
+    def _prune(self, now):
+        for show_id, queue in list(self._queues.items()):
+            queue['tickets'] = {
+                token: ticket for token, ticket in queue['tickets'].items() if now - ticket[1] < self.ticket_ttl
+            }
+            if not queue['tickets'] and now - queue['updated'] >= self.ticket_ttl:
+                del self._queues[show_id] # Idle; a new queue starts in the same state
+
+    def _queue(self, show_id, now, rate):
+        # A new queue starts with a full bucket so the first arrivals go straight in
+        return self._queues.setdefault(show_id, {
+            'issued': 0, 'frontier': float(rate), 'updated': now, 'rate': rate, 'tickets': {},
+        })
+
+    def join(self, show_id, rate):
+        now = time.monotonic()
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            if self._should_prune():
+                self._prune(now)
+            queue = self._queue(show_id, now, rate)
+            queue['frontier'] = advance(queue['issued'], queue['frontier'], queue['updated'], queue['rate'], now)
+            queue['updated'] = now
+            queue['rate'] = rate
+            queue['issued'] += 1
+            queue['tickets'][token] = [queue['issued'], now]
+            return make_status(token, queue['issued'], queue['frontier'], rate)
+
+    def status(self, show_id, token):
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queues.get(show_id)
+            ticket = queue['tickets'].get(token) if queue is not None else None
+            if ticket is None or now - ticket[1] >= self.ticket_ttl:
+                return None
+            ticket[1] = now
+            queue['frontier'] = advance(queue['issued'], queue['frontier'], queue['updated'], queue['rate'], now)
+            queue['updated'] = now
+            return make_status(token, ticket[0], queue['frontier'], queue['rate'])
+
+    def consume(self, show_id, token):
+        with self._lock:
+            queue = self._queues.get(show_id)
+            if queue is not None:
+                queue['tickets'].pop(token, None)
+
+    def ticket_count(self):
+        with self._lock:
+            return sum(len(queue['tickets']) for queue in self._queues.values())
+
+
+class SQLiteWaitingRoom(BaseWaitingRoom):
+    # Uses wall-clock time (not monotonic) because the state is shared between processes.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS queue_state (
+            show_id INTEGER PRIMARY KEY,
+            issued INTEGER NOT NULL,
+            frontier REAL NOT NULL,
+            updated REAL NOT NULL,
+            rate REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS queue_ticket (
+            token TEXT PRIMARY KEY,
+            show_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            seen REAL NOT NULL DEFAULT 0 -- Last checked
+        );
+    """
+    # Run after SCHEMA, once any older queue_ticket table has its seen column
+    INDEXES = "CREATE INDEX IF NOT EXISTS queue_ticket_seen ON queue_ticket (seen);"
+
+    def __init__(self, path=None, **options):
+        super().__init__(**options)
+        self.path = str(path or settings.BASE_DIR / 'waiting_room.sqlite3')
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(queue_ticket)')]
+            if 'seen' not in columns: # A file from before tickets expired
+                conn.execute('ALTER TABLE queue_ticket ADD COLUMN seen REAL NOT NULL DEFAULT 0')
+                conn.execute('UPDATE queue_ticket SET seen = ?', (time.time(),))
+            conn.executescript(self.INDEXES)
+
+    def _prune(self, conn, now):
+        cutoff = now - self.ticket_ttl
+        conn.execute('DELETE FROM queue_ticket WHERE seen <= ?', (cutoff,))
+        conn.execute(
+            'DELETE FROM queue_state WHERE updated <= ? AND show_id NOT IN (SELECT show_id FROM queue_ticket)',
+            (cutoff,),
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _advance_locked(self, conn, show_id, now, rate=None):
+        row = conn.execute(
+            'SELECT issued, frontier, updated, rate FROM queue_state WHERE show_id = ?', (show_id,)
+        ).fetchone()
+        if row is None:
+            # A new queue starts with a full bucket so the first arrivals go straight in
+            issued, frontier, old_rate = 0, float(rate or 1), rate or 1
+        else:
+            issued, frontier, updated, old_rate = row
+            frontier = advance(issued, frontier, updated, old_rate, now)
+        rate = rate or old_rate
+        conn.execute(
+            'INSERT OR REPLACE INTO queue_state (show_id, issued, frontier, updated, rate) VALUES (?, ?, ?, ?, ?)',
+            (show_id, issued, frontier, now, rate),
+        )
+        return issued, frontier, rate
+
+    def join(self, show_id, rate):
+        token = secrets.token_urlsafe(16)
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self._should_prune():
+                self._prune(conn, now)
+            issued, frontier, rate = self._advance_locked(conn, show_id, now, rate)
+            seq = issued + 1
+            conn.execute('UPDATE queue_state SET issued = ? WHERE show_id = ?', (seq, show_id))
+            conn.execute(
+                'INSERT INTO queue_ticket (token, show_id, seq, seen) VALUES (?, ?, ?, ?)', (token, show_id, seq, now),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return make_status(token, seq, frontier, rate)
+
+    def status(self, show_id, token):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ticket = conn.execute(
+                'SELECT seq FROM queue_ticket WHERE token = ? AND show_id = ? AND seen > ?',
+                (token, show_id, now - self.ticket_ttl),
+            ).fetchone()
+            if ticket is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute('UPDATE queue_ticket SET seen = ? WHERE token = ?', (now, token))
+            _, frontier, rate = self._advance_locked(conn, show_id, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return make_status(token, ticket[0], frontier, rate)
+
+    def consume(self, show_id, token):
+        self._connect().execute('DELETE FROM queue_ticket WHERE token = ? AND show_id = ?', (token, show_id))
+
+    def ticket_count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM queue_ticket').fetchone()[0]
+
+
+_waiting_room = None
+_waiting_room_lock = threading.Lock()
+
+
+def get_waiting_room():
+    """Return the process-wide waiting room configured in settings.WAITING_ROOM."""
+    global _waiting_room
+    if _waiting_room is None:
+        with _waiting_room_lock:
+            if _waiting_room is None:
+                config = getattr(settings, 'WAITING_ROOM', {})
+                backend = import_string(config.get('BACKEND', 'shows.waiting_room.InMemoryWaitingRoom'))
+                _waiting_room = backend(**config.get('OPTIONS', {}))
+    return _waiting_room
@@ -12,5 +12,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ticket_booking_system.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True') # Use the native async views (see settings.ASYNC_VIEWS)
 
 application = get_asgi_application()
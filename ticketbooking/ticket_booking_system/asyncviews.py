@@ -0,0 +1,17 @@
+"""
+Shared helpers for the async views that ASGI deployments serve instead of the
+sync ones (settings.ASYNC_VIEWS, switched on by ticket_booking_system/asgi.py).
+"""
+
+
+async def auser(request):
+    """
+    Load the user through the async auth API and pin it on request.user.
+
+    request.user is otherwise a lazy object that queries the database the
+    first time the templates (or the auth context processor) touch it, which
+    Django refuses to do inside async code.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
@@ -0,0 +1,441 @@
+"""
+Per-view request metrics in Prometheus text format.
+
+MetricsMiddleware times every request and, through a query wrapper installed
+on each database connection (connection.execute_wrappers), counts its SQL
+queries and the time they took. Template render time comes from
+InstrumentedDjangoTemplates (the TEMPLATES backend) and cache hits from the
+show catalogue (shows/catalogue.py). Everything is keyed by the URL name of
+the view that served the request, so a dashboard can show e.g. p95 latency
+and queries per request for show_detail alone.
+
+The numbers for the request in progress live in a context variable, which
+asgiref copies into sync_to_async threads, so async views are covered too.
+Recording costs a few additions per query and one short lock per request.
+
+Views listed in settings.QUERY_BUDGETS (or any view, with
+QUERY_BUDGET_DEFAULT) log a warning when one request runs more queries than
+its budget: the usual sign of an N+1 query slipping in.
+
+The registry is per process, but with settings.METRICS_DIR set (the server
+sets it up whenever it runs several workers) each worker also writes its
+numbers to a file there, at most every METRICS_FLUSH_SECONDS and when it
+exits, and custom-admin/metrics/ adds up every worker's file. So whichever
+worker the load balancer hands the scrape to answers for all of them, with
+the other workers' numbers up to METRICS_FLUSH_SECONDS behind. When a worker
+exits (gunicorn recycles them every --max-requests), the server master folds
+its file into retired.json, so the counters never go down. Without
+METRICS_DIR (runserver, --workers 1) a process serves its own numbers.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED = 'unmatched' # Requests no URL pattern matched (404s, mostly)
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+RETIRED = 'retired.json' # In METRICS_DIR: the totals of workers that have exited
+
+
+class RequestMetrics:
+    """What one request did, filled in while it runs."""
+    __slots__ = ('queries', 'query_seconds', 'template_seconds', 'cache')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.cache = {} # catalogue stat name (hits, seat_misses, ...) -> count
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds) # Not cumulative; render() adds them up
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def dump(self):
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    def merge(self, data):
+        self.counts = [a + b for a, b in zip(self.counts, data['counts'])]
+        self.sum += data['sum']
+        self.count += data['count']
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.responses = {} # (method, status class) -> count
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.cache = {}
+        self.budget_exceeded = 0
+
+    def dump(self):
+        """These metrics as JSON-able data, for another process to merge()."""
+        return {
+            'responses': [[method, status, count] for (method, status), count in self.responses.items()],
+            'latency': self.latency.dump(),
+            'queries': self.queries.dump(),
+            'query_seconds': self.query_seconds,
+            'template_seconds': self.template_seconds,
+            'cache': dict(self.cache),
+            'budget_exceeded': self.budget_exceeded,
+        }
+
+    def merge(self, data):
+        """Add a dump() to these metrics."""
+        for method, status, count in data['responses']:
+            self.responses[(method, status)] = self.responses.get((method, status), 0) + count
+        self.latency.merge(data['latency'])
+        self.queries.merge(data['queries'])
+        self.query_seconds += data['query_seconds']
+        self.template_seconds += data['template_seconds']
+        for name, count in data['cache'].items():
+            self.cache[name] = self.cache.get(name, 0) + count
+        self.budget_exceeded += data['budget_exceeded']
+
+
+def merge_snapshots(snapshots):
+    # {view: dump()} per process -> {view: ViewMetrics} of their totals
+    views = {}
+    for snapshot in snapshots:
+        for view, data in snapshot.items():
+            views.setdefault(view, ViewMetrics()).merge(data)
+    return views
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {} # URL name -> ViewMetrics
+        self.flush_lock = threading.Lock()
+        self.flushed = 0.0 # time.monotonic() of the last flush()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def observe(self, view, method, status, seconds, request_metrics):
+        status_class = f'{status // 100}xx'
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            key = (method, status_class)
+            metrics.responses[key] = metrics.responses.get(key, 0) + 1
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(request_metrics.queries)
+            metrics.query_seconds += request_metrics.query_seconds
+            metrics.template_seconds += request_metrics.template_seconds
+            for name, count in request_metrics.cache.items():
+                metrics.cache[name] = metrics.cache.get(name, 0) + count
+        if settings.METRICS_DIR and time.monotonic() - self.flushed >= settings.METRICS_FLUSH_SECONDS:
+            self.flush()
+
+    def record_budget_exceeded(self, view):
+        with self.lock:
+            self.views[view].budget_exceeded += 1
+
+    def snapshot(self):
+        """This process's metrics, {view: ViewMetrics.dump()}."""
+        with self.lock:
+            return {view: metrics.dump() for view, metrics in self.views.items()}
+
+    def flush(self):
+        """Write this process's metrics to METRICS_DIR, for the other workers' scrapes."""
+        if not settings.METRICS_DIR or not self.flush_lock.acquire(blocking=False):
+            return # Not shared, or another thread is writing them right now
+        try:
+            self.flushed = time.monotonic()
+            write_snapshot(worker_file(os.getpid()), self.snapshot())
+        except OSError as e:
+            logger.warning("Could not write request metrics to %s: %s", settings.METRICS_DIR, e)
+        finally:
+            self.flush_lock.release()
+
+    def collect(self):
+        """{view: ViewMetrics}: this process's, plus every other worker's from METRICS_DIR."""
+        return merge_snapshots([self.snapshot(), *shared_snapshots(exclude_pid=os.getpid())])
+
+    def render(self):
+        """The metrics of every worker (or of this process alone) in Prometheus text exposition format."""
+        views = sorted(self.collect().items())
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, view, hist):
+            cumulative = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{labels(view=view, le=bound)} {cumulative}')
+            lines.append(f'{name}_bucket{labels(view=view, le="+Inf")} {hist.count}')
+            lines.append(f'{name}_sum{labels(view=view)} {hist.sum:.6f}')
+            lines.append(f'{name}_count{labels(view=view)} {hist.count}')
+
+        family('ticketbooking_requests_total', 'counter', 'Requests served, by view, method and status class.')
+        for view, metrics in views:
+            for (method, status), count in sorted(metrics.responses.items()):
+                lines.append(f'ticketbooking_requests_total{labels(view=view, method=method, status=status)} {count}')
+
+        family('ticketbooking_request_duration_seconds', 'histogram', 'Time to build the response, by view.')
+        for view, metrics in views:
+            histogram('ticketbooking_request_duration_seconds', view, metrics.latency)
+
+        family('ticketbooking_db_queries', 'histogram', 'SQL queries per request, by view.')
+        for view, metrics in views:
+            histogram('ticketbooking_db_queries', view, metrics.queries)
+
+        family('ticketbooking_db_query_seconds_total', 'counter', 'Time spent running SQL queries, by view.')
+        for view, metrics in views:
+            lines.append(f'ticketbooking_db_query_seconds_total{labels(view=view)} {metrics.query_seconds:.6f}')
+
+        family('ticketbooking_template_render_seconds_total', 'counter', 'Time spent rendering templates, by view.')
+        for view, metrics in views:
+            lines.append(f'ticketbooking_template_render_seconds_total{labels(view=view)} {metrics.template_seconds:.6f}')
+
+        family('ticketbooking_catalogue_cache_total', 'counter',
+               'Show catalogue cache lookups, by view and outcome (hits, misses, seat_hits, seat_misses).')
+        for view, metrics in views:
+            for name, count in sorted(metrics.cache.items()):
+                lines.append(f'ticketbooking_catalogue_cache_total{labels(view=view, result=name)} {count}')
+
+        family('ticketbooking_query_budget_exceeded_total', 'counter',
+               'Requests that ran more queries than their view budget (settings.QUERY_BUDGETS).')
+        for view, metrics in views:
+            if metrics.budget_exceeded:
+                lines.append(f'ticketbooking_query_budget_exceeded_total{labels(view=view)} {metrics.budget_exceeded}')
+        return '\n'.join(lines) + '\n'
+
+
+def labels(**values):
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in values.items()) + '}'
+
+
+REGISTRY = Registry()
+
+
+# Sharing between workers
+
+def worker_file(pid):
+    return os.path.join(settings.METRICS_DIR, f'worker-{pid}.json')
+
+
+def write_snapshot(path, snapshot):
+    # Write, then rename over the old file, so a scrape never reads half of one
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temporary, path)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError: # Retired meanwhile, or never written
+        return {}
+
+
+def shared_snapshots(exclude_pid):
+    """The snapshots in METRICS_DIR: the retired workers' totals, then each live worker's but `exclude_pid`'s."""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return []
+    own = os.path.basename(worker_file(exclude_pid))
+    names = sorted(name for name in os.listdir(directory) if name.startswith('worker-') and name.endswith('.json') and name != own)
+    return [read_snapshot(os.path.join(directory, name)) for name in [RETIRED, *names]]
+
+
+def start_sharing():
+    """Create METRICS_DIR, or empty it of an earlier run's files. Run by the server master before it forks."""
+    directory = settings.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, name))
+
+
+def retire_worker(pid):
+    """
+    Add the file of a worker that has exited to RETIRED, so its counts stay in
+    the totals, and remove it. Run by the server master, one worker at a time.
+    """
+    path = worker_file(pid)
+    snapshot = read_snapshot(path)
+    if snapshot:
+        retired = os.path.join(settings.METRICS_DIR, RETIRED)
+        views = merge_snapshots([read_snapshot(retired), snapshot])
+        write_snapshot(retired, {view: metrics.dump() for view, metrics in views.items()})
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Recording
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper that counts queries for the request in progress."""
+    metrics = _current.get()
+    if metrics is None: # Management commands, background threads
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_seconds += time.perf_counter() - started
+
+
+def install_query_wrapper(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    install_query_wrapper(connection)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='ticket_booking_system.metrics')
+
+
+def install_query_wrappers():
+    # Connections this thread opened before the signal receiver existed
+    for connection in connections.all(initialized_only=True):
+        install_query_wrapper(connection)
+
+
+def record_cache(name, count=1):
+    """Count a catalogue cache hit or miss against the request in progress."""
+    metrics = _current.get()
+    if metrics is not None and count:
+        metrics.cache[name] = metrics.cache.get(name, 0) + count
+
+
+def query_budget(view):
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+
+def finish(request, response, started, request_metrics):
+    elapsed = time.perf_counter() - started
+    match = request.resolver_match
+    view = (match.url_name or match.view_name) if match else UNMATCHED
+    REGISTRY.observe(view, request.method, response.status_code, elapsed, request_metrics)
+    budget = query_budget(view)
+    if budget is not None and request_metrics.queries > budget:
+        REGISTRY.record_budget_exceeded(view)
+        logger.warning(
+            "Query budget exceeded: %s %s (%s) ran %d queries, budget %d",
+            request.method, request.path, view, request_metrics.queries, budget,
+        )
+
+
+class MetricsMiddleware:
+    """Times requests and records their metrics. Goes first in MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        install_query_wrappers()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        install_query_wrappers()
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        finish(request, response, started, request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        finish(request, response, started, request_metrics)
+        return response
+
+
+# Templates
+
+class TimedTemplate:
+    """Wraps a backend template to time render() for the request in progress."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with render time recorded per request.
+    Only top-level templates are wrapped, so {% extends %} and {% include %}
+    are counted once, as part of the page that pulls them in.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
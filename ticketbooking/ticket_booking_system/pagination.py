@@ -0,0 +1,164 @@
+"""
+Keyset (seek) pagination for large list views.
+
+Instead of OFFSET, each page continues from the sort key of the last row of
+the previous page, e.g. for ('-booking_time', '-id'):
+
+    WHERE booking_time < t OR (booking_time = t AND id < n)
+    ORDER BY booking_time DESC, id DESC LIMIT page_size + 1
+
+so every page costs the same no matter how deep it is, and rows inserted while
+someone is paging never shift later pages. The trailing field must be unique
+(normally 'id' or '-id') for cursors to be stable.
+"""
+import base64
+import json
+from dataclasses import dataclass
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.page_size = page_size
+        # ('-booking_time', '-id') -> [('booking_time', True), ('id', True)]
+        self.keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def seek_filter(self, values):
+        # (a, b, c) > (x, y, z) expanded as a > x OR (a = x AND b > y) OR ...
+        condition = Q()
+        for i, (field, descending) in enumerate(self.keys):
+            term = Q(**{f"{field}__{'lt' if descending else 'gt'}": values[i]})
+            for j, (earlier, _) in enumerate(self.keys[:i]):
+                term &= Q(**{earlier: values[j]})
+            condition |= term
+        return condition
+
+    def clean_values(self, cursor, values):
+        # A cursor comes from the client: convert each value with its field,
+        # so a tampered one is rejected here rather than when the page is read
+        if len(values) != len(self.keys):
+            raise InvalidCursor(cursor)
+        cleaned = []
+        for (name, _), value in zip(self.keys, values):
+            field = self.queryset.model._meta.get_field(name)
+            try:
+                value = field.to_python(value)
+                if value is None:
+                    raise ValueError("Cursor values cannot be null.")
+                field.run_validators(value) # e.g. the database's integer range
+            except (ValidationError, ValueError, TypeError, OverflowError):
+                raise InvalidCursor(cursor)
+            cleaned.append(value)
+        return cleaned
+
+    def page_queryset(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            values = self.clean_values(cursor, decode_cursor(cursor))
+            queryset = queryset.filter(self.seek_filter(values))
+        return queryset[:self.page_size + 1]
+
+    def page(self, cursor=None):
+        return self.make_page(list(self.page_queryset(cursor)))
+
+    async def apage(self, cursor=None):
+        return self.make_page([item async for item in self.page_queryset(cursor)])
+
+    def make_page(self, items):
+        next_cursor = None
+        if len(items) > self.page_size:
+            items = items[:self.page_size]
+            last = items[-1]
+            next_cursor = encode_cursor([getattr(last, field) for field, _ in self.keys])
+        return KeysetPage(items=items, next_cursor=next_cursor)
+
+
+def keyset_chunks(queryset, chunk_size):
+    """
+    Yield the whole queryset as lists of at most `chunk_size` rows, in primary
+    key order, using one `WHERE pk > last LIMIT n` query per chunk.
+
+    Unlike QuerySet.iterator() this keeps memory flat on MySQL too, where the
+    driver otherwise buffers the entire result set client-side. A values_list()
+    queryset must list the primary key first.
+    """
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0] if isinstance(rows[-1], tuple) else rows[-1].pk
+
+
+def keyset_iterator(queryset, chunk_size):
+    """Like keyset_chunks(), but one row at a time."""
+    for rows in keyset_chunks(queryset, chunk_size):
+        yield from rows
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin that replaces the full object list with one keyset page.
+    Templates get `page` (with `page.has_next` and `page.next_cursor`).
+    """
+    keyset_ordering = ('-id',)
+    page_size = 50
+    max_page_size = 200
+
+    def get_page_size(self):
+        try:
+            size = int(self.request.GET.get('page_size', self.page_size))
+        except ValueError:
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_context_data(self, **kwargs):
+        paginator = KeysetPaginator(self.object_list, self.keyset_ordering, self.get_page_size())
+        try:
+            page = paginator.page(self.request.GET.get('after'))
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        context = super().get_context_data(object_list=page.items, **kwargs)
+        context['page'] = page
+        context['page_size'] = paginator.page_size
+        return context
@@ -0,0 +1,67 @@
+"""
+Query plan checks, for tests that keep the hot views on their indexes.
+
+full_scans() runs EXPLAIN on a queryset (or a captured SQL statement) and
+returns the tables the database would read in full. Only plans with no index
+to use count: SQLite's bare `SCAN table` (not `SCAN table USING INDEX`), and
+on MySQL an `ALL` access with no possible keys, since MySQL picks a table
+scan over an index on the near-empty tables of a test database anyway.
+
+    with CaptureQueriesContext(connection) as queries:
+        self.client.get(url)
+    self.assertEqual(captured_full_scans(queries.captured_queries), {})
+"""
+import json
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)$', re.MULTILINE)
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def full_scans(queryset):
+    """Names of the tables `queryset` would scan without an index."""
+    sql, params = queryset.query.sql_with_params()
+    return sql_full_scans(sql, params, using=queryset.db)
+
+
+def sql_full_scans(sql, params=None, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = '\n'.join(row[-1] for row in cursor.fetchall())
+            return sorted(set(SQLITE_FULL_SCAN.findall(plan)))
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN FORMAT=JSON ' + sql, params)
+            return sorted(set(_mysql_full_scans(json.loads(cursor.fetchone()[0]))))
+    raise NotImplementedError(f"No query plan check for {connection.vendor}")
+
+
+def captured_full_scans(captured_queries, using=DEFAULT_DB_ALIAS):
+    """
+    {sql: [tables]} for every statement in CaptureQueriesContext output that
+    scans a table without an index. The captured SQL has its parameters
+    already inlined, so it is explained as is.
+    """
+    scans = {}
+    for query in captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            continue
+        tables = sql_full_scans(sql, using=using)
+        if tables:
+            scans[sql] = tables
+    return scans
+
+
+def _mysql_full_scans(plan):
+    if isinstance(plan, dict):
+        if plan.get('access_type') == 'ALL' and not plan.get('possible_keys'):
+            yield plan['table_name']
+        for value in plan.values():
+            yield from _mysql_full_scans(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _mysql_full_scans(value)
@@ -0,0 +1,196 @@
+"""
+Read replica routing.
+
+ReplicaMiddleware decides per request whether its reads may go to a replica:
+only GET/HEAD requests to the views named in settings.REPLICA_VIEWS qualify,
+and only while the client is not pinned to the primary. ReplicaRouter then
+sends that request's reads to the replica the middleware picked, and every
+write (from any request) to the primary.
+
+Read-your-writes: the first write of a request switches the rest of that
+request back to the primary, and the response sets a short-lived cookie
+(REPLICA_PIN_SECONDS) that keeps the client on the primary until replication
+has caught up, so the booking history shown right after a booking is never
+stale. Reads inside a transaction on the primary stay on the primary too.
+
+Replicas are health-checked every REPLICA_HEALTH_CHECK_INTERVAL seconds; one
+that cannot be reached, or (on MySQL) lags more than REPLICA_MAX_LAG_SECONDS
+behind, gets no reads until it passes again. With no healthy replica
+everything reads from the primary.
+
+Sessions always use the primary: the session cookie is read right after the
+login that wrote it.
+"""
+import contextvars
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.urls import Resolver404, resolve
+
+PIN_COOKIE = 'primary_pin'
+PRIMARY_ONLY_APPS = {'sessions'}
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class RequestRouting:
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self, replica=None):
+        self.replica = replica # Alias to read from, or None for the primary
+        self.wrote = False
+
+
+_routing = contextvars.ContextVar('replica_routing', default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is None or routing.replica is None or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None # Inside a write transaction, read what it wrote
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            routing.wrote = True
+            routing.replica = None # The rest of this request reads its own writes
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # Replicas hold the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def probe(alias, max_lag):
+    """True if replica `alias` answers and is no more than `max_lag` seconds behind."""
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor != 'mysql':
+                cursor.execute('SELECT 1')
+                return True
+            cursor.execute('SHOW REPLICA STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                return True # Not configured as a replica (e.g. a local stand-in)
+            status = dict(zip([column[0] for column in cursor.description], row))
+            lag = status.get('Seconds_Behind_Source')
+            return lag is not None and lag <= max_lag # None: replication stopped
+    except DatabaseError:
+        return False
+    finally:
+        connection.close() # Probes run on whatever thread is handy; leave nothing open
+
+
+class ReplicaPool:
+    def __init__(self, aliases, interval, max_lag, probe=probe):
+        self.aliases = list(aliases)
+        self.interval = interval
+        self.max_lag = max_lag
+        self.probe = probe
+        self.healthy = []
+        self.next_check = 0.0 # Check before the first pick
+        self.lock = threading.Lock()
+
+    def check_due(self):
+        return bool(self.aliases) and time.monotonic() >= self.next_check
+
+    def check(self):
+        with self.lock:
+            if not self.check_due():
+                return # Another thread just did
+            self.next_check = time.monotonic() + self.interval
+            self.healthy = [alias for alias in self.aliases if self.probe(alias, self.max_lag)]
+
+    def choose(self):
+        healthy = self.healthy
+        return random.choice(healthy) if healthy else None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    aliases = list(settings.REPLICA_DATABASES)
+    with _pool_lock:
+        if _pool is None or _pool.aliases != aliases: # Settings changed (tests)
+            _pool = ReplicaPool(aliases, settings.REPLICA_HEALTH_CHECK_INTERVAL, settings.REPLICA_MAX_LAG_SECONDS)
+        return _pool
+
+
+def pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def replica_view(request):
+    """True if the request is a read of one of settings.REPLICA_VIEWS."""
+    if request.method not in SAFE_METHODS or not settings.REPLICA_DATABASES:
+        return False
+    try:
+        match = resolve(request.path_info, getattr(request, 'urlconf', None))
+    except Resolver404:
+        return False
+    return match.url_name in settings.REPLICA_VIEWS
+
+
+def pin_to_primary(response):
+    seconds = settings.REPLICA_PIN_SECONDS
+    response.set_cookie(PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds, httponly=True, samesite='Lax')
+
+
+class ReplicaMiddleware:
+    """Picks the database a request reads from. Goes before SessionMiddleware."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        use_replica = replica_view(request) and not pinned(request)
+        pool = get_pool()
+        if use_replica and pool.check_due():
+            pool.check()
+        routing = RequestRouting(pool.choose() if use_replica else None)
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        if routing.wrote:
+            pin_to_primary(response)
+        return response
+
+    async def __acall__(self, request):
+        use_replica = replica_view(request) and not pinned(request)
+        pool = get_pool()
+        if use_replica and pool.check_due():
+            await sync_to_async(pool.check, thread_sensitive=False)()
+        routing = RequestRouting(pool.choose() if use_replica else None)
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        if routing.wrote:
+            pin_to_primary(response)
+        return response
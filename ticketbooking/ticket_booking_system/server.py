@@ -0,0 +1,301 @@
+"""
+Production server entrypoint.
+
+    python -m ticket_booking_system.server [--bind 0.0.0.0:8000] [--workers N] [--threads N] [--asgi]
+
+Runs gunicorn with the Django application loaded once in the master process
+and only then forked into workers, so imported code, the populated URL
+resolver and the compiled templates (Django's cached template loader) are
+shared copy-on-write. gc.freeze() after warm-up keeps the garbage collector
+from writing to, and so copying, those shared pages.
+
+Database connections are never opened in the master, because a socket must
+not be shared between processes. Each worker opens one per request thread
+after the fork, before it accepts traffic, and keeps them (CONN_MAX_AGE,
+with CONN_HEALTH_CHECKS so a dropped connection is replaced, not served).
+
+WSGI (the default) uses gthread workers. --asgi serves the async views with
+uvicorn workers; persistent connections are off there, since sync code runs
+on a different thread per request under ASGI.
+
+Start-up is timed: the master logs how long loading and warming took, the
+server requests one page of its own as soon as it listens and logs the cold
+start to that first served request, and every worker logs when it served its
+first request, measured from the moment this process started.
+
+Several workers need their shared state outside the process: the cache (the
+show catalogue, rendered cards and rate limit counters), the waiting room and
+the rate limiter. With a LocMem cache or an in-memory backend every worker
+would keep its own copy, serving stale shows and prices, answering another
+worker's queue tickets with 404 and multiplying the rate limits by the number
+of workers. The server refuses to start more than one worker then; point
+CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached and WAITING_ROOM_BACKEND at
+a shared backend, as docker-compose.yml does, or run --workers 1. Request
+metrics are shared through files in METRICS_DIR, which the server creates in
+/dev/shm (or the temp directory) unless it is set: any worker's
+custom-admin/metrics/ then reports the totals of all of them.
+
+Migrations are not run here; run `manage.py migrate` once per deploy.
+"""
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import wait
+
+STARTED = time.monotonic() # Before Django or gunicorn is imported
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger('gunicorn.error')
+
+TEMPLATE_SUFFIXES = ('.html', '.txt')
+
+# Backends whose state lives in the worker process
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+PROCESS_LOCAL_WAITING_ROOMS = ('shows.waiting_room.InMemoryWaitingRoom',)
+PROCESS_LOCAL_RATE_LIMITERS = ('accounts.ratelimit.InMemoryRateLimiter',)
+
+
+def template_names(engine):
+    for directory in engine.template_dirs:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(TEMPLATE_SUFFIXES):
+                    yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+
+def warm_up(asgi=False):
+    """
+    Load the application and everything it otherwise loads on first use.
+    Returns (application, {step: seconds}).
+    """
+    timings = {}
+    step = time.monotonic()
+
+    def lap(name):
+        nonlocal step
+        now = time.monotonic()
+        timings[name] = now - step
+        step = now
+
+    if asgi:
+        from django.core.asgi import get_asgi_application
+        application = get_asgi_application()
+    else:
+        from django.core.wsgi import get_wsgi_application
+        application = get_wsgi_application()
+    lap('django')
+
+    from django.db import connections
+    from django.template import engines
+    from django.urls import get_resolver
+
+    get_resolver().reverse_dict # Imports every view module and builds the lookup tables
+    lap('urls')
+
+    for engine in engines.all():
+        for name in template_names(engine):
+            try:
+                engine.get_template(name)
+            except Exception as e: # A broken template should fail its page, not the server
+                logger.warning("Could not compile template %s: %s", name, e)
+    lap('templates')
+
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+    timings['total'] = sum(timings.values())
+    return application, timings
+
+
+def process_local_state():
+    """The settings that would give each worker its own copy of shared state, as messages."""
+    from django.conf import settings
+    problems = []
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        problems.append(f"the cache ({backend}) is per process: set CACHE_BACKEND and CACHE_LOCATION")
+    backend = settings.WAITING_ROOM['BACKEND']
+    if backend in PROCESS_LOCAL_WAITING_ROOMS:
+        problems.append(f"the waiting room ({backend}) is per process: set WAITING_ROOM_BACKEND")
+    backend = settings.RATE_LIMITER['BACKEND']
+    if backend in PROCESS_LOCAL_RATE_LIMITERS:
+        problems.append(f"the rate limiter ({backend}) is per process: set RATE_LIMITER_BACKEND")
+    return problems
+
+
+def open_connections():
+    from django.db import DatabaseError, connections
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as e:
+            logger.warning("Could not connect to database %s yet: %s", alias, e)
+
+
+def warm_worker(worker):
+    # Connections are per thread: open one on each of the worker's request threads
+    pool = getattr(worker, 'tpool', None)
+    if pool is None:
+        open_connections()
+        return
+    threads = worker.cfg.threads
+    barrier = threading.Barrier(threads)
+
+    def task():
+        try:
+            barrier.wait(timeout=10) # Keeps every task on its own thread
+        except threading.BrokenBarrierError:
+            pass
+        open_connections()
+
+    wait([pool.submit(task) for _ in range(threads)])
+
+
+def report_first_request(worker):
+    from django.core.signals import request_finished
+    lock = threading.Lock()
+
+    def first_request(sender, **kwargs):
+        with lock:
+            if not request_finished.disconnect(first_request):
+                return # Another thread got here first
+        logger.info(
+            "Worker %s served its first request %.2fs after server start",
+            worker.pid, time.monotonic() - STARTED,
+        )
+
+    request_finished.connect(first_request, weak=False)
+
+
+def request_first_page(address):
+    # The server's own first request: cold start as a client would see it
+    url = f'http://{address}/'
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        logger.warning("Start-up request to %s failed: %s", url, e)
+        return
+    logger.info("Cold start to first served request: %.2fs (GET / -> %s)", time.monotonic() - STARTED, status)
+
+
+class Server(BaseApplication):
+    def __init__(self, options, asgi=False, check=True):
+        self.options = options
+        self.asgi = asgi
+        self.check = check
+        self.application = None
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set('preload_app', True)
+        self.cfg.set('post_worker_init', self.post_worker_init)
+        self.cfg.set('when_ready', self.when_ready)
+        self.cfg.set('worker_exit', self.worker_exit)
+        self.cfg.set('child_exit', self.child_exit)
+
+    def load(self):
+        # With preload_app this runs once, in the master, before any fork
+        if self.application is None:
+            from django.conf import settings
+            from . import metrics
+            if settings.METRICS_DIR:
+                metrics.start_sharing()
+            self.application, timings = warm_up(self.asgi)
+            logger.info(
+                "Application loaded in %.2fs (%s), %.2fs after start",
+                timings['total'],
+                ', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items() if name != 'total'),
+                time.monotonic() - STARTED,
+            )
+        return self.application
+
+    def post_worker_init(self, worker):
+        if not self.asgi:
+            warm_worker(worker)
+        report_first_request(worker)
+
+    def worker_exit(self, server, worker):
+        from . import metrics
+        metrics.REGISTRY.flush() # The requests since its last flush
+
+    def child_exit(self, server, worker):
+        # In the master, after the worker is gone: keep its counts in the totals
+        from django.conf import settings
+        from . import metrics
+        if settings.METRICS_DIR:
+            metrics.retire_worker(worker.pid)
+
+    def when_ready(self, server):
+        if not self.check:
+            return
+        host, _, port = self.cfg.bind[0].rpartition(':')
+        if host in ('', '0.0.0.0', '[::]'):
+            host = '127.0.0.1'
+        if host.startswith('unix'):
+            return
+        threading.Thread(target=request_first_page, args=(f'{host}:{port}',), daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the ticket booking site under gunicorn.")
+    parser.add_argument('--bind', default=os.getenv('WEB_BIND', '0.0.0.0:8000'))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('WEB_CONCURRENCY', 2 * multiprocessing.cpu_count() + 1)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', '4')),
+                        help="Request threads per WSGI worker.")
+    parser.add_argument('--asgi', action='store_true', help="Serve the async views with uvicorn workers.")
+    parser.add_argument('--timeout', type=int, default=30)
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('WEB_MAX_REQUESTS', '10000')),
+                        help="Recycle a worker after this many requests (0: never).")
+    parser.add_argument('--no-check', action='store_true', help="Skip the start-up request.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ticket_booking_system.settings')
+    if args.asgi:
+        os.environ['ASYNC_VIEWS'] = 'True'
+        os.environ['CONN_MAX_AGE'] = '0'
+    else:
+        os.environ.setdefault('CONN_MAX_AGE', '60')
+
+    if args.workers > 1:
+        # Before the settings are read, so every worker inherits it
+        shared = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        os.environ.setdefault('METRICS_DIR', os.path.join(shared, f'ticketbooking-metrics-{os.getpid()}'))
+        problems = process_local_state()
+        if problems:
+            parser.error(
+                f"{args.workers} workers would not share state; " + '; '.join(problems) + " (or use --workers 1)"
+            )
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'uvicorn_worker.UvicornWorker' if args.asgi else 'gthread',
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'graceful_timeout': args.timeout,
+        'keepalive': 5,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10, # So workers do not all restart at once
+        'accesslog': '-',
+    }
+    if os.path.isdir('/dev/shm'):
+        options['worker_tmp_dir'] = '/dev/shm' # Heartbeat files off the container's disk
+    Server(options, asgi=args.asgi, check=not args.no_check).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -19,6 +20,10 @@ DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
 
 ALLOWED_HOSTS = ['*'] # Use '*' for easy testing with Docker, restrict in production
 
+# Serve the public show pages, booking and booking history with the async
+# views. ticket_booking_system/asgi.py turns this on; WSGI keeps the sync views.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+
 
 # Application definition
 
@@ -36,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ticket_booking_system.metrics.MetricsMiddleware', # First, so it times everything below it
+    'ticket_booking_system.replicas.ReplicaMiddleware', # Picks the database each request reads from
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,13 +56,22 @@ ROOT_URLCONF = 'ticket_booking_system.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'ticket_booking_system.metrics.InstrumentedDjangoTemplates', # DjangoTemplates plus render timing
         'DIRS': [BASE_DIR / 'templates'], # Add the project-level templates directory
-        'APP_DIRS': True, # Look for templates in app subdirectories
         'OPTIONS': {
+            # Templates are parsed once per process, in every environment (Django
+            # only does this by default when DEBUG is off). runserver still picks
+            # up edited templates: its autoreloader resets this cache.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader', # Templates in app subdirectories
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
+                'django.template.context_processors.tz', # Provides TIME_ZONE used by the {% timezone %} blocks
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
@@ -75,6 +91,12 @@ DATABASE_PASSWORD = os.getenv('DATABASE_PASSWORD')
 DATABASE_HOST = os.getenv('DATABASE_HOST')
 DATABASE_PORT = os.getenv('DATABASE_PORT')
 
+# Seconds a worker keeps its database connection between requests (0: one per
+# request). ticket_booking_system/server.py turns this on for WSGI workers.
+CONN_MAX_AGE = int(os.getenv('CONN_MAX_AGE', '0'))
+
+DATABASE_ENGINE = os.getenv('DATABASE_ENGINE', 'mysql') # 'sqlite' for local runs without a MySQL server
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.mysql',
@@ -83,6 +105,8 @@ DATABASES = {
         'PASSWORD': DATABASE_PASSWORD,
         'HOST': DATABASE_HOST,
         'PORT': DATABASE_PORT,
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True, # Replace a dropped persistent connection instead of failing a request
         'OPTIONS': {
             'sql_mode': 'traditional',
             'charset': 'utf8mb4',
@@ -90,6 +114,87 @@ DATABASES = {
     }
 }
 
+if DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': DATABASE_NAME or BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': 20, # Seconds to wait for the write lock under concurrent bookings
+            },
+            # A file, not the in-memory default: the concurrency tests book from
+            # several threads, each with its own connection to the same database
+            'TEST': {
+                'NAME': os.getenv('DATABASE_TEST_NAME') or os.path.join(tempfile.gettempdir(), 'ticketbooking_test.sqlite3'),
+            },
+        }
+    }
+
+# Read replicas (see ticket_booking_system/replicas.py): a comma-separated list
+# of replica hosts for MySQL, or of database files for SQLite. Each becomes a
+# replica_N alias that read-only views (REPLICA_VIEWS) read from. Locally, a
+# SQLite replica can name the primary's own file: a second connection to the
+# same data. Tests read replicas through the primary (TEST MIRROR).
+REPLICA_DATABASES = []
+for number, location in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(',')), start=1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    replica['NAME' if DATABASE_ENGINE == 'sqlite' else 'HOST'] = location.strip()
+    DATABASES[f'replica_{number}'] = replica
+    REPLICA_DATABASES.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['ticket_booking_system.replicas.ReplicaRouter']
+
+# URL names of the views whose GET requests may read from a replica
+REPLICA_VIEWS = [
+    'show_list',
+    'show_detail',
+    'booking_history',
+    'admin_dashboard',
+    'admin_show_list',
+    'admin_show_export',
+    'admin_booking_list',
+    'admin_booking_export',
+]
+# After a write, the client reads from the primary for this long (replication lag headroom)
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '15'))
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv('REPLICA_HEALTH_CHECK_INTERVAL', '5'))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '10'))
+
+
+# Password hashing policy (see accounts/hashers.py). PASSWORD_HASHER hashes new
+# passwords, and rehashes older ones when their users log in; the rest of the
+# list only verifies hashes from earlier policies. PASSWORD_HASH_ITERATIONS sets
+# the PBKDF2 cost: the CPU time of every login, but also of every guess against
+# a stolen hash, so lower it only together with the login rate limits below.
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'accounts.hashers.TunedPBKDF2PasswordHasher')
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '0')) or None # None: Django's default
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [
+    hasher for hasher in [
+        'accounts.hashers.TunedPBKDF2PasswordHasher', # Also verifies Django's default pbkdf2_sha256 hashes
+        'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+        'django.contrib.auth.hashers.Argon2PasswordHasher', # Needs argon2-cffi
+        'django.contrib.auth.hashers.BCryptSHA256PasswordHasher', # Needs bcrypt
+        'django.contrib.auth.hashers.ScryptPasswordHasher',
+    ] if hasher != PASSWORD_HASHER
+]
+
+# Login and registration rate limits (see accounts/ratelimit.py), as (attempts,
+# window in seconds). Attempts over a limit get a 429 before any password is
+# hashed. CacheRateLimiter shares the counts between workers through the cache.
+RATE_LIMITER = {
+    'BACKEND': os.getenv('RATE_LIMITER_BACKEND', 'accounts.ratelimit.CacheRateLimiter'),
+    'OPTIONS': {},
+}
+LOGIN_RATE_LIMITS = {
+    'login_ip': (int(os.getenv('LOGIN_ATTEMPTS_PER_IP', '30')), 60), # Login attempts per client IP
+    'login_username': (int(os.getenv('LOGIN_FAILURES_PER_USERNAME', '5')), 300), # Failed logins per username
+    'register_ip': (int(os.getenv('REGISTRATIONS_PER_IP', '10')), 3600), # Registrations per client IP
+}
+# Request header with the client's address, set by a trusted reverse proxy
+# (e.g. HTTP_X_REAL_IP); empty to use REMOTE_ADDR.
+RATE_LIMIT_IP_HEADER = os.getenv('RATE_LIMIT_IP_HEADER', '')
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,4 +243,69 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom Auth URLs
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/' # Redirect to home page after login
-LOGOUT_REDIRECT_URL = '/' # Redirect to home page after logout
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/' # Redirect to home page after logout
+
+# Seat holds: how long seats picked on a show page stay reserved before the
+# sweep_holds command returns them to the show.
+SEAT_HOLD_TTL_SECONDS = int(os.getenv('SEAT_HOLD_TTL_SECONDS', '300'))
+
+# How long a booking or hold submission's idempotency key replays its first
+# outcome before the purge_idempotency_keys command deletes it.
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_KEY_TTL_SECONDS', '86400'))
+
+# Waiting room backend for shows with the admission queue turned on (see
+# shows/waiting_room.py). The in-memory backend is per process; use
+# SQLiteWaitingRoom to share the queue between workers on one host.
+WAITING_ROOM = {
+    'BACKEND': os.getenv('WAITING_ROOM_BACKEND', 'shows.waiting_room.InMemoryWaitingRoom'),
+    'OPTIONS': {},
+}
+
+# Cache
+# LocMem locally; point CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached in
+# production, e.g. django.core.cache.backends.redis.RedisCache and redis://cache:6379/0
+# (as docker-compose.yml does). LocMem is per process, so the server refuses to
+# start more than one worker with it (see ticket_booking_system/server.py).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Show catalogue cache (see shows/catalogue.py). Catalogue entries are
+# invalidated by version bumps, seat counts by bookings; the timeouts are a
+# safety net only.
+CATALOGUE_CACHE_TIMEOUT = int(os.getenv('CATALOGUE_CACHE_TIMEOUT', '3600'))
+CATALOGUE_SEATS_TIMEOUT = int(os.getenv('CATALOGUE_SEATS_TIMEOUT', '5'))
+
+# Live availability streams (server-sent events, see shows/live.py). Each stream
+# gets at most LIVE_MAX_UPDATES_PER_SECOND batches of seat updates; changes made
+# by other processes are noticed through the shared cache every LIVE_POLL_INTERVAL. Served
+# only with ASYNC_VIEWS (the ASGI server); WSGI answers 501.
+LIVE_MAX_UPDATES_PER_SECOND = float(os.getenv('LIVE_MAX_UPDATES_PER_SECOND', '2'))
+LIVE_POLL_INTERVAL = float(os.getenv('LIVE_POLL_INTERVAL', '1'))
+LIVE_KEEPALIVE_SECONDS = float(os.getenv('LIVE_KEEPALIVE_SECONDS', '15'))
+LIVE_RETRY_MS = int(os.getenv('LIVE_RETRY_MS', '3000'))
+
+# Request metrics (see ticket_booking_system/metrics.py, served at custom-admin/metrics/).
+# A request that runs more SQL queries than its view's budget logs a warning;
+# QUERY_BUDGET_DEFAULT applies to views not listed (unset: no budget).
+QUERY_BUDGETS = {
+    'show_list': 6,
+    'show_detail': 30, # Booking POSTs: seat locks, idempotency key, booking, rollups
+    'show_hold': 20,
+    'hold_detail': 20,
+    'show_cart_add': 8, # Session only; seats are not touched until checkout
+    'cart': 100, # Checkout: a seat update and two rollup bumps per show, up to MAX_CART_LINES shows
+    'show_availability': 4,
+    'show_availability_batch': 4,
+    'booking_history': 6,
+    'booking_confirmation': 4,
+}
+QUERY_BUDGET_DEFAULT = int(os.environ['QUERY_BUDGET_DEFAULT']) if os.getenv('QUERY_BUDGET_DEFAULT') else None
+# Directory where each server worker writes its metrics, so that a scrape of
+# any worker returns the totals of all of them. The server sets one up when it
+# runs several workers; unset, every process serves only its own numbers.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5')) # How far behind other workers' numbers may be